@@ -1,5 +1,6 @@
 import os
 import sys
+import signal
 import socket
 import threading
 import re
@@ -7,7 +8,12 @@ import logging
 import time
 from time import sleep
 import json
+import shlex
 from backend import models
+from backend import metrics
+from backend.media_server import MediaServer
+from backend.prompt_cache import PromptCache, PromptNotFound
+from backend.voice_engine import VoiceStream
 
 # Configure logging
 logging.basicConfig(
@@ -23,6 +29,18 @@ AGI_PORT = int(os.environ.get('AGI_PORT', '4573'))  # Traditional AGI port
 # Voice parameter environment variables
 VOICE_CACHE_TIMEOUT = int(os.environ.get('VOICE_CACHE_TIMEOUT', '300'))  # 5 minutes
 
+# Length of the profile written on SIGUSR2
+AGI_PROFILE_SECONDS = float(os.environ.get('AGI_PROFILE_SECONDS', '10'))
+
+AGI_SESSIONS = metrics.gauge('agi_sessions_active', 'FastAGI connections being handled')
+AGI_SESSIONS_TOTAL = metrics.counter('agi_sessions_total', 'FastAGI connections accepted')
+VOICE_CACHE_LOOKUPS = metrics.counter('voice_cache_lookups_total',
+                                      'Voice parameter lookups by cache result', ('result',))
+VOICE_CACHE_HITS = VOICE_CACHE_LOOKUPS.labels('hit')
+VOICE_CACHE_MISSES = VOICE_CACHE_LOOKUPS.labels('miss')
+metrics.gauge('voice_cache_hit_ratio', 'Share of voice parameter lookups served from cache').set_function(
+    lambda: VOICE_CACHE_HITS.value / ((VOICE_CACHE_HITS.value + VOICE_CACHE_MISSES.value) or 1))
+
 
 class VoiceProcessor:
     """Class to handle voice processing and transformation"""
@@ -35,9 +53,11 @@ class VoiceProcessor:
         """Get voice parameters from cache or database"""
         # Check if voice is in cache and not expired
         if voice_id in self.voice_cache:
+            VOICE_CACHE_HITS.inc()
             return self.voice_cache[voice_id]
         
         # If not in cache, fetch from database
+        VOICE_CACHE_MISSES.inc()
         voice = models.get_voice_by_id(voice_id)
         if voice:
             # Cache the voice parameters
@@ -62,44 +82,59 @@ class VoiceProcessor:
             if key in self.voice_cache_times:
                 del self.voice_cache_times[key]
     
-    def transform_voice(self, voice_id, audio_data):
-        """Apply voice transformation to the audio data
-        
-        In a real implementation, this would use audio processing libraries
-        to transform the voice according to the voice parameters.
+    def open_stream(self, voice_id, sample_rate=8000, aligned=False, pitch_mode=None):
+        """Open a stateful engine stream for transforming audio block by block
         
         Args:
             voice_id (str): ID of the voice to use
-            audio_data (bytes): Raw audio data to transform
+            sample_rate (int): Sample rate of the 16-bit mono PCM to be pushed
+            aligned (bool): Compensate the engine latency (offline rendering)
+            pitch_mode (str): Pitch algorithm ('psola' or 'vocoder'); defaults
+                to the voice's setting, then to the mode suited to aligned
             
         Returns:
-            bytes: Transformed audio data
+            VoiceStream: Stream to push PCM blocks through
         """
         params = self.get_voice_parameters(voice_id)
+        return VoiceStream(params, sample_rate=sample_rate, aligned=aligned, pitch_mode=pitch_mode)
+    
+    def transform_voice(self, voice_id, audio_data, sample_rate=8000):
+        """Apply voice transformation to the audio data
         
-        # This is a placeholder. In a real implementation, we would:
-        # 1. Convert the audio data to the appropriate format
-        # 2. Apply the voice transformation (pitch shift, formant shift, effects)
-        # 3. Return the transformed audio data
-        
-        # For this demo, we're just returning the original audio
-        # In a real AGI implementation, audio processing would be done
-        # by an external module or service
+        Args:
+            voice_id (str): ID of the voice to use
+            audio_data (bytes): Raw 16-bit mono PCM audio to transform
+            sample_rate (int): Sample rate of audio_data
+            
+        Returns:
+            bytes: Transformed audio data, the same length as the input
+        """
+        stream = self.open_stream(voice_id, sample_rate, aligned=True)
+        transformed = stream.process(audio_data) + stream.flush()
         
-        logger.info(f"Applied voice transformation with parameters: {params}")
-        return audio_data
+        logger.info(f"Applied voice transformation with parameters: {stream.params}")
+        return transformed
 
 
 class AGIServer:
-    """FastAGI server for voice transformation in Asterisk"""
+    """FastAGI server for voice transformation in Asterisk
+
+    Args:
+        host (str): Address to listen on
+        port (int): Port to listen on
+        media_server (MediaServer): AudioSocket server the calls' voices are
+            bound in, optional
+    """
     
-    def __init__(self, host=AGI_HOST, port=AGI_PORT):
+    def __init__(self, host=AGI_HOST, port=AGI_PORT, media_server=None):
         self.host = host
         self.port = port
         self.socket = None
         self.running = False
         self.clients = []
         self.voice_processor = VoiceProcessor()
+        self.prompt_cache = PromptCache()
+        self.media_server = media_server
     
     def start(self):
         """Start the AGI server"""
@@ -178,11 +213,16 @@ class AGIServer:
     
     def handle_client(self, client_socket, address):
         """Handle a client connection"""
+        # Read line-buffered so the environment block and commands are parsed
+        # correctly no matter how the peer's writes are split into segments
+        reader = client_socket.makefile('r', encoding='utf-8', newline='\n')
+        AGI_SESSIONS_TOTAL.inc()
+        AGI_SESSIONS.inc()
         try:
             # Read AGI environment variables
             env = {}
             while True:
-                line = client_socket.recv(1024).decode().strip()
+                line = reader.readline().strip()
                 if not line or line == '':
                     break
                 logger.debug(f"Received: {line}")
@@ -196,14 +236,23 @@ class AGIServer:
             # Extract voice parameters from environment
             voice_id = env.get('agi_arg_1', '')
             
+            # AGI(agi://host,<voice>,<uuid>) selects the voice of the
+            # AudioSocket call started with the same UUID
+            call_uuid = env.get('agi_arg_2', '')
+            if call_uuid and voice_id:
+                self._bind_media(call_uuid, voice_id)
+            
             # Send AGI response
             self._send_response(client_socket, "200 status=ready")
             
             # Process AGI commands
             while True:
-                command = client_socket.recv(1024).decode().strip()
-                if not command:
+                raw_command = reader.readline()
+                if not raw_command:
                     break
+                command = raw_command.strip()
+                if not command:
+                    continue
                 
                 logger.debug(f"Command: {command}")
                 
@@ -213,16 +262,17 @@ class AGIServer:
                     if len(args) >= 1:
                         voice_id = args[0]
                     
-                    # Apply voice transformation
-                    # In a real implementation, this would be where we'd hook into
-                    # the audio stream for processing
-                    response = "200 result=1"
+                    # With a second argument, transform the AudioSocket call
+                    # with that UUID in the selected voice
+                    if len(args) >= 2 and not self._bind_media(args[1], voice_id):
+                        response = "200 result=-1"
+                    else:
+                        response = "200 result=1"
                     self._send_response(client_socket, response)
                 
                 elif command.startswith("STREAM FILE"):
-                    # Handle streaming file with voice transformation
-                    # This would be where we'd transform the audio in a real implementation
-                    response = "200 result=0"
+                    # Serve the prompt pre-rendered in the caller's voice
+                    response = self._stream_file(command, voice_id)
                     self._send_response(client_socket, response)
                 
                 elif command.startswith("HANGUP"):
@@ -251,11 +301,73 @@ class AGIServer:
         except Exception as e:
             logger.error(f"Error handling AGI client: {e}")
         finally:
+            AGI_SESSIONS.dec()
             try:
+                reader.close()
                 client_socket.close()
             except:
                 pass
     
+    def _bind_media(self, call_uuid, voice_id):
+        """Bind a voice to an AudioSocket call; returns False if it cannot be"""
+        if self.media_server is None:
+            logger.warning(f"No media server to transform call {call_uuid}")
+            return False
+        try:
+            self.media_server.bind(call_uuid, voice_id)
+        except ValueError:
+            logger.warning(f"Not a call UUID: {call_uuid!r}")
+            return False
+        return True
+
+    def _stream_file(self, command, voice_id):
+        """Resolve STREAM FILE to a cached render of the prompt in the selected voice
+
+        Renders happen once per (prompt, voice parameters, codec) and are then
+        served from the prompt cache, so playback never runs the voice engine.
+        The response names the render to play in place of the original
+        prompt, as an absolute path without extension the way STREAM FILE and
+        Playback() take it: 200 result=0 endpos=<samples> (<path>)
+        """
+        try:
+            args = shlex.split(command)
+        except ValueError:
+            args = command.split()
+        if len(args) < 3 or not voice_id:
+            return "200 result=0"
+
+        prompt = args[2]
+        for attempt in range(2):
+            path = None
+            try:
+                params = self.voice_processor.get_voice_parameters(voice_id)
+                path = self.prompt_cache.get(
+                    prompt, params,
+                    lambda pcm, sample_rate: self.voice_processor.transform_voice(voice_id, pcm, sample_rate)
+                )
+                mapped, samples = self.prompt_cache.read_samples(path)
+                try:
+                    endpos = len(samples) // 2
+                finally:
+                    samples.release()
+                    if mapped is not None:
+                        mapped.close()
+                break
+            except OSError as e:
+                # Evicted by another process between lookup and read: render again
+                if path is not None:
+                    self.prompt_cache.discard(path)
+                if attempt or path is None:
+                    logger.warning(f"Cannot serve transformed prompt {prompt}: {e}")
+                    return "200 result=0"
+            except (PromptNotFound, ValueError) as e:
+                logger.warning(f"Cannot serve transformed prompt {prompt}: {e}")
+                return "200 result=0"
+
+        playback = os.path.splitext(os.path.abspath(path))[0]
+        logger.debug(f"Serving {prompt} for voice {voice_id} from {path}")
+        return f"200 result=0 endpos={endpos} ({playback})"
+
     def _send_response(self, client_socket, response):
         """Send a response to the AGI client"""
         logger.debug(f"Sending response: {response}")
@@ -263,8 +375,18 @@ class AGIServer:
 
 
 def run_agi_server():
-    """Run the AGI server"""
+    """Run the AGI server
+
+    The AudioSocket media server runs alongside it, on MEDIA_PORT. When
+    started from the main thread, SIGUSR2 writes a profile of the process
+    (AGI_PROFILE_SECONDS long) under PROFILE_DIR.
+    """
+    from backend import profiler
+
+    profiler.install_signal_handler(signal.SIGUSR2, AGI_PROFILE_SECONDS, prefix='agi')
     server = AGIServer()
+    server.media_server = MediaServer(server.voice_processor.get_voice_parameters)
+    threading.Thread(target=server.media_server.start, name='media-server', daemon=True).start()
     server.start()
 
 
@@ -0,0 +1,129 @@
+"""
+Connection health tracking for the Asterisk Manager Interface.
+
+A circuit breaker shared by every PhoneCallManager in the process. While the
+PBX is reachable the breaker is 'closed' and connections go through. After
+AMI_BREAKER_FAILURE_THRESHOLD consecutive failures it 'opens' and connection
+attempts fail immediately until a jittered, exponentially growing backoff
+expires. The breaker then goes 'half-open' and lets exactly one probe through:
+success closes it again, failure re-opens it with a longer backoff.
+"""
+import os
+import time
+import random
+import threading
+
+AMI_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('AMI_BREAKER_FAILURE_THRESHOLD', '3'))
+AMI_BREAKER_BASE_DELAY = float(os.environ.get('AMI_BREAKER_BASE_DELAY', '1.0'))  # seconds
+AMI_BREAKER_MAX_DELAY = float(os.environ.get('AMI_BREAKER_MAX_DELAY', '60.0'))  # seconds
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class ConnectionHealth:
+    """Circuit breaker with jittered exponential backoff
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the breaker
+        base_delay (float): Backoff after the breaker first opens, in seconds
+        max_delay (float): Upper bound on the backoff, in seconds
+        probe_timeout (float): Seconds after which a half-open probe that never
+            reported back is considered lost and another probe is allowed
+    """
+
+    def __init__(self, failure_threshold=AMI_BREAKER_FAILURE_THRESHOLD,
+                 base_delay=AMI_BREAKER_BASE_DELAY, max_delay=AMI_BREAKER_MAX_DELAY,
+                 probe_timeout=30.0, rng=None):
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.probe_timeout = probe_timeout
+        self._random = rng or random.Random()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Return to the closed state and forget all history"""
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.open_count = 0  # Times opened since the last success; drives the backoff
+            self.retry_at = 0.0
+            self._probe_started = None
+            self.last_failure = None
+            self.last_success = None
+            self.last_error = None
+
+    def after_fork(self):
+        """Start clean in a forked worker; the parent's lock and history are not ours"""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given attempt number"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** max(0, attempt)))
+        return self._random.uniform(ceiling / 2, ceiling)
+
+    def allow_request(self):
+        """Return True if a connection attempt may be made now"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if now < self.retry_at:
+                    return False
+                self.state = HALF_OPEN
+                self._probe_started = now
+                return True
+            # Half-open: only one probe at a time
+            if self._probe_started is not None and now - self._probe_started < self.probe_timeout:
+                return False
+            self._probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.open_count = 0
+            self._probe_started = None
+            self.last_success = time.time()
+
+    def record_failure(self, error=None):
+        now = time.monotonic()
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_failure = time.time()
+            self.last_error = str(error) if error else None
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = OPEN
+                self.retry_at = now + self.backoff(self.open_count)
+                self.open_count += 1
+                self._probe_started = None
+
+    def time_until_retry(self):
+        """Seconds until an open breaker lets the next probe through"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.retry_at - time.monotonic())
+
+    def snapshot(self):
+        """Breaker state for status endpoints"""
+        retry_in = self.time_until_retry()
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'retry_in': round(retry_in, 2),
+                'last_failure': self.last_failure,
+                'last_success': self.last_success,
+                'last_error': self.last_error,
+            }
+
+
+# Shared by every PhoneCallManager in the process
+ami_health = ConnectionHealth()
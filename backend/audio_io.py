@@ -0,0 +1,147 @@
+"""
+Streaming helpers for WAV and raw PCM audio.
+
+These read and write audio incrementally so large files can be transformed
+block by block without ever holding the whole file in memory. Only 16-bit
+PCM is supported, which is what the voice engine consumes.
+"""
+import mmap
+import struct
+
+# RIFF/data sizes written when the total length is not known up front;
+# readers that honour them treat the stream as "until EOF".
+STREAMING_SIZE = 0xFFFFFFFF
+
+
+class AudioFormatError(ValueError):
+    """Raised for audio the engine cannot consume"""
+
+
+def _read_exact(stream, size):
+    """Read exactly size bytes from a possibly short-reading stream"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_wav_header(stream, prefix=b''):
+    """Parse a WAV header from a forward-only stream
+
+    Reads up to the start of the 'data' chunk and leaves the stream there.
+
+    Args:
+        stream: File-like object supporting read()
+        prefix (bytes): Bytes already consumed from the stream (e.g. a sniffed 'RIFF')
+
+    Returns:
+        dict: sample_rate, channels, sample_width and data_size (None if streaming)
+    """
+    header = prefix + _read_exact(stream, 12 - len(prefix))
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise AudioFormatError('Not a RIFF/WAVE file')
+
+    fmt = None
+    while True:
+        chunk_header = _read_exact(stream, 8)
+        if len(chunk_header) < 8:
+            raise AudioFormatError('WAV file has no data chunk')
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+
+        if chunk_id == b'data':
+            if fmt is None:
+                raise AudioFormatError('WAV data chunk before fmt chunk')
+            fmt['data_size'] = None if chunk_size in (0, STREAMING_SIZE) else chunk_size
+            return fmt
+
+        body = _read_exact(stream, chunk_size + (chunk_size & 1))
+        if chunk_id == b'fmt ':
+            if len(body) < 16:
+                raise AudioFormatError('Truncated WAV fmt chunk')
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+            # 0xFFFE is WAVE_FORMAT_EXTENSIBLE, used by some tools for plain PCM
+            if audio_format not in (1, 0xFFFE) or bits != 16:
+                raise AudioFormatError('Only 16-bit PCM WAV is supported')
+            fmt = {'sample_rate': sample_rate, 'channels': channels, 'sample_width': 2}
+
+
+def wav_header(sample_rate, channels=1, data_size=None):
+    """Build a canonical 44-byte PCM WAV header
+
+    Args:
+        data_size (int): Size of the data chunk in bytes, or None when
+            streaming output of unknown length
+    """
+    block_align = channels * 2
+    if data_size is None:
+        riff_size = data_chunk = STREAMING_SIZE
+    else:
+        riff_size, data_chunk = 36 + data_size, data_size
+    return (struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE')
+            + struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, channels, sample_rate,
+                          sample_rate * block_align, block_align, 16)
+            + struct.pack('<4sI', b'data', data_chunk))
+
+
+def iter_blocks(stream, block_bytes, limit=None):
+    """Yield fixed-size blocks from a stream; the last block may be shorter
+
+    Args:
+        stream: File-like object supporting read()
+        block_bytes (int): Size of each yielded block
+        limit (int): Stop after this many bytes (e.g. the WAV data size)
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = block_bytes if remaining is None else min(block_bytes, remaining)
+        block = _read_exact(stream, size)
+        if not block:
+            return
+        if remaining is not None:
+            remaining -= len(block)
+        yield block
+        if len(block) < size:
+            return
+
+
+class _ViewReader:
+    """Minimal forward-only reader over a buffer, for parsing headers in place"""
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self.offset = 0
+
+    def read(self, size):
+        chunk = self._view[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return bytes(chunk)
+
+    def release(self):
+        self._view.release()
+
+
+def map_wav(path):
+    """Memory-map a 16-bit PCM WAV file
+
+    Returns:
+        tuple: (mmap, format dict, memoryview of the sample data). The view
+        references the mapping directly; release it before closing the mmap.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    reader = _ViewReader(mapped)
+    try:
+        fmt = read_wav_header(reader)
+    except AudioFormatError:
+        reader.release()
+        mapped.close()
+        raise
+    start = reader.offset
+    reader.release()
+    end = len(mapped) if fmt['data_size'] is None else min(len(mapped), start + fmt['data_size'])
+    return mapped, fmt, memoryview(mapped)[start:end]
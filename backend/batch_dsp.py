@@ -0,0 +1,380 @@
+"""
+Batched voice DSP across concurrent calls.
+
+Calls that use the same voice plan (same parameters, rate and pitch mode)
+share one engine chain built with one channel per call. The media layer
+submits each call's 20 ms frames into that call's row ("slot") of a stacked
+input array. Once per tick the scheduler runs each chain a single time over
+the whole 2-D batch and scatters the rows back to the calls' output
+buffers. Interpreter overhead is therefore paid per voice plan per tick
+rather than per call per frame.
+
+Slots live in banks; every slot is processed each tick whether or not a
+call holds it, so a plan's banks double in size as it grows (4, 8, 16, ...
+up to BATCH_DSP_SLOTS) to keep idle slots few. A slot's stage state is reset
+when a new call takes it over. Plans with a
+stage that mixes channels (PSOLA pitch marks) get single-slot banks, so
+they still work, unbatched.
+
+Calls whose frames cross a network (a remote media worker) can be opened
+with a jitter buffer: they submit timestamped frames in any order and the
+tick pulls one frame per call from the buffer, with concealment for gaps.
+"""
+import os
+import time
+import logging
+import threading
+
+import numpy as np
+
+from backend.audio_buffer import RingBuffer
+from backend.jitter_buffer import JitterBuffer
+from backend.media_stats import media_stats, default_worker_name
+from backend.pitch import PITCH_MODES
+from backend.prompt_cache import voice_parameters_hash
+from backend.voice_engine import build_stages
+
+logger = logging.getLogger('BatchDSP')
+
+BATCH_DSP_SLOTS = int(os.environ.get('BATCH_DSP_SLOTS', '64'))
+BATCH_DSP_FRAME_MS = int(os.environ.get('BATCH_DSP_FRAME_MS', '20'))
+# Batched plans run the phase vocoder: PSOLA's marks cannot be shared by a batch
+BATCH_DSP_PITCH_MODE = os.environ.get('BATCH_DSP_PITCH_MODE', 'vocoder')
+# Slots in a plan's first bank; each further bank doubles, up to BATCH_DSP_SLOTS
+FIRST_BANK_SLOTS = 4
+# Output buffered per call before the oldest audio is dropped
+OUTPUT_BUFFER_FRAMES = 10
+
+
+class BatchSession:
+    """One call's handle on its slot in a batch
+
+    The media layer calls submit() with each received frame and read_into()
+    to collect transformed audio for sending. `stats` carries the session's
+    latency and jitter instrumentation, `jitter` its JitterBuffer if any.
+    """
+
+    __slots__ = ('session_id', 'plan', 'bank', 'slot', 'output', 'stats', 'jitter', 'closed')
+
+    def __init__(self, session_id, plan, bank, slot, output_capacity, stats, jitter=None):
+        self.session_id = session_id
+        self.plan = plan
+        self.bank = bank
+        self.slot = slot
+        self.output = RingBuffer(output_capacity)
+        self.stats = stats
+        self.jitter = jitter
+        self.closed = False
+
+    def submit(self, samples, timestamp=None):
+        """Queue one frame of float32 samples for the next tick
+
+        Args:
+            samples (np.ndarray): One frame
+            timestamp (int): Frame timestamp in samples; required with a
+                jitter buffer, which orders and paces frames by it
+
+        Returns:
+            bool: False if the frame was dropped (a frame for this tick was
+            already queued, or the jitter buffer found it late or duplicated)
+        """
+        # Unlocked fast path only; the bank re-checks slot ownership under its lock
+        if self.closed:
+            return False
+        if self.jitter is not None:
+            if timestamp is None:
+                raise ValueError("Frames for a jitter-buffered session need a timestamp")
+            return self.jitter.put(timestamp, samples)
+        return self.bank.submit(self, samples)
+
+    def read_into(self, out):
+        """Move transformed samples into out; returns the number read"""
+        with self.bank.lock:
+            count = self.output.read_into(out)
+        self.stats.frame_read(time.monotonic(), count < len(out))
+        return count
+
+
+class _Bank:
+    """A chain with one channel per slot and the stacked input for a tick"""
+
+    def __init__(self, params, sample_rate, pitch_mode, slots, frame_samples):
+        self.stages = build_stages(params, sample_rate, pitch_mode, channels=slots)
+        self.slots = slots
+        self.frame_samples = frame_samples
+        self.sample_rate = sample_rate
+        self.algorithmic_ms = sum(stage.latency for stage in self.stages) * 1000.0 / sample_rate
+        self.input = np.zeros((slots, frame_samples), dtype=np.float32)
+        self.has_frame = np.zeros(slots, dtype=bool)
+        self.arrival = [0.0] * slots
+        self.sessions = [None] * slots
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def attach(self, session):
+        for stage in self.stages:
+            stage.reset_channel(session.slot)
+        self.input[session.slot] = 0.0
+        self.has_frame[session.slot] = False
+        self.sessions[session.slot] = session
+        self.active += 1
+
+    def detach(self, slot):
+        self.sessions[slot] = None
+        self.has_frame[slot] = False
+        self.active -= 1
+
+    def free_slot(self):
+        for slot, session in enumerate(self.sessions):
+            if session is None:
+                return slot
+        return None
+
+    def submit(self, session, samples):
+        slot = session.slot
+        now = time.monotonic()
+        with self.lock:
+            # Closed concurrently, and the slot possibly handed to another call
+            if self.sessions[slot] is not session:
+                return False
+            session.stats.frame_arrived(now)
+            if self.has_frame[slot]:
+                session.stats.count('duplicate_frames')
+                return False
+            self.input[slot, :len(samples)] = samples
+            self.has_frame[slot] = True
+            self.arrival[slot] = now
+        return True
+
+    def process(self):
+        """Run the chain once over every slot and scatter the results"""
+        with self.lock:
+            started = time.monotonic()
+            for slot, session in enumerate(self.sessions):
+                if session is not None and session.jitter is not None:
+                    frame, arrival = session.jitter.get(started)
+                    self.input[slot] = frame
+                    # Concealment counts in the jitter buffer, not as a late frame
+                    self.has_frame[slot] = arrival is not None
+                    if arrival is not None:
+                        self.arrival[slot] = arrival
+            block = self.input
+            for stage in self.stages:
+                block = stage.process(block)
+            dsp_ms = (time.monotonic() - started) * 1000.0
+            for slot, session in enumerate(self.sessions):
+                if session is None:
+                    continue
+                output = session.output
+                if self.has_frame[slot]:
+                    session.stats.frame_processed(
+                        (started - self.arrival[slot]) * 1000.0, dsp_ms, self.algorithmic_ms,
+                        output.size * 1000.0 / self.sample_rate)
+                elif session.jitter is None:
+                    session.stats.count('late_frames')
+                if output.write(block[slot]) < block.shape[1]:
+                    # Nobody is reading fast enough; keep the newest audio
+                    session.stats.count('overflow_frames')
+                    output.clear()
+                    output.write(block[slot])
+            # Silence for calls that miss the next tick
+            self.input.fill(0.0)
+            self.has_frame.fill(False)
+
+
+class _Plan:
+    __slots__ = ('key', 'params', 'pitch_mode', 'banks', 'bank_slots')
+
+    def __init__(self, key, params, pitch_mode, bank_slots):
+        self.key = key
+        self.params = params
+        self.pitch_mode = pitch_mode
+        self.banks = []
+        self.bank_slots = bank_slots
+
+
+class BatchScheduler:
+    """Groups calls by voice plan and runs each plan once per tick
+
+    Args:
+        sample_rate (int): Sample rate of every call handled by this scheduler
+        frame_ms (int): Tick length; each call submits one frame per tick
+        slots (int): Largest bank size
+        pitch_mode (str): Pitch algorithm for voices that do not choose one
+        worker (str): Name sessions are aggregated under in media stats
+        stats (MediaStats): Instrumentation registry
+    """
+
+    def __init__(self, sample_rate=8000, frame_ms=BATCH_DSP_FRAME_MS, slots=BATCH_DSP_SLOTS,
+                 pitch_mode=BATCH_DSP_PITCH_MODE, worker=None, stats=media_stats):
+        self.worker = worker or default_worker_name()
+        self.media_stats = stats
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.slots = slots
+        self.pitch_mode = pitch_mode
+        self._plans = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self.ticks = 0
+        self.late_ticks = 0
+
+    def _plan_for(self, params):
+        key = voice_parameters_hash(params)
+        plan = self._plans.get(key)
+        if plan is None:
+            pitch_mode = params.get('pitch_mode')
+            if pitch_mode not in PITCH_MODES:
+                pitch_mode = self.pitch_mode
+            probe = build_stages(params, self.sample_rate, pitch_mode)
+            bank_slots = self.slots if all(stage.batchable for stage in probe) else 1
+            plan = self._plans[key] = _Plan(key, params, pitch_mode, bank_slots)
+        return plan
+
+    def open(self, session_id, params, voice_id=None, jitter_buffer=False):
+        """Give a call a slot in the bank for its voice plan
+
+        Args:
+            session_id: Call or media session ID
+            params (dict): Voice parameters
+            voice_id: Voice the stats are aggregated under
+            jitter_buffer (bool): Put an adaptive jitter buffer in front of
+                the call's slot
+
+        Returns:
+            BatchSession: Handle the media layer submits frames through
+        """
+        with self._lock:
+            plan = self._plan_for(params or {})
+            bank = next((b for b in plan.banks if b.active < b.slots), None)
+            if bank is None:
+                slots = min(plan.bank_slots, FIRST_BANK_SLOTS << len(plan.banks))
+                bank = _Bank(plan.params, self.sample_rate, plan.pitch_mode,
+                             slots, self.frame_samples)
+                plan.banks.append(bank)
+            stats = self.media_stats.open_session(session_id, voice_id, self.worker, self.frame_ms)
+            jitter = JitterBuffer(self.frame_samples, self.sample_rate, stats) if jitter_buffer else None
+            session = BatchSession(session_id, plan, bank, bank.free_slot(),
+                                   self.frame_samples * OUTPUT_BUFFER_FRAMES, stats, jitter)
+            with bank.lock:
+                bank.attach(session)
+        return session
+
+    def close(self, session):
+        """Release a call's slot; an emptied bank is dropped"""
+        with self._lock:
+            if session.closed:
+                return
+            session.closed = True
+            self.media_stats.close_session(session.stats)
+            bank = session.bank
+            with bank.lock:
+                bank.detach(session.slot)
+            if not bank.active:
+                session.plan.banks.remove(bank)
+                if not session.plan.banks:
+                    self._plans.pop(session.plan.key, None)
+
+    def tick(self):
+        """Process one frame for every open call
+
+        Returns:
+            int: Number of banks processed (vectorized chain runs)
+        """
+        with self._lock:
+            banks = [bank for plan in self._plans.values() for bank in plan.banks]
+        for bank in banks:
+            bank.process()
+        self.ticks += 1
+        return len(banks)
+
+    def start(self):
+        """Tick on a background thread every frame_ms"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='batch-dsp', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        interval = self.frame_ms / 1000.0
+        deadline = time.monotonic()
+        while self._running:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Batch DSP tick failed: {e}")
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Overran the frame budget; re-anchor rather than burst to catch up
+                self.late_ticks += 1
+                deadline = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            plans = list(self._plans.values())
+        return {
+            'plans': len(plans),
+            'banks': sum(len(p.banks) for p in plans),
+            'sessions': sum(b.active for p in plans for b in p.banks),
+            'ticks': self.ticks,
+            'late_ticks': self.late_ticks,
+        }
+
+
+def _benchmark(channels=(16, 64, 256), seconds=2.0, sample_rate=8000):
+    """Channels per core: batched ticks against a per-channel engine loop"""
+    params = {'pitch': -3, 'formant': -20, 'effect': 'reverb'}
+    frame = sample_rate * BATCH_DSP_FRAME_MS // 1000
+    ticks = int(seconds * 1000 / BATCH_DSP_FRAME_MS)
+    rng = np.random.default_rng(0)
+    results = []
+    for count in channels:
+        frames = (rng.standard_normal((count, frame)) * 0.1).astype(np.float32)
+        out = np.empty(frame * OUTPUT_BUFFER_FRAMES, dtype=np.float32)
+
+        scheduler = BatchScheduler(sample_rate)
+        sessions = [scheduler.open(i, params) for i in range(count)]
+        started = time.process_time()
+        for _ in range(ticks):
+            for i, session in enumerate(sessions):
+                session.submit(frames[i])
+            scheduler.tick()
+            for session in sessions:
+                session.read_into(out)
+        batched = (time.process_time() - started) / ticks
+
+        per_channel = {}
+        for mode in ('vocoder', 'psola'):
+            chains = [build_stages(params, sample_rate, mode) for _ in range(count)]
+            started = time.process_time()
+            for _ in range(ticks):
+                for i, chain in enumerate(chains):
+                    block = frames[i:i + 1]
+                    for stage in chain:
+                        block = stage.process(block)
+            per_channel[mode] = (time.process_time() - started) / ticks
+
+        budget = BATCH_DSP_FRAME_MS / 1000.0
+        results.append((count, count * budget / batched,
+                        count * budget / per_channel['vocoder'],
+                        count * budget / per_channel['psola']))
+    return results
+
+
+if __name__ == '__main__':
+    print("voice plan: pitch -3, formant -20, reverb; 8 kHz, 20 ms frames")
+    for count, batched, loop_vocoder, loop_psola in _benchmark():
+        print(f"{count:4d} calls: batched {batched:6.0f} channels/core, "
+              f"per-channel loop {loop_vocoder:5.0f} (vocoder) / {loop_psola:5.0f} (psola)")
@@ -0,0 +1,201 @@
+"""
+Batch re-voicing of large audio corpora (IVR prompts, voicemail greetings).
+
+Files are spread over a ProcessPoolExecutor running the voice engine. Each
+input WAV is memory-mapped and pushed through a VoiceStream block by block.
+Completed outputs are appended to a manifest in the output directory, so an
+interrupted job picks up where it left off when it is run again.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from backend.audio_io import AudioFormatError, map_wav, wav_header
+
+logger = logging.getLogger('BatchRender')
+
+MANIFEST_NAME = '.batch_manifest.jsonl'
+BLOCK_SAMPLES = 16384
+
+
+def params_hash(params):
+    payload = json.dumps(params or {}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def discover_jobs(source, output_dir):
+    """List (input, output) pairs from a directory or a manifest file
+
+    A manifest is a text file with one input path per line, or JSON lines
+    with 'input' and optional 'output' keys. Relative outputs are placed
+    under output_dir; by default an input keeps its path relative to the
+    manifest.
+
+    Raises:
+        ValueError: If two inputs map to the same output
+    """
+    jobs = []
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith('.wav'):
+                    path = os.path.join(root, name)
+                    jobs.append((path, os.path.join(output_dir, os.path.relpath(path, source))))
+        return jobs
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entry = json.loads(line) if line.startswith('{') else {'input': line}
+            path = entry['input']
+            if not os.path.isabs(path):
+                path = os.path.join(base, path)
+            output = entry.get('output') or _default_output(path, base)
+            jobs.append((path, os.path.join(output_dir, output)))
+
+    # Two inputs writing one output would overwrite each other and both be
+    # marked done in the resume manifest
+    seen = {}
+    for path, output in jobs:
+        key = os.path.normpath(output)
+        if key in seen:
+            raise ValueError(f"{seen[key]} and {path} would both be written to {output}; "
+                             f"give one of them an explicit output")
+        seen[key] = path
+    return jobs
+
+
+def _default_output(path, base):
+    """Path of a manifest input relative to the manifest, or its file name if outside"""
+    relative = os.path.relpath(os.path.normpath(path), base)
+    if relative.startswith(os.pardir + os.sep) or relative == os.pardir:
+        return os.path.basename(path)
+    return relative
+
+
+def load_completed(manifest_path, voice_hash):
+    """Inputs already rendered with these voice parameters"""
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Torn last line from an interrupted run
+            if entry.get('params_hash') == voice_hash and os.path.exists(entry.get('output', '')):
+                completed.add(entry['input'])
+    return completed
+
+
+def render_file(input_path, output_path, params):
+    """Render one file; runs inside a worker process
+
+    Returns:
+        dict: Manifest entry including timing for progress reporting
+    """
+    from backend.voice_engine import VoiceStream
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    mapped, fmt, data = map_wav(input_path)
+    try:
+        if fmt['channels'] != 1:
+            raise AudioFormatError(f"{input_path}: only mono audio is supported")
+        sample_rate = fmt['sample_rate']
+        samples = len(data) // 2
+        stream = VoiceStream(params, sample_rate=sample_rate, aligned=True)
+
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as out:
+            out.write(wav_header(sample_rate, data_size=samples * 2))
+            step = BLOCK_SAMPLES * 2
+            for offset in range(0, samples * 2, step):
+                out.write(stream.process(data[offset:offset + step]))
+            out.write(stream.flush())
+        os.replace(tmp_path, output_path)
+    finally:
+        data.release()
+        mapped.close()
+
+    return {
+        'input': input_path,
+        'output': output_path,
+        'audio_seconds': round(samples / sample_rate, 3),
+        'cpu_seconds': round(time.process_time() - cpu_started, 4),
+        'wall_seconds': round(time.perf_counter() - started, 4),
+        'worker': os.getpid(),
+    }
+
+
+class _WorkerProgress:
+    __slots__ = ('files', 'audio_seconds', 'cpu_seconds', 'started')
+
+    def __init__(self, started):
+        self.files = 0
+        self.audio_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.started = started
+
+
+def run_batch(source, output_dir, params, workers=None, out=sys.stdout):
+    """Render every file from source into output_dir with the given voice parameters
+
+    Returns:
+        dict: Totals for the run (rendered, skipped, failed)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    voice_hash = params_hash(params)
+
+    jobs = discover_jobs(source, output_dir)
+    completed = load_completed(manifest_path, voice_hash)
+    pending = [(i, o) for i, o in jobs if i not in completed]
+    print(f"{len(jobs)} files, {len(jobs) - len(pending)} already rendered, "
+          f"{len(pending)} to go", file=out)
+
+    progress = {}
+    failed = 0
+    started = time.perf_counter()
+    with open(manifest_path, 'a') as manifest, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_file, i, o, params): i for i, o in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                entry = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"FAILED {futures[future]}: {e}", file=out)
+                continue
+
+            entry['params_hash'] = voice_hash
+            manifest.write(json.dumps(entry) + '\n')
+            manifest.flush()
+
+            worker = progress.setdefault(entry['worker'], _WorkerProgress(started))
+            worker.files += 1
+            worker.audio_seconds += entry['audio_seconds']
+            worker.cpu_seconds += entry['cpu_seconds']
+            elapsed = time.perf_counter() - worker.started
+            rtf = worker.cpu_seconds / worker.audio_seconds if worker.audio_seconds else 0.0
+            print(f"[worker {entry['worker']}] {worker.files} files, "
+                  f"{worker.files / elapsed:.2f} files/s, RTF {rtf:.4f} "
+                  f"| {done}/{len(pending)} {os.path.basename(entry['output'])}", file=out)
+
+    elapsed = time.perf_counter() - started
+    rendered = sum(w.files for w in progress.values())
+    audio = sum(w.audio_seconds for w in progress.values())
+    cpu = sum(w.cpu_seconds for w in progress.values())
+    print(f"Rendered {rendered} files ({audio:.1f}s of audio) in {elapsed:.1f}s: "
+          f"{rendered / elapsed if elapsed else 0:.2f} files/s, "
+          f"RTF {cpu / audio if audio else 0:.4f}, {failed} failed", file=out)
+    return {'rendered': rendered, 'skipped': len(jobs) - len(pending), 'failed': failed}
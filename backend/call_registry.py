@@ -0,0 +1,312 @@
+"""
+Bounded registry of calls placed through PhoneCallManager.
+
+Active calls are kept until they finish; finished calls stay queryable for a
+TTL and are then evicted, so a long-running API process no longer grows with
+every call placed. Calls never reported as finished (a lost Hangup event, a
+crash on the Asterisk side) are expired after CALL_REGISTRY_MAX_ACTIVE_AGE.
+Calls are indexed by phone number and voice, and all operations are guarded
+by a single lock so Flask request threads and the AMI reader/keepalive
+thread can share one registry.
+"""
+import os
+import sys
+import time
+import threading
+from collections import deque
+
+# How long finished calls stay queryable, and how many of them are kept at most
+CALL_REGISTRY_TTL = int(os.environ.get('CALL_REGISTRY_TTL', '3600'))  # 1 hour
+CALL_REGISTRY_MAX_FINISHED = int(os.environ.get('CALL_REGISTRY_MAX_FINISHED', '10000'))
+# Calls still not finished this long after being placed are marked 'expired'
+CALL_REGISTRY_MAX_ACTIVE_AGE = int(os.environ.get('CALL_REGISTRY_MAX_ACTIVE_AGE', '14400'))  # 4 hours
+
+FINISHED_STATUSES = frozenset(['completed', 'failed', 'busy', 'no-answer', 'canceled', 'expired'])
+
+
+class CallRecord:
+    """Compact record for one tracked call"""
+
+    __slots__ = ('call_id', 'status', 'to_number', 'voice_id', 'parameters',
+                 'start_time', 'end_time', 'channel', '_added_at', '_expires_at')
+
+    def __init__(self, call_id, to_number, voice_id=None, parameters=None,
+                 status='initiated', start_time=None):
+        self.call_id = call_id
+        self.status = status
+        self.to_number = to_number
+        self.voice_id = voice_id
+        self.parameters = parameters
+        self.start_time = start_time if start_time is not None else time.time()
+        self.end_time = None
+        self.channel = None
+        self._added_at = time.monotonic()
+        self._expires_at = None
+
+    @property
+    def finished(self):
+        return self.end_time is not None
+
+    def duration(self, now=None):
+        """Call duration in whole seconds"""
+        end = self.end_time if self.end_time is not None else (now or time.time())
+        return int(end - self.start_time)
+
+    def to_dict(self):
+        return {
+            'call_id': self.call_id,
+            'status': self.status,
+            'to_number': self.to_number,
+            'voice_id': self.voice_id,
+            'parameters': self.parameters,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+        }
+
+
+class CallRegistry:
+    """Thread-safe call registry with TTL eviction of finished calls
+
+    Args:
+        ttl (float): Seconds a finished call stays in the registry
+        max_finished (int): Upper bound on finished calls kept at once
+        max_active_age (float): Seconds after which a call that never
+            finished is marked 'expired'
+    """
+
+    def __init__(self, ttl=CALL_REGISTRY_TTL, max_finished=CALL_REGISTRY_MAX_FINISHED,
+                 max_active_age=CALL_REGISTRY_MAX_ACTIVE_AGE):
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.max_active_age = max_active_age
+        self._lock = threading.RLock()
+        self._calls = {}
+        self._by_number = {}
+        self._by_voice = {}
+        self._by_channel = {}
+        # Calls in the order they were added, for expiring stale active ones
+        self._active = deque()
+        # Finished calls in the order they finished; the TTL is constant, so
+        # this is also expiry order and eviction only ever looks at the head.
+        self._finished = deque()
+        self.evicted = 0
+        self.expired_active = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
+
+    def __contains__(self, call_id):
+        with self._lock:
+            self._evict_expired()
+            return call_id in self._calls
+
+    def add(self, call_id, to_number, voice_id=None, parameters=None, status='initiated'):
+        """Track a newly placed call and return its record"""
+        record = CallRecord(call_id, to_number, voice_id, parameters or None, status)
+        with self._lock:
+            self._evict_expired()
+            previous = self._calls.get(call_id)
+            if previous is not None:
+                self._unindex(previous)
+            self._calls[call_id] = record
+            self._active.append(record)
+            self._by_number.setdefault(to_number, set()).add(call_id)
+            if voice_id is not None:
+                self._by_voice.setdefault(voice_id, set()).add(call_id)
+        return record
+
+    def get(self, call_id):
+        """Return the CallRecord for call_id, or None if unknown or evicted"""
+        with self._lock:
+            self._evict_expired()
+            return self._calls.get(call_id)
+
+    def update_status(self, call_id, status):
+        """Update a call's status; finished statuses start its TTL"""
+        if status in FINISHED_STATUSES:
+            return self.finish(call_id, status)
+        with self._lock:
+            record = self._calls.get(call_id)
+            if record is not None and not record.finished:
+                record.status = status
+            return record
+
+    def finish(self, call_id, status='completed', end_time=None):
+        """Mark a call as finished; it will be evicted after the TTL"""
+        with self._lock:
+            record = self._calls.get(call_id)
+            if record is None:
+                return None
+            self._mark_finished(record, status, end_time)
+            self._evict_expired()
+            return record
+
+    def _mark_finished(self, record, status, end_time=None):
+        record.status = status
+        if record.finished:
+            return
+        record.end_time = end_time if end_time is not None else time.time()
+        record._expires_at = time.monotonic() + self.ttl
+        self._finished.append(record)
+
+    def set_channel(self, call_id, channel):
+        """Remember the Asterisk channel of a call, so its events can be matched"""
+        with self._lock:
+            record = self._calls.get(call_id)
+            if record is None or not channel:
+                return None
+            if record.channel is not None:
+                self._by_channel.pop(record.channel, None)
+            record.channel = channel
+            self._by_channel[channel] = call_id
+            return record
+
+    def find_by_channel(self, channel):
+        """Return the record for the call on an Asterisk channel, or None"""
+        with self._lock:
+            self._evict_expired()
+            call_id = self._by_channel.get(channel)
+            return self._calls.get(call_id) if call_id is not None else None
+
+    def find_by_number(self, to_number):
+        """Return records for every tracked call to to_number"""
+        with self._lock:
+            self._evict_expired()
+            return [self._calls[c] for c in self._by_number.get(to_number, ())]
+
+    def find_by_voice(self, voice_id):
+        """Return records for every tracked call using voice_id"""
+        with self._lock:
+            self._evict_expired()
+            return [self._calls[c] for c in self._by_voice.get(voice_id, ())]
+
+    def active(self):
+        """Return records for calls that have not finished"""
+        with self._lock:
+            self._evict_expired()
+            return [r for r in self._calls.values() if not r.finished]
+
+    def evict_expired(self):
+        """Evict finished calls past their TTL; returns the number evicted"""
+        with self._lock:
+            return self._evict_expired()
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        # Calls are added in time order, so stale active calls are at the head
+        active = self._active
+        stale_before = now - self.max_active_age
+        while active:
+            record = active[0]
+            if not record.finished and self._calls.get(record.call_id) is record:
+                if record._added_at > stale_before:
+                    break
+                self._mark_finished(record, 'expired')
+                self.expired_active += 1
+            active.popleft()
+        # Finished calls queued behind a long-running one: compact occasionally
+        if len(active) > 2 * len(self._calls) + 64:
+            self._active = deque(r for r in active
+                                 if not r.finished and self._calls.get(r.call_id) is r)
+
+        evicted = 0
+        finished = self._finished
+        while finished and (finished[0]._expires_at <= now or len(finished) > self.max_finished):
+            record = finished.popleft()
+            # Skip records that were replaced by a re-used call ID
+            if self._calls.get(record.call_id) is record:
+                del self._calls[record.call_id]
+                self._unindex(record)
+                evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    def _unindex(self, record):
+        for index, key in ((self._by_number, record.to_number), (self._by_voice, record.voice_id)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(record.call_id)
+                if not ids:
+                    del index[key]
+        if record.channel is not None and self._by_channel.get(record.channel) == record.call_id:
+            del self._by_channel[record.channel]
+
+    def stats(self):
+        """Report registry size and approximate memory use per tracked call"""
+        with self._lock:
+            self._evict_expired()
+            records = list(self._calls.values())
+            index_bytes = (sys.getsizeof(self._calls) + sys.getsizeof(self._by_number)
+                           + sys.getsizeof(self._by_voice) + sys.getsizeof(self._by_channel)
+                           + sys.getsizeof(self._finished) + sys.getsizeof(self._active))
+        finished = sum(1 for r in records if r.finished)
+        record_bytes = sum(_record_size(r) for r in records)
+        total = record_bytes + index_bytes
+        return {
+            'tracked': len(records),
+            'active': len(records) - finished,
+            'finished': finished,
+            'evicted': self.evicted,
+            'expired_active': self.expired_active,
+            'ttl': self.ttl,
+            'max_active_age': self.max_active_age,
+            'approx_bytes': total,
+            'approx_bytes_per_call': round(total / len(records), 1) if records else 0,
+        }
+
+
+def _record_size(record):
+    """Approximate size of a record including its small owned values"""
+    size = sys.getsizeof(record) + sys.getsizeof(record.call_id) + sys.getsizeof(record.to_number)
+    if record.parameters:
+        size += sys.getsizeof(record.parameters)
+    return size
+
+
+def _measure(factory, calls):
+    """Measure traced bytes per call for a registry built by factory(calls)"""
+    import tracemalloc
+    import gc
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    holder = factory(calls)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del holder
+    return (after - before) / calls
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    params = {'pitch': -3, 'formant': -20, 'effect': 'none'}
+
+    def build_dicts(n):
+        # The previous PhoneCallManager.active_calls layout
+        calls_by_id = {}
+        for i in range(n):
+            calls_by_id[f"voice-changer-{i}"] = {
+                'status': 'initiated', 'to_number': f"555{i % 10000:07d}",
+                'voice_id': str(i % 50), 'parameters': params, 'start_time': time.time(),
+            }
+        return calls_by_id
+
+    def build_registry(n):
+        registry = CallRegistry(ttl=3600, max_finished=n)
+        for i in range(n):
+            registry.add(f"voice-changer-{i}", f"555{i % 10000:07d}", str(i % 50), params)
+        return registry
+
+    print(f"dict-of-dicts:  {_measure(build_dicts, calls):.1f} bytes/call")
+    print(f"CallRegistry:   {_measure(build_registry, calls):.1f} bytes/call (incl. indexes)")
+
+    registry = CallRegistry(ttl=0.0, max_finished=1000)
+    started = time.perf_counter()
+    for i in range(calls):
+        registry.add(f"c{i}", f"555{i % 10000:07d}", str(i % 50), params)
+        registry.finish(f"c{i}")
+    elapsed = time.perf_counter() - started
+    print(f"add+finish:     {calls / elapsed:.0f} calls/s, {len(registry)} retained after churn")
+    print(f"stats:          {registry.stats()}")
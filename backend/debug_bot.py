@@ -1,54 +1,90 @@
 
+import os
+import time
 import logging
 import traceback
 import socket
-import requests
+import threading
 import json
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict, List, Optional
 from backend.ml_debugger import MLDebugger
 
+# Seconds each diagnostic check may take before it is reported as timed out
+DEBUG_CHECK_TIMEOUT = float(os.environ.get('DEBUG_CHECK_TIMEOUT', '5'))
+# Seconds a diagnostics run is reused by later callers
+DEBUG_DIAGNOSTICS_TTL = float(os.environ.get('DEBUG_DIAGNOSTICS_TTL', '30'))
+
 class DebugBot:
     def __init__(self):
         self.logger = logging.getLogger('DebugBot')
         self.issues = []
         self.ml_debugger = MLDebugger()
+        self.checks = {
+            'port_conflicts': self.check_port_conflicts,
+            'asterisk_config': self.check_asterisk_config,
+            'syntax_errors': self.check_syntax_errors,
+        }
+        # A check still running from an earlier run is not started again, so
+        # one thread per check is enough and hung checks cannot pile up
+        self._executor = ThreadPoolExecutor(max_workers=len(self.checks),
+                                            thread_name_prefix='diagnostics')
+        self._pending = {}
+        self._cache = None
+        self._cache_expires = 0.0
+        self._lock = threading.Lock()
         
-    def check_port_conflicts(self) -> List[Dict]:
-        """Check for port conflicts"""
+    def check_port_conflicts(self, timeout=DEBUG_CHECK_TIMEOUT) -> List[Dict]:
+        """Check for port conflicts, giving up on the remaining ports after timeout"""
         ports_to_check = [5000, 5001, 4573]
         conflicts = []
+        deadline = time.monotonic() + timeout
         
         for port in ports_to_check:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            try:
-                sock.bind(('0.0.0.0', port))
-                sock.close()
-            except socket.error:
-                conflicts.append({
-                    'type': 'port_conflict',
-                    'port': port,
-                    'message': f'Port {port} is already in use'
-                })
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.logger.warning(f"Port check ran out of time before port {port}")
+                break
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.settimeout(remaining)
+                try:
+                    sock.bind(('0.0.0.0', port))
+                except OSError:
+                    conflicts.append({
+                        'type': 'port_conflict',
+                        'port': port,
+                        'message': f'Port {port} is already in use'
+                    })
         return conflicts
 
-    def check_asterisk_config(self) -> List[Dict]:
-        """Check Asterisk configuration"""
+    def check_asterisk_config(self, timeout=DEBUG_CHECK_TIMEOUT) -> List[Dict]:
+        """Check Asterisk configuration and the AMI connection health
+
+        Reads the in-process state directly; calling back into this API
+        over HTTP could deadlock a worker whose threads are all busy.
+        """
+        from backend import phone
+        from backend.ami_health import ami_health
+
         issues = []
-        try:
-            response = requests.get('http://localhost:5001/api/config/asterisk/status')
-            if response.status_code != 200:
-                issues.append({
-                    'type': 'asterisk_config',
-                    'message': 'Asterisk configuration check failed'
-                })
-        except Exception as e:
+        missing = [name for name in ('ASTERISK_HOST', 'ASTERISK_USERNAME', 'ASTERISK_SECRET')
+                   if not getattr(phone, name)]
+        if missing:
+            issues.append({
+                'type': 'asterisk_config',
+                'message': f"Asterisk is not configured: {', '.join(missing)} not set"
+            })
+
+        health = ami_health.snapshot()
+        if health['state'] != 'closed':
             issues.append({
                 'type': 'asterisk_config',
-                'message': f'Asterisk check error: {str(e)}'
+                'message': f"AMI circuit is {health['state']} after {health['consecutive_failures']} "
+                           f"failures (retry in {health['retry_in']}s): {health['last_error']}"
             })
         return issues
 
-    def check_syntax_errors(self) -> List[Dict]:
+    def check_syntax_errors(self, timeout=DEBUG_CHECK_TIMEOUT) -> List[Dict]:
         """Check for syntax errors in key Python files"""
         files_to_check = [
             'backend/phone.py',
@@ -56,8 +92,12 @@ class DebugBot:
             'run_voice_api.py'
         ]
         issues = []
+        deadline = time.monotonic() + timeout
         
         for file_path in files_to_check:
+            if time.monotonic() >= deadline:
+                self.logger.warning(f"Syntax check ran out of time before {file_path}")
+                break
             try:
                 with open(file_path) as f:
                     compile(f.read(), file_path, 'exec')
@@ -90,23 +130,84 @@ class DebugBot:
             self.logger.error(f"Error fixing syntax: {e}")
             return False
 
-    def run_diagnostics(self) -> Dict:
-        """Run all diagnostic checks"""
-        results = {
-            'port_conflicts': self.check_port_conflicts(),
-            'asterisk_config': self.check_asterisk_config(),
-            'syntax_errors': self.check_syntax_errors(),
-            'status': 'error' if any([
-                self.check_port_conflicts(),
-                self.check_asterisk_config(),
-                self.check_syntax_errors()
-            ]) else 'ok'
-        }
-        return results
+    def run_diagnostics(self, use_cache=True) -> Dict:
+        """Run all diagnostic checks concurrently, once per DEBUG_DIAGNOSTICS_TTL
+
+        Each check gets DEBUG_CHECK_TIMEOUT seconds and is expected to stop
+        on its own by then; one that overruns is not started again while it
+        still runs. Checks that time out or fail get an empty issue list and
+        an entry in 'check_failures', so each check's list only ever holds
+        its own issue type. 'durations_ms' has each check's run time and
+        'cached' tells whether the results were reused.
+        """
+        with self._lock:
+            if use_cache and self._cache is not None and time.monotonic() < self._cache_expires:
+                return dict(self._cache, cached=True)
+
+            started = time.monotonic()
+            durations = {}
+            results = {}
+            failures = []
+
+            def timed(name, check):
+                check_started = time.monotonic()
+                try:
+                    return check(timeout=DEBUG_CHECK_TIMEOUT)
+                finally:
+                    durations[name] = round((time.monotonic() - check_started) * 1000, 1)
+
+            futures = {}
+            for name, check in self.checks.items():
+                pending = self._pending.get(name)
+                if pending is not None and not pending.done():
+                    results[name] = []
+                    failures.append({
+                        'type': 'check_timeout',
+                        'check': name,
+                        'message': f'{name} check is still running from an earlier run'
+                    })
+                    continue
+                futures[name] = self._pending[name] = self._executor.submit(timed, name, check)
+            wait(futures.values(), timeout=DEBUG_CHECK_TIMEOUT)
+
+            for name, future in futures.items():
+                if not future.done():
+                    durations[name] = round((time.monotonic() - started) * 1000, 1)
+                    results[name] = []
+                    failures.append({
+                        'type': 'check_timeout',
+                        'check': name,
+                        'message': f'{name} check did not finish within {DEBUG_CHECK_TIMEOUT}s'
+                    })
+                elif future.exception() is not None:
+                    results[name] = []
+                    failures.append({
+                        'type': 'check_error',
+                        'check': name,
+                        'message': f'{name} check failed: {future.exception()}'
+                    })
+                else:
+                    results[name] = future.result()
+
+            has_issues = failures or any(results[name] for name in self.checks)
+            results['status'] = 'error' if has_issues else 'ok'
+            results['check_failures'] = failures
+            results['durations_ms'] = dict(durations)
+            self._cache = results
+            self._cache_expires = time.monotonic() + DEBUG_DIAGNOSTICS_TTL
+            return dict(results, cached=False)
+
+    def auto_fix(self, diagnostic_results=None) -> Dict:
+        """Use ML to determine and apply best fix strategy
 
-    def auto_fix(self) -> Dict:
-        """Use ML to determine and apply best fix strategy"""
-        diagnostic_results = self.run_diagnostics()
+        Args:
+            diagnostic_results (dict): Results of run_diagnostics() the caller
+                already has; diagnostics are run if None. Only fresh results
+                are saved for training, so a cached run is not recorded again
+                on every call within the TTL.
+        """
+        if diagnostic_results is None:
+            diagnostic_results = self.run_diagnostics()
         resolution = self.ml_debugger.predict_resolution(diagnostic_results)
         
         fixes = {
@@ -121,7 +222,8 @@ class DebugBot:
                 
         if resolution == 'port_fix' or resolution == 'auto_fix':
             for conflict in diagnostic_results.get('port_conflicts', []):
-                fixes['fixes_applied'].append(f"port_{conflict['port']}")
+                if conflict.get('type') == 'port_conflict':
+                    fixes['fixes_applied'].append(f"port_{conflict['port']}")
                 
         if resolution == 'config_fix' or resolution == 'auto_fix':
             if diagnostic_results.get('asterisk_config'):
@@ -129,7 +231,8 @@ class DebugBot:
                 
         # Save the diagnostic record for training
         success = len(fixes['fixes_applied']) > 0
-        self.ml_debugger.save_diagnostic_record(diagnostic_results, resolution, success)
+        if not diagnostic_results.get('cached'):
+            self.ml_debugger.save_diagnostic_record(diagnostic_results, resolution, success)
         
         fixes['message'] = f"Applied {resolution} strategy with {len(fixes['fixes_applied'])} fixes"
         return fixes
@@ -0,0 +1,202 @@
+"""
+Append-optimized store for DebugBot diagnostic history.
+
+Records go into a local SQLite table (WAL mode). They are buffered in
+memory and written in batches of DEBUG_HISTORY_BATCH rows, or by a timer
+once the oldest buffered record is DEBUG_HISTORY_FLUSH_SECONDS old. Readers fetch
+rows after a given id as NumPy feature/label arrays, so a model can be
+updated with only the records it has not seen yet, whatever the total
+history size.
+
+A legacy debug_history.csv next to the database is imported once, by
+whichever process gets there first.
+"""
+import os
+import csv
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger('DebugHistory')
+
+DEBUG_HISTORY_PATH = os.environ.get('DEBUG_HISTORY_PATH', 'backend/models/debug_history.sqlite3')
+DEBUG_HISTORY_BATCH = int(os.environ.get('DEBUG_HISTORY_BATCH', '50'))
+DEBUG_HISTORY_FLUSH_SECONDS = float(os.environ.get('DEBUG_HISTORY_FLUSH_SECONDS', '5'))
+
+FEATURES = ('port_conflicts', 'asterisk_issues', 'syntax_errors', 'had_error')
+COLUMNS = ('timestamp',) + FEATURES + ('resolution_type', 'success')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diagnostic_history (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    port_conflicts INTEGER NOT NULL,
+    asterisk_issues INTEGER NOT NULL,
+    syntax_errors INTEGER NOT NULL,
+    had_error INTEGER NOT NULL,
+    resolution_type TEXT NOT NULL,
+    success INTEGER NOT NULL
+)
+"""
+
+_META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+"""
+
+_INSERT = (f"INSERT INTO diagnostic_history ({', '.join(COLUMNS)}) "
+           f"VALUES ({', '.join('?' * len(COLUMNS))})")
+
+
+class DiagnosticHistory:
+    """Batched writer and incremental reader for diagnostic records
+
+    Args:
+        path (str): SQLite database file
+        batch_size (int): Buffered records that trigger a write
+        flush_seconds (float): Age of the oldest buffered record that
+            triggers a write, checked on append and by a timer
+        on_write (callable): Called with no arguments after every written
+            batch, whichever of append, the timer or flush wrote it
+    """
+
+    def __init__(self, path=DEBUG_HISTORY_PATH, batch_size=DEBUG_HISTORY_BATCH,
+                 flush_seconds=DEBUG_HISTORY_FLUSH_SECONDS, on_write=None):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.on_write = on_write
+        self._pending = []
+        self._oldest_pending = None
+        self._pending_pid = None
+        self._timer = None
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _connection(self):
+        # One connection per process; a forked worker opens its own
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(_SCHEMA)
+            conn.execute(_META_SCHEMA)
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+            self._import_legacy_csv()
+        return self._conn
+
+    def _import_legacy_csv(self):
+        legacy = os.path.join(os.path.dirname(self.path), 'debug_history.csv')
+        if not os.path.exists(legacy):
+            return
+        conn = self._conn
+        # Workers start together; the write lock makes exactly one of them import
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute("SELECT 1 FROM history_meta WHERE key = 'legacy_csv_imported'").fetchone():
+                conn.rollback()
+                return
+            try:
+                with open(legacy, newline='') as f:
+                    rows = [tuple(row.get(column) for column in COLUMNS) for row in csv.DictReader(f)]
+            except FileNotFoundError:
+                conn.rollback()
+                return
+            conn.executemany(_INSERT, rows)
+            conn.execute("INSERT INTO history_meta (key, value) VALUES ('legacy_csv_imported', ?)",
+                         (str(len(rows)),))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        os.replace(legacy, legacy + '.imported')
+        logger.info(f"Imported {len(rows)} records from {legacy}")
+
+    def append(self, record):
+        """Buffer one record (a dict with COLUMNS keys); writes when a batch is due"""
+        row = tuple(record[column] for column in COLUMNS)
+        with self._lock:
+            self._own_pending()
+            self._pending.append(row)
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+                self._schedule_flush()
+            due = (len(self._pending) >= self.batch_size
+                   or time.monotonic() - self._oldest_pending >= self.flush_seconds)
+            if due:
+                self._write_pending()
+            return due
+
+    def flush(self):
+        """Write any buffered records"""
+        with self._lock:
+            self._write_pending()
+
+    def _own_pending(self):
+        if self._pending_pid != os.getpid():
+            # Records and timer inherited across fork are the parent's
+            self._pending = []
+            self._oldest_pending = None
+            self._timer = None
+            self._pending_pid = os.getpid()
+
+    def _schedule_flush(self):
+        # Writes the batch when no further append comes to do it
+        self._timer = threading.Timer(self.flush_seconds, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _write_pending(self):
+        self._own_pending()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        conn = self._connection()
+        with conn:
+            conn.executemany(_INSERT, self._pending)
+        self._pending = []
+        self._oldest_pending = None
+        if self.on_write is not None:
+            try:
+                self.on_write()
+            except Exception as e:
+                logger.error(f"History write callback failed: {e}")
+
+    def count(self):
+        with self._lock:
+            return self._connection().execute('SELECT COUNT(*) FROM diagnostic_history').fetchone()[0]
+
+    def last_id(self):
+        with self._lock:
+            row = self._connection().execute('SELECT MAX(id) FROM diagnostic_history').fetchone()
+        return row[0] or 0
+
+    def read_since(self, after_id=0, limit=10000):
+        """Records with id > after_id, oldest first, as columns
+
+        Returns:
+            tuple: (ids, features, resolutions). ids is an int64 array,
+            features an int32 array shaped (n, len(FEATURES)) and resolutions
+            a list of strings.
+        """
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT id, {', '.join(FEATURES)}, resolution_type FROM diagnostic_history "
+                f"WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)).fetchall()
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(FEATURES)), dtype=np.int32), []
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        features = np.array([row[1:-1] for row in rows], dtype=np.int32)
+        return ids, features, [row[-1] for row in rows]
@@ -0,0 +1,185 @@
+"""
+Asterisk dialplan rendering for voice transformation.
+
+Renders the [voice-changer] contexts that go into extensions.conf, either for
+a single voice or for the whole voice catalog at once. Bulk output is cached
+per catalog version and rebuilt incrementally: only voices whose name or
+parameters changed are re-rendered.
+"""
+import json
+import hashlib
+import threading
+from backend import models
+
+# Context shared by every voice context; emitted once in bulk output
+CALL_CONTEXT_LINES = [
+    '[voice-changer-call]',
+    'exten => s,1,Dial(${ARG1},30)',
+    'exten => s,n,Hangup()',
+]
+
+
+def voice_context_name(voice_id):
+    """Context name used for a voice in bulk output"""
+    return f"voice-changer-{voice_id}"
+
+
+def voice_context_lines(context, voice_id=None, voice=None):
+    """Build the dialplan lines for one voice-changer context
+
+    Args:
+        context (str): Name of the context to emit
+        voice_id: ID of the voice, or None for the untransformed greeting
+        voice (dict): Voice row as returned by models, or None if not found
+
+    Returns:
+        list: Dialplan lines, without the shared [voice-changer-call] context
+    """
+    dialplan = [f"[{context}]"]
+
+    if voice_id and voice:
+        voice_name = voice.get('name', 'Custom Voice')
+        voice_params = voice.get('parameters') or {}
+
+        # Add voice parameters as variables
+        dialplan.append(f"exten => s,1,Set(VOICE_ID={voice_id})")
+        dialplan.append(f"exten => s,n,Set(VOICE_NAME={voice_name})")
+        dialplan.append(f"exten => s,n,Set(VOICE_PITCH={voice_params.get('pitch', 0)})")
+        dialplan.append(f"exten => s,n,Set(VOICE_FORMANT={voice_params.get('formant', 0)})")
+        dialplan.append(f"exten => s,n,Set(VOICE_EFFECT={voice_params.get('effect', 'none')})")
+
+        # Add a greeting with the voice name
+        dialplan.append('exten => s,n,Playback(custom/voice-changer-greeting)')
+        dialplan.append(f'exten => s,n,SayAlpha({voice_name})')
+
+        # Apply voice transformation (this would require a custom Asterisk module/app)
+        dialplan.append('exten => s,n,VoiceTransform(${VOICE_ID},${VOICE_PITCH},${VOICE_FORMANT},${VOICE_EFFECT})')
+    else:
+        # Default greeting with no (or an unknown) voice
+        dialplan.append('exten => s,1,Playback(custom/voice-changer-greeting)')
+
+    # Add options for the caller
+    dialplan.append('exten => s,n,Background(custom/voice-options)')
+    dialplan.append('exten => s,n,WaitExten(10)')
+
+    # Add handlers for different DTMF options
+    dialplan.append('exten => 1,1,Playback(custom/original-voice)')
+    dialplan.append('exten => 1,n,Set(VOICE_TRANSFORM=0)')
+    dialplan.append('exten => 1,n,Goto(voice-changer-call,s,1)')
+
+    dialplan.append('exten => 2,1,Playback(custom/transformed-voice)')
+    dialplan.append('exten => 2,n,Set(VOICE_TRANSFORM=1)')
+    dialplan.append('exten => 2,n,Goto(voice-changer-call,s,1)')
+
+    # Default timeout or invalid option
+    dialplan.append('exten => t,1,Playback(custom/no-selection)')
+    dialplan.append('exten => t,n,Goto(s,1)')
+    dialplan.append('exten => i,1,Playback(custom/invalid-selection)')
+    dialplan.append('exten => i,n,Goto(s,1)')
+
+    return dialplan
+
+
+def render_dialplan(voice_id=None, voice=None):
+    """Render the single-voice [voice-changer] dialplan"""
+    lines = voice_context_lines('voice-changer', voice_id, voice)
+    lines.append('')
+    lines.extend(CALL_CONTEXT_LINES)
+    return '\n'.join(lines)
+
+
+def voice_fingerprint(voice):
+    """Hash of the voice fields that affect its rendered context"""
+    payload = json.dumps([voice.get('id'), voice.get('name'), voice.get('parameters')],
+                         sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class DialplanUnavailable(Exception):
+    """Raised when the voice catalog cannot be read to refresh the dialplan"""
+
+
+class DialplanRenderer:
+    """Render and cache the extensions.conf fragment for every voice
+
+    The cache holds one rendered fragment per voice together with the
+    fingerprint it was rendered from, so a catalog change only re-renders the
+    voices that actually changed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fragments = {}  # voice_id -> (fingerprint, text)
+        self._order = []
+        self.version = None
+        self.rendered = 0  # Fragments rendered since startup
+
+    def refresh(self, voices=None):
+        """Bring the cache up to date with the catalog
+
+        Args:
+            voices (list): Voice rows; fetched with one catalog query if None
+
+        Returns:
+            str: Catalog version of the cached output
+
+        Raises:
+            DialplanUnavailable: If the catalog cannot be read; the previous
+                cache is kept
+        """
+        if voices is None:
+            # Skip fetching rows entirely when the catalog has not changed
+            catalog_version = models.get_voice_catalog_version()
+            if catalog_version is None:
+                raise DialplanUnavailable("Could not read the voice catalog version")
+            if catalog_version == self.version:
+                return self.version
+            try:
+                voices = models.get_all_voices(raise_errors=True)
+            except Exception as e:
+                raise DialplanUnavailable(f"Could not read the voice catalog: {e}") from e
+        else:
+            catalog_version = None
+
+        fingerprints = [(voice['id'], voice_fingerprint(voice)) for voice in voices]
+        with self._lock:
+            fragments = {}
+            for voice, (voice_id, fingerprint) in zip(voices, fingerprints):
+                cached = self._fragments.get(voice_id)
+                if cached and cached[0] == fingerprint:
+                    fragments[voice_id] = cached
+                    continue
+                lines = voice_context_lines(voice_context_name(voice_id), voice_id, voice)
+                fragments[voice_id] = (fingerprint, '\n'.join(lines) + '\n\n')
+                self.rendered += 1
+
+            self._fragments = fragments
+            self._order = [voice_id for voice_id, _ in fingerprints]
+            if catalog_version is None:
+                digest = hashlib.sha1()
+                for voice_id, fingerprint in fingerprints:
+                    digest.update(f"{voice_id}:{fingerprint};".encode())
+                catalog_version = digest.hexdigest()
+            self.version = catalog_version
+            return self.version
+
+    def iter_dialplan(self):
+        """Yield the cached bulk dialplan in chunks, one voice context at a time
+
+        Call refresh() first. The snapshot taken here is not affected by a
+        concurrent refresh, so a streamed response is always consistent.
+        """
+        with self._lock:
+            order = list(self._order)
+            fragments = self._fragments
+            version = self.version
+
+        yield f"; Voice changer dialplan for {len(order)} voices (catalog {version})\n\n"
+        for voice_id in order:
+            yield fragments[voice_id][1]
+        yield '\n'.join(CALL_CONTEXT_LINES) + '\n'
+
+    def render_all(self, voices=None):
+        """Render the whole bulk dialplan as one string"""
+        self.refresh(voices)
+        return ''.join(self.iter_dialplan())
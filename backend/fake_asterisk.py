@@ -0,0 +1,627 @@
+"""
+Local stand-in for an Asterisk PBX, used to exercise PhoneCallManager and
+AGIServer without real telephony infrastructure.
+
+Provides:
+    FakeAMIServer     - simulated Asterisk Manager Interface (Login, Originate,
+                        Status, Hangup, Ping, Logoff) with configurable latency
+                        and failure injection
+    AGILoadGenerator  - opens N concurrent FastAGI sessions against AGIServer and
+                        replays an AGI script in each of them
+    run_ami_load      - drives PhoneCallManager.start_call/end_call against an AMI
+
+Each tool reports latency percentiles and throughput so performance can be
+regression-tested on a laptop:
+
+    python -m backend.fake_asterisk ami --port 5038 --latency-ms 20 --failure-rate 0.05
+    python -m backend.fake_asterisk ami --failure-rate 0.2 --fail-stages answer
+    python -m backend.fake_asterisk ami-load --port 5038 --calls 200 --concurrency 20
+    python -m backend.fake_asterisk agi-load --port 4573 --sessions 100 --concurrency 50
+"""
+import sys
+import socket
+import socketserver
+import threading
+import argparse
+import logging
+import random
+import time
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('FakeAsterisk')
+
+AMI_BANNER = "Asterisk Call Manager/5.0.2\r\n"
+
+# Steps of a call FakeAMIServer can fail: the AMI Login, the Originate
+# itself, and the far end answering
+FAILURE_STAGES = ('login', 'originate', 'answer')
+
+# Default AGI script replayed by the load generator. Each line is sent as one
+# command and must be answered with exactly one response line.
+DEFAULT_AGI_SCRIPT = [
+    'GET VARIABLE VOICE_ID',
+    'STREAM FILE custom/voice-changer-greeting ""',
+    'EXEC VoiceTransform "{voice_id}"',
+    'STREAM FILE custom/voice-options "12"',
+    'HANGUP',
+]
+
+
+class LatencyStats:
+    """Thread-safe collector of latency samples with percentile reporting"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []
+        self.errors = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+    def stop(self):
+        self.finished_at = time.perf_counter()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def percentile(self, pct):
+        """Return the pct-th percentile (nearest rank) in milliseconds"""
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+        return ordered[rank - 1] * 1000.0
+
+    def summary(self):
+        """Summarize the run as a dictionary"""
+        elapsed = 0.0
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.perf_counter()
+            elapsed = end - self.started_at
+        count = len(self.samples)
+        return {
+            'count': count,
+            'errors': self.errors,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_per_s': round(count / elapsed, 2) if elapsed > 0 else 0.0,
+            'p50_ms': round(self.percentile(50), 3),
+            'p90_ms': round(self.percentile(90), 3),
+            'p99_ms': round(self.percentile(99), 3),
+            'max_ms': round(self.percentile(100), 3),
+        }
+
+    def format_summary(self, label):
+        s = self.summary()
+        return (f"{label}: {s['count']} ok, {s['errors']} errors in {s['elapsed_s']}s "
+                f"({s['throughput_per_s']}/s) "
+                f"p50={s['p50_ms']}ms p90={s['p90_ms']}ms p99={s['p99_ms']}ms max={s['max_ms']}ms")
+
+
+def _format_message(fields):
+    """Encode an ordered list of (key, value) pairs as one AMI message"""
+    return ''.join(f"{key}: {value}\r\n" for key, value in fields) + "\r\n"
+
+
+class _AMIHandler(socketserver.StreamRequestHandler):
+    """Handle one AMI client connection"""
+
+    def setup(self):
+        super().setup()
+        self.authenticated = False
+        self._write_lock = threading.Lock()
+
+    def send(self, fields):
+        data = _format_message(fields).encode()
+        with self._write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.wfile.write(AMI_BANNER.encode())
+        self.wfile.flush()
+
+        while True:
+            message = self._read_message()
+            if message is None:
+                break
+            if not message:
+                continue
+
+            started = time.perf_counter()
+            action = message.get('action', '').lower()
+            action_id = message.get('actionid')
+            server.simulate_latency()
+
+            try:
+                keep_open = self.dispatch(action, action_id, message)
+            except (BrokenPipeError, ConnectionResetError):
+                break
+            server.stats_for(action or 'unknown').record(time.perf_counter() - started)
+            if not keep_open:
+                break
+
+    def _read_message(self):
+        """Read one AMI message; returns None on EOF"""
+        message = {}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            line = line.decode(errors='replace').strip()
+            if not line:
+                return message
+            if ':' in line:
+                key, value = line.split(':', 1)
+                message[key.strip().lower()] = value.strip()
+
+    def _response(self, action_id, ok, message, extra=None):
+        fields = [('Response', 'Success' if ok else 'Error')]
+        if action_id:
+            fields.append(('ActionID', action_id))
+        fields.extend(extra or [])
+        fields.append(('Message', message))
+        self.send(fields)
+
+    def dispatch(self, action, action_id, message):
+        server = self.server
+
+        if action == 'login':
+            if (message.get('username') == server.username
+                    and message.get('secret') == server.secret
+                    and not server.should_fail('login')):
+                self.authenticated = True
+                self._response(action_id, True, 'Authentication accepted')
+                self.send([('Event', 'FullyBooted'), ('Privilege', 'system,all'),
+                           ('Status', 'Fully Booted')])
+            else:
+                self._response(action_id, False, 'Authentication failed')
+                return False
+            return True
+
+        if action == 'logoff':
+            self.send([('Response', 'Goodbye'), ('Message', 'Thanks for all the fish.')])
+            return False
+
+        if not self.authenticated:
+            self._response(action_id, False, 'Permission denied')
+            return True
+
+        if action == 'ping':
+            self.send([('Response', 'Success'), ('ActionID', action_id or ''),
+                       ('Ping', 'Pong'), ('Timestamp', f"{time.time():.6f}")])
+        elif action == 'originate':
+            self._originate(action_id, message)
+        elif action == 'status':
+            self._status(action_id)
+        elif action == 'hangup':
+            channel = message.get('channel', '')
+            if server.hangup_channel(channel, cause='16'):
+                self._response(action_id, True, 'Channel Hungup')
+            else:
+                self._response(action_id, False, 'No such channel')
+        else:
+            self._response(action_id, False, 'Invalid/unknown command')
+        return True
+
+    def _originate(self, action_id, message):
+        server = self.server
+        if server.should_fail('originate'):
+            self._response(action_id, False, 'Originate failed')
+            return
+
+        exten = message.get('exten', '')
+        channel = server.open_channel(action_id, exten)
+        self._response(action_id, True, 'Originate successfully queued')
+
+        # Emit the channel lifecycle asynchronously, like a real PBX would
+        timer = threading.Thread(target=self._emit_call_events,
+                                 args=(action_id, channel, exten), daemon=True)
+        timer.start()
+
+    def _emit_call_events(self, action_id, channel, exten):
+        server = self.server
+        try:
+            self.send([('Event', 'Newchannel'), ('Channel', channel), ('ChannelState', '0'),
+                       ('ChannelStateDesc', 'Down'), ('Exten', exten)])
+            time.sleep(server.ring_delay)
+            server.set_channel_state(channel, 'Ringing')
+            self.send([('Event', 'Newstate'), ('Channel', channel), ('ChannelState', '5'),
+                       ('ChannelStateDesc', 'Ringing')])
+            time.sleep(server.answer_delay)
+            if server.should_fail('answer'):
+                server.hangup_channel(channel, cause='17')
+                self.send([('Event', 'OriginateResponse'), ('ActionID', action_id or ''),
+                           ('Response', 'Failure'), ('Channel', channel), ('Reason', '5')])
+                self.send([('Event', 'Hangup'), ('Channel', channel), ('Cause', '17'),
+                           ('Cause-txt', 'User busy')])
+                return
+            server.set_channel_state(channel, 'Up')
+            self.send([('Event', 'Newstate'), ('Channel', channel), ('ChannelState', '6'),
+                       ('ChannelStateDesc', 'Up')])
+            self.send([('Event', 'OriginateResponse'), ('ActionID', action_id or ''),
+                       ('Response', 'Success'), ('Channel', channel), ('Reason', '4')])
+        except (OSError, ValueError):
+            # Client went away while events were pending
+            pass
+
+    def _status(self, action_id):
+        channels = self.server.list_channels()
+        self._response(action_id, True, 'Channel status will follow',
+                       extra=[('EventList', 'start')])
+        for name, info in channels:
+            self.send([('Event', 'Status'), ('ActionID', action_id or ''), ('Channel', name),
+                       ('State', info['state']), ('Exten', info['exten']),
+                       ('Seconds', str(int(time.time() - info['created'])))])
+        self.send([('Event', 'StatusComplete'), ('ActionID', action_id or ''),
+                   ('EventList', 'Complete'), ('ListItems', str(len(channels)))])
+
+
+class FakeAMIServer(socketserver.ThreadingTCPServer):
+    """Simulated Asterisk Manager Interface
+
+    Args:
+        host (str): Address to bind
+        port (int): Port to bind (0 picks a free port)
+        username (str): Accepted AMI username
+        secret (str): Accepted AMI secret
+        latency_ms (float): Mean processing delay added to every action
+        jitter_ms (float): Uniform +/- jitter applied to latency_ms
+        failure_rate (float): Probability that Originate/answer/login fail
+        fail_stages (iterable): Stages failure_rate applies to, out of
+            FAILURE_STAGES; all of them by default
+        seed (int): Random seed for reproducible runs
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=5038, username='admin', secret='secret',
+                 latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0, fail_stages=None,
+                 ring_delay=0.05, answer_delay=0.1, seed=None):
+        fail_stages = frozenset(FAILURE_STAGES if fail_stages is None else fail_stages)
+        unknown = fail_stages - set(FAILURE_STAGES)
+        if unknown:
+            raise ValueError(f"Unknown failure stages: {', '.join(sorted(unknown))}")
+        super().__init__((host, port), _AMIHandler)
+        self.username = username
+        self.secret = secret
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.fail_stages = fail_stages
+        self.ring_delay = ring_delay
+        self.answer_delay = answer_delay
+        self.random = random.Random(seed)
+        self.connections = 0
+        self.action_stats = {}
+        self._channels = {}
+        self._channels_lock = threading.Lock()
+        self._channel_seq = 0
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stats_for(self, action):
+        stats = self.action_stats.get(action)
+        if stats is None:
+            stats = LatencyStats()
+            stats.start()
+            stats = self.action_stats.setdefault(action, stats)
+        return stats
+
+    def simulate_latency(self):
+        if self.latency_ms <= 0 and self.jitter_ms <= 0:
+            return
+        delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def should_fail(self, stage):
+        """Draw whether this login, originate or answer fails"""
+        return (stage in self.fail_stages and self.failure_rate > 0
+                and self.random.random() < self.failure_rate)
+
+    def open_channel(self, action_id, exten):
+        with self._channels_lock:
+            self._channel_seq += 1
+            name = f"SIP/{exten or 'fake'}-{self._channel_seq:08x}"
+            channel = {'state': 'Down', 'exten': exten, 'created': time.time()}
+            self._channels[name] = channel
+            # PhoneCallManager hangs up by the originate ActionID, so index it too
+            if action_id:
+                self._channels[action_id] = channel
+        return name
+
+    def set_channel_state(self, channel, state):
+        with self._channels_lock:
+            if channel in self._channels:
+                self._channels[channel]['state'] = state
+
+    def hangup_channel(self, channel, cause='16'):
+        with self._channels_lock:
+            info = self._channels.pop(channel, None)
+            if info is None:
+                return False
+            # Drop every alias pointing at the same channel
+            for key in [k for k, v in self._channels.items() if v is info]:
+                del self._channels[key]
+            return True
+
+    def list_channels(self):
+        with self._channels_lock:
+            seen = set()
+            channels = []
+            for name, info in self._channels.items():
+                if id(info) in seen or not name.startswith('SIP/'):
+                    continue
+                seen.add(id(info))
+                channels.append((name, dict(info)))
+            return channels
+
+    def start_background(self):
+        """Serve in a daemon thread and return immediately"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def report(self):
+        lines = [f"Fake AMI served {self.connections} connections"]
+        for action, stats in sorted(self.action_stats.items()):
+            lines.append('  ' + stats.format_summary(action))
+        return '\n'.join(lines)
+
+
+class AGILoadGenerator:
+    """Open concurrent FastAGI sessions against AGIServer and replay a script
+
+    Args:
+        host (str): AGI server host
+        port (int): AGI server port
+        script (list): AGI command lines; '{voice_id}' is substituted per session
+        voice_ids (list): Voice IDs cycled across sessions
+        timeout (float): Socket timeout per session in seconds
+    """
+
+    def __init__(self, host='127.0.0.1', port=4573, script=None, voice_ids=None, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.script = script or DEFAULT_AGI_SCRIPT
+        self.voice_ids = voice_ids or ['1']
+        self.timeout = timeout
+        self.session_stats = LatencyStats()
+        self.command_stats = LatencyStats()
+
+    def _environment(self, index, voice_id):
+        return [
+            'agi_network: yes',
+            'agi_network_script: voice-changer',
+            'agi_request: agi://localhost/voice-changer',
+            f'agi_channel: SIP/load-{index:06d}',
+            'agi_language: en',
+            'agi_type: SIP',
+            f'agi_uniqueid: {time.time():.6f}.{index}',
+            'agi_callerid: 1000',
+            'agi_context: voice-changer',
+            'agi_extension: s',
+            'agi_priority: 1',
+            f'agi_arg_1: {voice_id}',
+        ]
+
+    def run_session(self, index):
+        """Run a single AGI session; returns True on success"""
+        voice_id = self.voice_ids[index % len(self.voice_ids)]
+        started = time.perf_counter()
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+                reader = sock.makefile('r', encoding='utf-8', newline='\n')
+                # Send the whole environment in one write, as Asterisk does
+                env = '\n'.join(self._environment(index, voice_id)) + '\n\n'
+                sock.sendall(env.encode())
+
+                ready = reader.readline()
+                if not ready.startswith('200'):
+                    raise ConnectionError(f"Unexpected greeting: {ready!r}")
+
+                for command in self.script:
+                    line = command.format(voice_id=voice_id)
+                    sent = time.perf_counter()
+                    sock.sendall((line + '\n').encode())
+                    response = reader.readline()
+                    if not response:
+                        raise ConnectionError(f"Connection closed after {line!r}")
+                    self.command_stats.record(time.perf_counter() - sent)
+                    if not response.startswith('200'):
+                        raise ConnectionError(f"{line!r} failed: {response.strip()}")
+                reader.close()
+        except Exception as e:
+            logger.debug(f"AGI session {index} failed: {e}")
+            self.session_stats.record_error()
+            return False
+
+        self.session_stats.record(time.perf_counter() - started)
+        return True
+
+    def run(self, sessions=100, concurrency=10):
+        """Run sessions with at most `concurrency` open at once; returns a summary dict"""
+        self.session_stats.start()
+        self.command_stats.start()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self.run_session, range(sessions)))
+        self.session_stats.stop()
+        self.command_stats.stop()
+        return {
+            'sessions': self.session_stats.summary(),
+            'commands': self.command_stats.summary(),
+        }
+
+
+def run_ami_load(host='127.0.0.1', port=5038, username='admin', secret='secret',
+                 calls=100, concurrency=10, to_number='5551234567', hangup=True):
+    """Drive PhoneCallManager against an AMI endpoint and measure call setup latency
+
+    Returns:
+        dict: Summaries for start_call and end_call
+    """
+    from backend import phone
+
+    # The manager reads its credentials from module-level settings
+    phone.ASTERISK_HOST = host
+    phone.ASTERISK_PORT = port
+    phone.ASTERISK_USERNAME = username
+    phone.ASTERISK_SECRET = secret
+
+    start_stats = LatencyStats()
+    end_stats = LatencyStats()
+    local = threading.local()
+
+    def place_call(_):
+        manager = getattr(local, 'manager', None)
+        if manager is None:
+            manager = local.manager = phone.PhoneCallManager()
+        started = time.perf_counter()
+        result = manager.start_call(to_number)
+        if not result.get('success'):
+            start_stats.record_error()
+            return
+        start_stats.record(time.perf_counter() - started)
+
+        if hangup:
+            started = time.perf_counter()
+            result = manager.end_call(result['call_sid'])
+            if result.get('success'):
+                end_stats.record(time.perf_counter() - started)
+            else:
+                end_stats.record_error()
+
+    start_stats.start()
+    end_stats.start()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(place_call, range(calls)))
+    start_stats.stop()
+    end_stats.stop()
+
+    return {
+        'start_call': start_stats.summary(),
+        'end_call': end_stats.summary(),
+    }
+
+
+def _print_summary(title, summary):
+    print(title)
+    for name, values in summary.items():
+        print(f"  {name}: " + ', '.join(f"{k}={v}" for k, v in values.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake Asterisk tools for local load testing')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    ami = sub.add_parser('ami', help='Run a simulated AMI server')
+    ami.add_argument('--host', default='127.0.0.1')
+    ami.add_argument('--port', type=int, default=5038)
+    ami.add_argument('--username', default='admin')
+    ami.add_argument('--secret', default='secret')
+    ami.add_argument('--latency-ms', type=float, default=0.0)
+    ami.add_argument('--jitter-ms', type=float, default=0.0)
+    ami.add_argument('--failure-rate', type=float, default=0.0)
+    ami.add_argument('--fail-stages', default=','.join(FAILURE_STAGES),
+                     help='Comma-separated stages the failure rate applies to')
+    ami.add_argument('--seed', type=int, default=None)
+
+    ami_load = sub.add_parser('ami-load', help='Drive PhoneCallManager against an AMI')
+    ami_load.add_argument('--host', default='127.0.0.1')
+    ami_load.add_argument('--port', type=int, default=5038,
+                          help='AMI port; 0 starts an in-process fake AMI')
+    ami_load.add_argument('--username', default='admin')
+    ami_load.add_argument('--secret', default='secret')
+    ami_load.add_argument('--calls', type=int, default=100)
+    ami_load.add_argument('--concurrency', type=int, default=10)
+    ami_load.add_argument('--latency-ms', type=float, default=0.0,
+                          help='Latency of the in-process fake AMI (with --port 0)')
+    ami_load.add_argument('--failure-rate', type=float, default=0.0,
+                          help='Failure rate of the in-process fake AMI (with --port 0)')
+
+    agi_load = sub.add_parser('agi-load', help='Replay AGI sessions against AGIServer')
+    agi_load.add_argument('--host', default='127.0.0.1')
+    agi_load.add_argument('--port', type=int, default=4573,
+                          help='AGI port; 0 starts an in-process AGIServer')
+    agi_load.add_argument('--sessions', type=int, default=100)
+    agi_load.add_argument('--concurrency', type=int, default=10)
+    agi_load.add_argument('--script', help='File with one AGI command per line')
+    agi_load.add_argument('--voice-ids', default='1', help='Comma-separated voice IDs')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == 'ami':
+        server = FakeAMIServer(args.host, args.port, args.username, args.secret,
+                               latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               failure_rate=args.failure_rate,
+                               fail_stages=args.fail_stages.split(','), seed=args.seed)
+        logger.info(f"Fake AMI listening on {args.host}:{server.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(server.report())
+        return 0
+
+    if args.command == 'ami-load':
+        server = None
+        port = args.port
+        if port == 0:
+            server = FakeAMIServer(args.host, 0, args.username, args.secret,
+                                   latency_ms=args.latency_ms,
+                                   failure_rate=args.failure_rate).start_background()
+            port = server.port
+        summary = run_ami_load(args.host, port, args.username, args.secret,
+                               calls=args.calls, concurrency=args.concurrency)
+        _print_summary(f"AMI load: {args.calls} calls, concurrency {args.concurrency}", summary)
+        if server:
+            server.shutdown()
+            print(server.report())
+        return 0
+
+    if args.command == 'agi-load':
+        script = None
+        if args.script:
+            with open(args.script) as f:
+                script = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        port = args.port
+        agi_server = None
+        if port == 0:
+            from backend.agi_server import AGIServer
+            agi_server = AGIServer(host=args.host, port=0)
+            threading.Thread(target=agi_server.start, daemon=True).start()
+            while agi_server.socket is None or not agi_server.running:
+                time.sleep(0.01)
+            port = agi_server.socket.getsockname()[1]
+        generator = AGILoadGenerator(args.host, port, script=script,
+                                     voice_ids=args.voice_ids.split(','))
+        summary = generator.run(sessions=args.sessions, concurrency=args.concurrency)
+        _print_summary(f"AGI load: {args.sessions} sessions, concurrency {args.concurrency}", summary)
+        if agi_server:
+            agi_server.stop()
+        return 0
+
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
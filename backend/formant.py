@@ -0,0 +1,128 @@
+"""
+Formant shifting independent of pitch.
+
+Each STFT frame's spectral envelope is estimated from the low quefrencies of
+its real cepstrum. The envelope is then warped along the frequency axis and
+the frame is re-weighted by warped/original envelope, which moves the
+formants while leaving the harmonics (the pitch) where they are.
+
+The `formant` voice parameter is in hundredths of an octave: +50 raises the
+formants by 2**0.5 (Chipmunk Voice), -40 lowers them by 2**-0.4 (Darth
+Vader). Warp tables are precomputed once per (FFT size, formant) and all
+frames available in a block are processed as one 2-D batch.
+"""
+import threading
+
+import numpy as np
+
+from backend.voice_engine import STFTStage
+
+# Analysis frame of 32 ms (256 samples at 8 kHz) with 75% overlap
+FRAME_SECONDS = 0.032
+OVERLAP = 4
+# Cepstral coefficients kept for the envelope, per 8 kHz of sample rate;
+# below the quefrency of a 400 Hz pitch so harmonics do not leak in
+LIFTER_PER_8K = 18
+# Largest envelope correction applied to a bin, in natural-log units (~26 dB)
+MAX_LOG_GAIN = 3.0
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def formant_ratio(formant):
+    """Frequency scale factor for a formant parameter value"""
+    return 2.0 ** (formant / 100.0)
+
+
+def frame_size(sample_rate, seconds=FRAME_SECONDS):
+    """Power-of-two FFT size covering at least `seconds` of audio"""
+    size = 1
+    while size < seconds * sample_rate:
+        size <<= 1
+    return size
+
+
+def get_tables(n_fft, formant, sample_rate):
+    """Lifter and warp table for one configuration, cached
+
+    Returns:
+        tuple: (lifter, index, fraction). The warped envelope at bin k is
+        env[index[k]] * (1 - fraction[k]) + env[index[k] + 1] * fraction[k].
+    """
+    key = (n_fft, formant, sample_rate)
+    tables = _tables.get(key)
+    if tables is None:
+        with _tables_lock:
+            tables = _tables.get(key)
+            if tables is None:
+                tables = _tables[key] = _build_tables(n_fft, formant, sample_rate)
+    return tables
+
+
+def _build_tables(n_fft, formant, sample_rate):
+    n_lifter = max(4, LIFTER_PER_8K * sample_rate // 8000)
+    lifter = np.zeros(n_fft, dtype=np.float32)
+    lifter[:n_lifter] = 1.0
+    lifter[n_fft - n_lifter + 1:] = 1.0
+
+    bins = n_fft // 2 + 1
+    source = np.minimum(np.arange(bins) / formant_ratio(formant), bins - 1.0)
+    index = np.minimum(np.floor(source).astype(np.intp), bins - 2)
+    fraction = (source - index).astype(np.float32)
+    return lifter, index, fraction
+
+
+class FormantShifter(STFTStage):
+    """Streaming cepstral formant shifter
+
+    Args:
+        formant (float): Shift in hundredths of an octave
+        sample_rate (int): Sample rate of the stream
+        channels (int): Channels per block
+    """
+
+    def __init__(self, formant, sample_rate, channels=1):
+        super().__init__(frame_size(sample_rate), OVERLAP, channels)
+        self.formant = formant
+        self.lifter, self.index, self.fraction = get_tables(self.n_fft, formant, sample_rate)
+
+    def process_spectra(self, spectrum):
+        log_magnitude = np.log(np.abs(spectrum) + 1e-9)
+
+        # Envelope = low-quefrency part of the real cepstrum
+        cepstrum = np.fft.irfft(log_magnitude, n=self.n_fft, axis=-1)
+        envelope = np.fft.rfft(cepstrum * self.lifter, axis=-1).real
+
+        warped = (envelope[..., self.index] * (1 - self.fraction)
+                  + envelope[..., self.index + 1] * self.fraction)
+        gain = np.exp(np.clip(warped - envelope, -MAX_LOG_GAIN, MAX_LOG_GAIN))
+        return spectrum * gain
+
+
+def _benchmark(seconds=10.0, sample_rate=8000, frame_ms=20):
+    """CPU time per 20 ms telephony frame for the catalog's formant range"""
+    import time
+
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal((1, int(seconds * sample_rate))) * 0.1).astype(np.float32)
+    frame = sample_rate * frame_ms // 1000
+    results = []
+    for formant in (-40, -20, 20, 50):
+        shifter = FormantShifter(formant, sample_rate)
+        shifter.process(audio[:, :frame])
+        shifter.reset()
+        started = time.process_time()
+        for i in range(0, audio.shape[1], frame):
+            shifter.process(audio[:, i:i + frame])
+        cpu = time.process_time() - started
+        frames = -(-audio.shape[1] // frame)
+        results.append((formant, cpu / frames * 1e6, seconds / cpu if cpu else float('inf'),
+                        shifter.latency * 1000 / sample_rate))
+    return results
+
+
+if __name__ == '__main__':
+    for formant, per_frame_us, realtime, latency_ms in _benchmark():
+        print(f"formant {formant:+4d}: {per_frame_us:7.1f} us per 20 ms frame, "
+              f"{realtime:6.0f}x realtime per core, latency {latency_ms:.0f} ms")
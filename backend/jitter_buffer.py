@@ -0,0 +1,280 @@
+"""
+Adaptive per-call jitter buffer in front of the voice transformer.
+
+The network side put()s frames tagged with their RTP-style timestamp (in
+samples) as they arrive, in whatever order. The DSP tick get()s exactly one
+frame per tick and never waits: if the frame due for playout is missing it
+gets a concealment frame instead, the last good frame repeated with a fade
+that reaches silence after a few frames.
+
+The target depth follows the measured interarrival jitter (RFC 3550
+estimator). It grows as soon as jitter rises or a frame arrives too late
+to be played, by holding playout for one concealed frame. It shrinks
+slowly, one skipped frame at a time, after jitter has stayed low for a
+while. Arrivals, concealment and depth are recorded in the call's media
+stats.
+"""
+import os
+import math
+import time
+import threading
+
+import numpy as np
+
+JITTER_BUFFER_MIN_FRAMES = int(os.environ.get('JITTER_BUFFER_MIN_FRAMES', '1'))
+JITTER_BUFFER_MAX_FRAMES = int(os.environ.get('JITTER_BUFFER_MAX_FRAMES', '10'))
+# Target delay beyond one frame, in units of the smoothed jitter estimate
+JITTER_MULTIPLIER = 3.0
+# Consecutive frames with a lower estimate before the target drops by one (1 s)
+SHRINK_AFTER_FRAMES = 50
+# Gain applied per consecutive concealed frame, and frames until silence
+CONCEAL_DECAY = 0.5
+MAX_CONCEALED_FRAMES = 4
+
+
+class JitterBuffer:
+    """Reorders one call's frames and paces them out one per tick
+
+    Args:
+        frame_samples (int): Samples per frame
+        sample_rate (int): Sample rate the timestamps count in
+        stats (SessionStats): Media stats of the call, optional
+        min_frames (int): Smallest target depth
+        max_frames (int): Largest target depth
+    """
+
+    def __init__(self, frame_samples, sample_rate=8000, stats=None,
+                 min_frames=JITTER_BUFFER_MIN_FRAMES, max_frames=JITTER_BUFFER_MAX_FRAMES):
+        self.frame_samples = frame_samples
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_samples * 1000.0 / sample_rate
+        self.stats = stats
+        self.min_frames = min_frames
+        self.max_frames = max(min_frames, max_frames)
+        self.target = min_frames
+        self.jitter_ms = 0.0
+        self.playing = False
+        self.received = 0
+        self.played = 0
+        self.concealed = 0
+        self.late = 0
+        self.reordered = 0
+        self.skipped = 0
+        self._frames = {}  # timestamp -> (samples, arrival)
+        self._next = None  # timestamp due for playout
+        self._newest = None
+        self._transit = None
+        self._below_target = 0
+        self._concealed_run = 0
+        self._last = np.zeros(frame_samples, dtype=np.float32)
+        self._conceal = np.zeros(frame_samples, dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def put(self, timestamp, samples, now=None):
+        """Store a received frame
+
+        Args:
+            timestamp (int): Timestamp of the frame's first sample, in samples
+            samples (np.ndarray): float32 frame
+            now (float): Arrival time (monotonic seconds), defaults to now
+
+        Returns:
+            bool: False if the frame was a duplicate or arrived after its
+            playout time and was discarded
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.stats is not None:
+            self.stats.frame_arrived(now)
+        with self._lock:
+            self.received += 1
+            self._update_jitter(timestamp, now)
+
+            if self._next is not None and self.playing and timestamp < self._next:
+                # Too late to play: the buffer is too shallow for this network
+                self.late += 1
+                self.target = min(self.max_frames, self.target + 1)
+                self._below_target = 0
+                discarded = 'discarded_late_frames'
+            elif timestamp in self._frames:
+                discarded = 'duplicate_frames'
+            else:
+                discarded = None
+                if self._newest is not None and timestamp < self._newest:
+                    self.reordered += 1
+                    if self.stats is not None:
+                        self.stats.count('reordered_frames')
+                else:
+                    self._newest = timestamp
+                frame = np.zeros(self.frame_samples, dtype=np.float32)
+                frame[:len(samples)] = samples[:self.frame_samples]
+                self._frames[timestamp] = (frame, now)
+                if not self.playing and (self._next is None or timestamp < self._next):
+                    self._next = timestamp
+
+        if discarded and self.stats is not None:
+            self.stats.count(discarded)
+        return not discarded
+
+    def _update_jitter(self, timestamp, now):
+        transit = now * 1000.0 - timestamp * 1000.0 / self.sample_rate
+        if self._transit is not None:
+            self.jitter_ms += (abs(transit - self._transit) - self.jitter_ms) / 16.0
+        self._transit = transit
+
+        estimate = 1 + math.ceil(JITTER_MULTIPLIER * self.jitter_ms / self.frame_ms)
+        estimate = min(self.max_frames, max(self.min_frames, estimate))
+        if estimate > self.target:
+            self.target = estimate
+            self._below_target = 0
+        elif estimate < self.target:
+            self._below_target += 1
+            if self._below_target >= SHRINK_AFTER_FRAMES:
+                self.target -= 1
+                self._below_target = 0
+        else:
+            self._below_target = 0
+
+    def depth(self):
+        """Frames buffered from the playout point to the newest frame"""
+        if not self._frames or self._next is None:
+            return 0
+        return max(0, (self._newest - self._next) // self.frame_samples + 1)
+
+    def get(self, now=None):
+        """Frame due for playout; never waits
+
+        Returns:
+            tuple: (samples, arrival). arrival is None for silence or a
+            concealment frame. samples is only valid until the next call.
+        """
+        with self._lock:
+            depth = self.depth()
+            if not self.playing:
+                if not self._frames or depth < self.target:
+                    return self._conceal_frame(silence=True), None
+                self.playing = True
+
+            entry = self._frames.pop(self._next, None)
+            if entry is None:
+                if self._frames and min(self._frames) - self._next > self.max_frames * self.frame_samples:
+                    # Resuming after a gap in the stream (silence suppression)
+                    self._next = min(self._frames)
+                    entry = self._frames.pop(self._next)
+                elif depth < self.target:
+                    # Shallower than the jitter calls for: treat the frame as
+                    # late rather than lost and hold playout, which grows the
+                    # buffer by one frame
+                    frame = self._conceal_frame()
+                else:
+                    frame = self._conceal_frame()
+                    self._next += self.frame_samples
+
+            if entry is not None:
+                frame, arrival = entry
+                self._next += self.frame_samples
+                self._last = frame
+                self._concealed_run = 0
+                self.played += 1
+                depth -= 1
+                if depth > self.target and self._next in self._frames:
+                    # Deeper than needed: drop a frame to cut the delay
+                    del self._frames[self._next]
+                    self._next += self.frame_samples
+                    self.skipped += 1
+                    depth -= 1
+            else:
+                arrival = None
+
+        if self.stats is not None:
+            self.stats.observe('jitter_buffer_ms', max(0, depth) * self.frame_ms)
+            if arrival is None:
+                self.stats.count('concealed_frames')
+        return frame, arrival
+
+    def _conceal_frame(self, silence=False):
+        if silence:
+            self._conceal.fill(0.0)
+            return self._conceal
+        self.concealed += 1
+        self._concealed_run += 1
+        if self._concealed_run > MAX_CONCEALED_FRAMES:
+            self._conceal.fill(0.0)
+        else:
+            np.multiply(self._last, CONCEAL_DECAY ** self._concealed_run, out=self._conceal)
+        return self._conceal
+
+    def summary(self):
+        with self._lock:
+            return {
+                'target_frames': self.target,
+                'depth_frames': self.depth(),
+                'jitter_ms': round(self.jitter_ms, 3),
+                'received': self.received,
+                'played': self.played,
+                'concealed': self.concealed,
+                'late': self.late,
+                'reordered': self.reordered,
+                'skipped': self.skipped,
+            }
+
+
+def _simulate(seconds=30.0, loss=0.03, sample_rate=8000, frame_ms=20, seed=0,
+              min_frames=JITTER_BUFFER_MIN_FRAMES, max_frames=JITTER_BUFFER_MAX_FRAMES):
+    """Run a buffer against a lossy stream whose jitter changes over time
+
+    Network delay is 30 ms plus exponential jitter: 2 ms mean for the first
+    third, 25 ms for the second and 5 ms for the last. Frames are lost at
+    random and arrive reordered whenever the jitter exceeds a frame period.
+    Time is simulated, so the run is deterministic and instantaneous. The
+    playout delay is measured from the frame's send time, network included.
+    """
+    rng = np.random.default_rng(seed)
+    frame = sample_rate * frame_ms // 1000
+    period = frame_ms / 1000.0
+    count = int(seconds / period)
+    phase_jitter = (0.002, 0.025, 0.005)
+
+    arrivals = []
+    for i in range(count):
+        if rng.random() < loss:
+            continue
+        mean = phase_jitter[min(2, i * 3 // count)]
+        arrivals.append((i * period + 0.03 + rng.exponential(mean), i * frame))
+    arrivals.sort()
+
+    buffer = JitterBuffer(frame, sample_rate, min_frames=min_frames, max_frames=max_frames)
+    samples = np.zeros(frame, dtype=np.float32)
+    delays = [[], [], []]
+    targets = [[], [], []]
+    index = 0
+    for tick in range(count + max_frames + 10):
+        now = 0.03 + tick * period
+        while index < len(arrivals) and arrivals[index][0] <= now:
+            buffer.put(arrivals[index][1], samples, arrivals[index][0])
+            index += 1
+        due = buffer._next
+        _, arrival = buffer.get(now)
+        phase = min(2, tick * 3 // count)
+        targets[phase].append(buffer.target)
+        if arrival is not None:
+            delays[phase].append((now - due / sample_rate) * 1000.0)
+
+    summary = buffer.summary()
+    summary['sent'] = count
+    summary['phases'] = [(jitter * 1000, float(np.mean(t)), float(np.mean(d)) if d else 0.0)
+                         for jitter, t, d in zip(phase_jitter, targets, delays)]
+    return summary
+
+
+if __name__ == '__main__':
+    print("30 s of 20 ms frames, 3% loss, jitter 2 ms -> 25 ms -> 5 ms")
+    for label, limits in (('adaptive', (JITTER_BUFFER_MIN_FRAMES, JITTER_BUFFER_MAX_FRAMES)),
+                          ('fixed 1 frame', (1, 1)), ('fixed 6 frames', (6, 6))):
+        result = _simulate(min_frames=limits[0], max_frames=limits[1])
+        print(f"{label}: sent {result['sent']}, played {result['played']}, "
+              f"concealed {result['concealed']}, late {result['late']}, "
+              f"reordered {result['reordered']}, skipped {result['skipped']}")
+        for jitter, target, delay in result['phases']:
+            print(f"    jitter {jitter:4.0f} ms: mean target {target:4.1f} frames, "
+                  f"mean playout delay {delay:5.1f} ms")
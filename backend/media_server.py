@@ -0,0 +1,247 @@
+"""
+AudioSocket media server: carries live call audio through the batched DSP.
+
+Asterisk's AudioSocket() application streams a call's audio over TCP as
+8 kHz signed linear frames and plays back whatever audio it is sent. Each
+connection gets a BatchScheduler session for the voice its call selected,
+so every call sharing a voice is transformed in one vectorized run per
+tick. The voice is bound to the call's UUID by its FastAGI session, which
+runs first:
+
+    same => n,Set(VOICE_UUID=${SHELL(uuidgen | tr -d '\\n')})
+    same => n,AGI(agi://<host>:4573,${VOICE_ID},${VOICE_UUID})
+    same => n,AudioSocket(${VOICE_UUID},<host>:4575)
+
+Every message is a 1-byte kind, a 2-byte big-endian payload length and the
+payload. Kinds: 0x00 hangup, 0x01 call UUID (16 bytes), 0x03 DTMF digit,
+0x10 audio, 0xff error. Each received frame is answered with one frame of
+transformed audio, so playback is paced by the caller's own frames.
+
+Received frames are timestamped by their position in the call's stream and
+go through the session's jitter buffer (MEDIA_JITTER_BUFFER). TCP and the
+PBX's scheduling deliver frames in bursts, and the DSP tick consumes one
+frame per call; without the buffer, a second frame arriving before the tick
+would be dropped as a duplicate.
+"""
+import os
+import uuid
+import time
+import socket
+import struct
+import logging
+import threading
+
+import numpy as np
+
+from backend import metrics
+from backend.audio_buffer import FrameBuffer
+from backend.batch_dsp import BatchScheduler
+
+logger = logging.getLogger('MediaServer')
+
+MEDIA_HOST = os.environ.get('MEDIA_HOST', '0.0.0.0')
+MEDIA_PORT = int(os.environ.get('MEDIA_PORT', '4575'))
+# Seconds a voice bound by the AGI session waits for its AudioSocket connection
+MEDIA_BINDING_TTL = float(os.environ.get('MEDIA_BINDING_TTL', '60'))
+MEDIA_JITTER_BUFFER = os.environ.get('MEDIA_JITTER_BUFFER', '1') == '1'
+
+KIND_HANGUP = 0x00
+KIND_UUID = 0x01
+KIND_DTMF = 0x03
+KIND_AUDIO = 0x10
+KIND_ERROR = 0xff
+
+_HEADER = struct.Struct('>BH')
+
+MEDIA_SESSIONS = metrics.gauge('media_sessions_active', 'AudioSocket calls being transformed')
+MEDIA_SESSIONS_TOTAL = metrics.counter('media_sessions_total', 'AudioSocket connections accepted')
+
+
+class MediaServer:
+    """AudioSocket server feeding calls into a BatchScheduler
+
+    Args:
+        resolve_voice (callable): Returns the parameters of a voice ID
+        host (str): Address to listen on
+        port (int): Port to listen on; 0 picks a free one
+        scheduler (BatchScheduler): Scheduler the calls share; one is
+            created (and started with the server) if None
+    """
+
+    def __init__(self, resolve_voice, host=MEDIA_HOST, port=MEDIA_PORT, scheduler=None):
+        self.resolve_voice = resolve_voice
+        self.host = host
+        self.port = port
+        self.scheduler = scheduler or BatchScheduler()
+        self.socket = None
+        self.running = False
+        self.ready = threading.Event()
+        self.clients = []
+        self._bindings = {}  # call UUID -> (voice ID, bound at)
+        self._lock = threading.Lock()
+
+    def bind(self, call_uuid, voice_id):
+        """Select the voice for the AudioSocket call with this UUID
+
+        Raises:
+            ValueError: call_uuid is not a UUID
+        """
+        key = str(uuid.UUID(call_uuid))
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (_, bound) in self._bindings.items() if now - bound > MEDIA_BINDING_TTL]
+            for k in expired:
+                del self._bindings[k]
+            self._bindings[key] = (voice_id, now)
+
+    def _take_binding(self, call_uuid):
+        with self._lock:
+            voice_id, bound = self._bindings.pop(call_uuid, (None, 0.0))
+        if voice_id is not None and time.monotonic() - bound > MEDIA_BINDING_TTL:
+            return None
+        return voice_id
+
+    def start(self):
+        """Start the media server; blocks accepting connections until stop()"""
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
+            self.socket.listen(16)
+            self.port = self.socket.getsockname()[1]
+            self.running = True
+        except OSError as e:
+            if e.errno == 98:  # Address already in use
+                logger.warning(f"Address {self.host}:{self.port} already in use, skipping media server start")
+                return
+            raise
+        finally:
+            self.ready.set()
+
+        self.scheduler.start()
+        logger.info(f"AudioSocket media server started on {self.host}:{self.port}")
+
+        try:
+            while self.running:
+                client, address = self.socket.accept()
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                client_thread = threading.Thread(target=self.handle_client, args=(client, address),
+                                                 daemon=True)
+                client_thread.start()
+                self.clients.append((client, client_thread))
+                self.clients = [(c, t) for c, t in self.clients if t.is_alive()]
+        except OSError:
+            if self.running:
+                logger.error("Media server socket failed", exc_info=True)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop accepting calls, hang up the open ones and stop the scheduler"""
+        self.running = False
+        for client, _ in self.clients:
+            try:
+                client.close()
+            except OSError:
+                pass
+        if self.socket:
+            try:
+                # Wakes the accept() blocked in start()
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        self.scheduler.stop()
+
+    def handle_client(self, client_socket, address):
+        """Transform one call's audio until it hangs up"""
+        frame_samples = self.scheduler.frame_samples
+        received = FrameBuffer('slin', frame_samples)
+        sent = FrameBuffer('slin', frame_samples)
+        out = np.zeros(frame_samples, dtype=np.float32)
+        header = bytearray(_HEADER.size)
+        header_view = memoryview(header)
+        reply = _HEADER.pack(KIND_AUDIO, len(sent.payload))
+        frame_bytes = len(received.payload)
+        pending = bytearray()
+        timestamp = 0
+        session = None
+        MEDIA_SESSIONS_TOTAL.inc()
+        MEDIA_SESSIONS.inc()
+        try:
+            while _recv_exact(client_socket, header_view):
+                kind, length = _HEADER.unpack(header)
+
+                if kind == KIND_AUDIO and session is not None:
+                    if length == frame_bytes and not pending:
+                        # Common case: one frame per message, received in place
+                        if not _recv_exact(client_socket, received.payload_view):
+                            break
+                        frames = 1
+                    else:
+                        payload = _recv_payload(client_socket, length)
+                        if payload is None:
+                            break
+                        pending += payload
+                        frames = len(pending) // frame_bytes
+                    for _ in range(frames):
+                        if pending:
+                            received.payload[:] = pending[:frame_bytes]
+                            del pending[:frame_bytes]
+                        session.submit(received.decode(), timestamp)
+                        timestamp += frame_samples
+                        count = session.read_into(out)
+                        out[count:] = 0.0
+                        client_socket.sendall(reply)
+                        client_socket.sendall(sent.encode(out))
+                    continue
+
+                payload = _recv_payload(client_socket, length)
+                if payload is None or kind == KIND_HANGUP:
+                    break
+                if kind == KIND_UUID and session is None:
+                    session = self._open_session(payload)
+                elif kind == KIND_ERROR:
+                    logger.warning(f"AudioSocket peer {address} reported an error: {payload.hex()}")
+                    break
+        except OSError as e:
+            logger.info(f"AudioSocket connection from {address} ended: {e}")
+        except Exception as e:
+            logger.error(f"Error handling AudioSocket client {address}: {e}")
+        finally:
+            MEDIA_SESSIONS.dec()
+            if session is not None:
+                self.scheduler.close(session)
+            try:
+                client_socket.close()
+            except OSError:
+                pass
+
+    def _open_session(self, payload):
+        call_uuid = str(uuid.UUID(bytes=bytes(payload)))
+        voice_id = self._take_binding(call_uuid)
+        if voice_id is None:
+            logger.warning(f"No voice bound to call {call_uuid}; passing it through neutral")
+            params = {}
+        else:
+            params = self.resolve_voice(voice_id)
+        logger.info(f"AudioSocket call {call_uuid} uses voice {voice_id}")
+        return self.scheduler.open(call_uuid, params, voice_id, jitter_buffer=MEDIA_JITTER_BUFFER)
+
+
+def _recv_exact(sock, view):
+    """Fill view from sock; returns False if the peer closed first"""
+    while len(view):
+        count = sock.recv_into(view)
+        if not count:
+            return False
+        view = view[count:]
+    return True
+
+
+def _recv_payload(sock, length):
+    payload = bytearray(length)
+    return payload if _recv_exact(sock, memoryview(payload)) else None
@@ -0,0 +1,246 @@
+"""
+Latency and jitter instrumentation for the media path.
+
+Every media session records, per frame:
+- arrival jitter: deviation of the inter-arrival time from the frame period
+- queue time: arrival to the start of the DSP tick that consumed the frame
+- DSP time: duration of the batched chain run carrying the frame
+- output pacing: deviation of the interval between reads from the period
+- added latency: queue + DSP + the chain's algorithmic latency + time the
+  output waits in the call's buffer
+
+It also counts late frames (the tick found no frame) and output underruns,
+and splits dropped frames by cause: duplicates (a second frame for the same
+tick or timestamp), overflow (output nobody read in time, replaced by newer
+audio) and late arrivals a jitter buffer discarded. Calls behind a jitter
+buffer add its depth and their concealed and reordered frames. Sessions fill
+their own histograms without locking. They are merged into per-voice and
+per-worker aggregates when a session closes or when a snapshot is taken.
+
+The registry is per process. GET /api/media/stats reports the sessions of
+the process serving it, which carries media once it runs the AGI and media
+servers (POST /api/config/agi/restart).
+"""
+import os
+import time
+import socket
+import threading
+from bisect import bisect_left
+
+# Added-latency budget the snapshot reports compliance against
+MEDIA_SLA_P99_MS = float(os.environ.get('MEDIA_SLA_P99_MS', '40'))
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 25, 30, 40, 50, 60, 80,
+              100, 150, 200, 300, 500, 1000)
+
+METRICS = ('arrival_jitter_ms', 'queue_ms', 'dsp_ms', 'output_pacing_ms', 'added_latency_ms',
+           'jitter_buffer_ms')
+COUNTERS = ('frames', 'late_frames', 'duplicate_frames', 'overflow_frames', 'discarded_late_frames',
+            'underruns', 'concealed_frames', 'reordered_frames')
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Histogram:
+    """Fixed-bucket latency histogram"""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS_MS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (conservative)"""
+        if not self.count:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                bound = min(BUCKETS_MS[i], self.max) if i < len(BUCKETS_MS) else self.max
+                return round(bound, 3)
+        return round(self.max, 3)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': round(self.max, 3),
+        }
+
+
+class SessionStats:
+    """Instrumentation for one media session, written without locks
+
+    Each metric has a single writer: arrivals and reads come from the
+    session's media thread, processing figures from the DSP tick.
+
+    Args:
+        session_id: Call or media session ID
+        voice_id: Voice the session is transformed with
+        worker (str): Media worker handling the session
+        frame_ms (float): Nominal frame period
+    """
+
+    __slots__ = ('session_id', 'voice_id', 'worker', 'frame_ms', 'histograms', 'counters',
+                 'jitter_ms', 'started', '_last_arrival', '_last_read')
+
+    def __init__(self, session_id, voice_id, worker, frame_ms):
+        self.session_id = session_id
+        self.voice_id = voice_id
+        self.worker = worker
+        self.frame_ms = frame_ms
+        self.histograms = {metric: Histogram() for metric in METRICS}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.jitter_ms = 0.0  # RFC 3550 smoothed interarrival jitter
+        self.started = time.time()
+        self._last_arrival = None
+        self._last_read = None
+
+    def frame_arrived(self, now):
+        """Record a frame arrival at monotonic time now (seconds)"""
+        self.counters['frames'] += 1
+        if self._last_arrival is not None:
+            deviation = abs((now - self._last_arrival) * 1000.0 - self.frame_ms)
+            self.jitter_ms += (deviation - self.jitter_ms) / 16.0
+            self.histograms['arrival_jitter_ms'].observe(deviation)
+        self._last_arrival = now
+
+    def frame_processed(self, queue_ms, dsp_ms, algorithmic_ms, buffered_ms):
+        self.histograms['queue_ms'].observe(queue_ms)
+        self.histograms['dsp_ms'].observe(dsp_ms)
+        self.histograms['added_latency_ms'].observe(queue_ms + dsp_ms + algorithmic_ms + buffered_ms)
+
+    def frame_read(self, now, short):
+        """Record the media layer collecting output; short means an underrun"""
+        if self._last_read is not None:
+            self.histograms['output_pacing_ms'].observe(
+                abs((now - self._last_read) * 1000.0 - self.frame_ms))
+        self._last_read = now
+        if short:
+            self.counters['underruns'] += 1
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def observe(self, metric, value):
+        self.histograms[metric].observe(value)
+
+    def summary(self):
+        return {
+            'session_id': self.session_id,
+            'voice_id': self.voice_id,
+            'worker': self.worker,
+            'duration': round(time.time() - self.started, 1),
+            'jitter_ms': round(self.jitter_ms, 3),
+            **self.counters,
+            **{metric: h.summary() for metric, h in self.histograms.items()},
+        }
+
+
+class _Aggregate:
+    __slots__ = ('histograms', 'counters', 'sessions')
+
+    def __init__(self):
+        self.histograms = {metric: Histogram() for metric in METRICS}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.sessions = 0
+
+    def merge(self, stats):
+        for metric, h in stats.histograms.items():
+            self.histograms[metric].merge(h)
+        for counter, n in stats.counters.items():
+            self.counters[counter] += n
+        self.sessions += 1
+
+    def summary(self):
+        latency = self.histograms['added_latency_ms']
+        p99 = latency.percentile(99)
+        return {
+            'sessions': self.sessions,
+            **self.counters,
+            **{metric: h.summary() for metric, h in self.histograms.items()},
+            'sla_p99_met': None if p99 is None else p99 <= MEDIA_SLA_P99_MS,
+        }
+
+
+class MediaStats:
+    """Registry of live session stats and per-voice/per-worker aggregates"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._live = {}
+        self._closed = {'voice': {}, 'worker': {}}
+
+    def open_session(self, session_id, voice_id=None, worker=None, frame_ms=20):
+        stats = SessionStats(session_id, voice_id, worker or default_worker_name(), frame_ms)
+        with self._lock:
+            self._live[id(stats)] = stats
+        return stats
+
+    def close_session(self, stats):
+        with self._lock:
+            if self._live.pop(id(stats), None) is None:
+                return
+            for dimension, key in (('voice', stats.voice_id), ('worker', stats.worker)):
+                self._closed[dimension].setdefault(str(key), _Aggregate()).merge(stats)
+
+    def snapshot(self, include_sessions=False):
+        """Aggregates per voice and per worker, closed sessions plus live ones"""
+        with self._lock:
+            live = list(self._live.values())
+            views = {}
+            for dimension, aggregates in self._closed.items():
+                views[dimension] = {}
+                for key, aggregate in aggregates.items():
+                    copy = views[dimension][key] = _Aggregate()
+                    for metric, h in aggregate.histograms.items():
+                        copy.histograms[metric].merge(h)
+                    copy.counters.update(aggregate.counters)
+                    copy.sessions = aggregate.sessions
+
+        for stats in live:
+            for dimension, key in (('voice', stats.voice_id), ('worker', stats.worker)):
+                views[dimension].setdefault(str(key), _Aggregate()).merge(stats)
+
+        snapshot = {
+            'sla_p99_ms': MEDIA_SLA_P99_MS,
+            'live_sessions': len(live),
+            'by_voice': {key: a.summary() for key, a in views['voice'].items()},
+            'by_worker': {key: a.summary() for key, a in views['worker'].items()},
+        }
+        if include_sessions:
+            snapshot['sessions'] = [stats.summary() for stats in live]
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._closed = {'voice': {}, 'worker': {}}
+
+
+# Shared by the media workers in this process
+media_stats = MediaStats()
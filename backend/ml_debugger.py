@@ -1,30 +1,108 @@
 
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import SGDClassifier
 from sklearn.preprocessing import LabelEncoder
 import joblib
 import os
+import copy
 import json
+import time
+import fcntl
+import logging
+import threading
 from typing import Dict, List
 from datetime import datetime
+from backend.debug_history import DiagnosticHistory
+
+logger = logging.getLogger('MLDebugger')
+
+# Strategies DebugBot.auto_fix can apply; the label space is fixed so the
+# model can be updated incrementally
+RESOLUTION_TYPES = ('auto_fix', 'config_fix', 'port_fix', 'syntax_fix')
+# History rows read per partial_fit call
+TRAIN_CHUNK_ROWS = 10000
+
+# Versioned model bundles live here, next to a pointer file naming the current one
+DEBUG_MODEL_DIR = os.environ.get('DEBUG_MODEL_DIR', 'backend/models')
+# Seconds between checks for a bundle published by another process
+DEBUG_MODEL_RELOAD_SECONDS = float(os.environ.get('DEBUG_MODEL_RELOAD_SECONDS', '10'))
+# Bundles kept on disk, including the current one
+DEBUG_MODEL_KEEP_VERSIONS = 3
 
 class MLDebugger:
-    def __init__(self):
-        self.model_path = 'backend/models/debug_model.joblib'
-        self.history_path = 'backend/models/debug_history.csv'
-        self.label_encoder = LabelEncoder()
-        self.model = None
+    """Resolution predictor backed by a versioned, hot-swappable model bundle
+
+    Training runs on a background thread and publishes each update as a new
+    bundle (model, label encoder, history position) written atomically, then
+    switches the pointer file to it. Every MLDebugger, in this or another
+    process, memory-maps the newest bundle in the background and swaps it in;
+    predictions keep using the previous bundle until then.
+
+    Args:
+        model_dir (str): Directory holding the bundles and pointer file
+        history (DiagnosticHistory): Record store; defaults to the shared one.
+            Every batch written to it triggers a background model update.
+    """
+
+    def __init__(self, model_dir=DEBUG_MODEL_DIR, history=None):
+        self.model_dir = model_dir
+        self.pointer_path = os.path.join(model_dir, 'debug_model.current')
+        self.lock_path = os.path.join(model_dir, 'debug_model.lock')
+        self.history = history or DiagnosticHistory()
+        self.history.on_write = self.request_training
+        self.bundle = None  # Replaced as a whole on swap, never mutated
+        self._reload_lock = threading.Lock()
+        self._next_reload = 0.0
+        self._train_requested = threading.Event()
+        self._trainer = None
+        self._trainer_pid = None
         self.initialize_model()
-        
+
     def initialize_model(self):
-        """Initialize or load the ML model"""
-        if os.path.exists(self.model_path):
-            self.model = joblib.load(self.model_path)
-        else:
-            self.model = RandomForestClassifier()
-            os.makedirs('backend/models', exist_ok=True)
-            
+        """Start loading the current bundle without blocking the caller"""
+        os.makedirs(self.model_dir, exist_ok=True)
+        self._next_reload = time.monotonic() + DEBUG_MODEL_RELOAD_SECONDS
+        threading.Thread(target=self.reload_model, name='ml-model-load', daemon=True).start()
+
+    def _current_name(self):
+        try:
+            with open(self.pointer_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def reload_model(self) -> bool:
+        """Swap in the bundle the pointer file names, if it is newer
+
+        Returns:
+            bool: True if a new bundle was loaded
+        """
+        with self._reload_lock:
+            name = self._current_name()
+            if name is None or (self.bundle is not None and self.bundle['name'] == name):
+                return False
+            try:
+                bundle = joblib.load(os.path.join(self.model_dir, name), mmap_mode='r')
+            except (OSError, EOFError, ValueError) as e:
+                logger.warning(f"Cannot load model bundle {name}: {e}")
+                return False
+            if tuple(bundle.get('resolutions', ())) != RESOLUTION_TYPES:
+                logger.warning(f"Ignoring model bundle {name} with different resolution types")
+                return False
+            if self.bundle is None or bundle['version'] > self.bundle['version']:
+                self.bundle = bundle
+                logger.info(f"Loaded model bundle {name}")
+                return True
+            return False
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_reload:
+            return
+        self._next_reload = now + DEBUG_MODEL_RELOAD_SECONDS
+        if not self._reload_lock.locked():
+            threading.Thread(target=self.reload_model, name='ml-model-load', daemon=True).start()
+
     def extract_features(self, diagnostic_data: Dict) -> np.ndarray:
         """Extract features from diagnostic data"""
         features = [
@@ -34,31 +112,124 @@ class MLDebugger:
             1 if diagnostic_data.get('status') == 'error' else 0
         ]
         return np.array(features).reshape(1, -1)
-        
-    def train_model(self, history_data: pd.DataFrame):
-        """Train the model on historical debug data"""
-        if len(history_data) < 2:  # Need minimum data to train
-            return
-            
-        X = history_data[['port_conflicts', 'asterisk_issues', 'syntax_errors', 'had_error']]
-        y = history_data['resolution_type']
-        
-        self.label_encoder.fit(y)
-        y_encoded = self.label_encoder.transform(y)
-        self.model.fit(X, y_encoded)
-        joblib.dump(self.model, self.model_path)
-        
+
+    def train_model(self) -> int:
+        """Update the model with history recorded since the last update
+
+        Only the new rows are read and fed to partial_fit, so the cost of an
+        update does not grow with the total history. The update is made on a
+        copy of the current model and published as a new bundle; a file lock
+        keeps processes sharing the model directory from training at once.
+
+        Returns:
+            int: Number of new records learned from
+        """
+        self.history.flush()
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Continue from whatever another process last published
+            self.reload_model()
+            current = self.bundle
+            if current is not None:
+                model = copy.deepcopy(current['model'])
+                label_encoder = current['label_encoder']
+                trained_through = current['trained_through']
+            else:
+                model = SGDClassifier(loss='log_loss', random_state=0)
+                label_encoder = LabelEncoder().fit(RESOLUTION_TYPES)
+                trained_through = 0
+
+            classes = np.arange(len(RESOLUTION_TYPES))
+            learned = 0
+            while True:
+                ids, X, resolutions = self.history.read_since(trained_through, TRAIN_CHUNK_ROWS)
+                if not len(ids):
+                    break
+                known = np.isin(resolutions, RESOLUTION_TYPES)
+                if known.any():
+                    y = label_encoder.transform(np.asarray(resolutions)[known])
+                    model.partial_fit(X[known], y, classes=classes)
+                    learned += int(known.sum())
+                trained_through = int(ids[-1])
+
+            if learned:
+                version = current['version'] + 1 if current is not None else 1
+                self._publish({
+                    'version': version,
+                    'name': f'debug_model-v{version}.joblib',
+                    'model': model,
+                    'label_encoder': label_encoder,
+                    'resolutions': RESOLUTION_TYPES,
+                    'trained_through': trained_through,
+                    'created': datetime.now().isoformat(),
+                })
+        return learned
+
+    def _publish(self, bundle):
+        """Write a bundle and point at it; readers never see a partial file"""
+        path = os.path.join(self.model_dir, bundle['name'])
+        tmp = f'{path}.tmp{os.getpid()}'
+        try:
+            joblib.dump(bundle, tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        tmp = f'{self.pointer_path}.tmp{os.getpid()}'
+        with open(tmp, 'w') as f:
+            f.write(bundle['name'])
+        os.replace(tmp, self.pointer_path)
+        with self._reload_lock:
+            self.bundle = bundle
+
+        # Old versions can go; a process still mapping one keeps its pages
+        stale = bundle['version'] - DEBUG_MODEL_KEEP_VERSIONS
+        for version in range(max(stale - DEBUG_MODEL_KEEP_VERSIONS, 1), stale + 1):
+            try:
+                os.remove(os.path.join(self.model_dir, f'debug_model-v{version}.joblib'))
+            except FileNotFoundError:
+                pass
+
+    def request_training(self):
+        """Have the background trainer pick up new history"""
+        # Threads do not survive fork: each process starts its own trainer
+        if self._trainer_pid != os.getpid():
+            self._train_requested = threading.Event()
+            self._trainer = threading.Thread(target=self._run_trainer, name='ml-trainer', daemon=True)
+            self._trainer.start()
+            self._trainer_pid = os.getpid()
+        self._train_requested.set()
+
+    def _run_trainer(self):
+        while True:
+            self._train_requested.wait()
+            self._train_requested.clear()
+            try:
+                learned = self.train_model()
+                if learned:
+                    logger.info(f"Model updated with {learned} records, now version {self.bundle['version']}")
+            except Exception as e:
+                logger.error(f"Model training failed: {e}")
+
     def predict_resolution(self, diagnostic_data: Dict) -> str:
         """Predict best resolution approach"""
-        if self.model is None or not os.path.exists(self.model_path):
+        self._maybe_reload()
+        bundle = self.bundle
+        if bundle is None:
             return 'auto_fix'  # Default to auto fix if no model
-            
+
         features = self.extract_features(diagnostic_data)
-        prediction = self.model.predict(features)
-        return self.label_encoder.inverse_transform(prediction)[0]
-        
+        prediction = bundle['model'].predict(features)
+        return bundle['label_encoder'].inverse_transform(prediction)[0]
+
     def save_diagnostic_record(self, diagnostic_data: Dict, resolution: str, success: bool):
-        """Save diagnostic record for future training"""
+        """Save diagnostic record for future training
+
+        Records are written in batches, when a batch fills up or its oldest
+        record is old enough; each written batch triggers a background model
+        update through the history's on_write callback.
+        """
         record = {
             'timestamp': datetime.now().isoformat(),
             'port_conflicts': len(diagnostic_data.get('port_conflicts', [])),
@@ -68,7 +239,135 @@ class MLDebugger:
             'resolution_type': resolution,
             'success': int(success)
         }
-        
-        df = pd.DataFrame([record])
-        mode = 'a' if os.path.exists(self.history_path) else 'w'
-        df.to_csv(self.history_path, mode=mode, header=(mode == 'w'), index=False)
+
+        self.history.append(record)
+
+
+def _benchmark(records=2000, history_sizes=(10000, 100000), new_rows=1000, predictions=20000):
+    """Write, update, load and prediction costs of the history and model bundle"""
+    import tempfile
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+
+    def random_record():
+        counts = rng.integers(0, 3, size=3)
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'port_conflicts': int(counts[0]),
+            'asterisk_issues': int(counts[1]),
+            'syntax_errors': int(counts[2]),
+            'had_error': int(counts.any()),
+            'resolution_type': RESOLUTION_TYPES[int(np.argmax(counts)) + 1] if counts.any() else 'auto_fix',
+            'success': 1,
+        }
+
+    results = {'updates': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Previous store: one DataFrame and one CSV append per record
+        csv_path = os.path.join(tmp, 'history.csv')
+        started = time.perf_counter()
+        for _ in range(records):
+            df = pd.DataFrame([random_record()])
+            mode = 'a' if os.path.exists(csv_path) else 'w'
+            df.to_csv(csv_path, mode=mode, header=(mode == 'w'), index=False)
+        results['csv_append_us'] = (time.perf_counter() - started) / records * 1e6
+
+        history = DiagnosticHistory(os.path.join(tmp, 'history.sqlite3'))
+        started = time.perf_counter()
+        for _ in range(records):
+            history.append(random_record())
+        history.flush()
+        results['sqlite_append_us'] = (time.perf_counter() - started) / records * 1e6
+
+        for size in history_sizes:
+            history = DiagnosticHistory(os.path.join(tmp, f'history-{size}.sqlite3'), batch_size=10000)
+            for _ in range(size):
+                history.append(random_record())
+            debugger = MLDebugger(os.path.join(tmp, f'model-{size}'), history)
+            history.on_write = None  # Updates are timed explicitly below
+            debugger.train_model()
+
+            for _ in range(new_rows):
+                history.append(random_record())
+            started = time.perf_counter()
+            debugger.train_model()
+            incremental = time.perf_counter() - started
+
+            # Previous path: load the whole history and refit from scratch
+            started = time.perf_counter()
+            frame = pd.read_sql_query('SELECT * FROM diagnostic_history', history._connection())
+            forest = RandomForestClassifier().fit(
+                frame[['port_conflicts', 'asterisk_issues', 'syntax_errors', 'had_error']],
+                frame['resolution_type'])
+            full = time.perf_counter() - started
+            results['updates'][size] = (incremental * 1000, full * 1000)
+
+        # Load time of the bundle, and of the previous RandomForest file for scale
+        bundle_path = os.path.join(debugger.model_dir, debugger.bundle['name'])
+        forest_path = os.path.join(tmp, 'forest.joblib')
+        joblib.dump(forest, forest_path)
+        for label, path in (('bundle', bundle_path), ('forest', forest_path)):
+            for mmap_mode in (None, 'r'):
+                started = time.perf_counter()
+                for _ in range(20):
+                    joblib.load(path, mmap_mode=mmap_mode)
+                results[f'load_{label}_{mmap_mode or "copy"}_ms'] = (time.perf_counter() - started) / 20 * 1000
+        results['forest_mb'] = os.path.getsize(forest_path) / 1e6
+
+        # Prediction latency while idle, then while another process-equivalent
+        # instance keeps training and publishing bundles that get swapped in
+        serving = MLDebugger(debugger.model_dir, history)
+        history.on_write = None
+        serving.reload_model()
+        sample = {'status': 'error', 'port_conflicts': [1, 2], 'syntax_errors': []}
+
+        def latencies():
+            timings = np.empty(predictions)
+            for i in range(predictions):
+                started = time.perf_counter()
+                serving.predict_resolution(sample)
+                timings[i] = time.perf_counter() - started
+            return timings * 1e6
+
+        results['predict_idle_us'] = latencies()
+        global DEBUG_MODEL_RELOAD_SECONDS
+        reload_seconds, DEBUG_MODEL_RELOAD_SECONDS = DEBUG_MODEL_RELOAD_SECONDS, 0.05
+        first_version = serving.bundle['version']
+        stop = threading.Event()
+
+        def keep_training():
+            while not stop.is_set():
+                for _ in range(200):
+                    history.append(random_record())
+                debugger.train_model()
+
+        trainer = threading.Thread(target=keep_training)
+        trainer.start()
+        try:
+            results['predict_training_us'] = latencies()
+        finally:
+            stop.set()
+            trainer.join()
+            DEBUG_MODEL_RELOAD_SECONDS = reload_seconds
+        results['swaps'] = serving.bundle['version'] - first_version
+    return results
+
+
+if __name__ == '__main__':
+    results = _benchmark()
+    print(f"append one record: CSV via pandas {results['csv_append_us']:7.1f} us, "
+          f"batched SQLite {results['sqlite_append_us']:6.1f} us")
+    for size, (incremental, full) in results['updates'].items():
+        print(f"history {size:6d} rows + 1000 new: incremental update {incremental:7.1f} ms, "
+              f"full RandomForest refit {full:8.1f} ms")
+    print(f"load SGD bundle: {results['load_bundle_copy_ms']:.2f} ms, "
+          f"mmap {results['load_bundle_r_ms']:.2f} ms")
+    print(f"load previous RandomForest ({results['forest_mb']:.1f} MB): "
+          f"{results['load_forest_copy_ms']:.1f} ms, mmap {results['load_forest_r_ms']:.1f} ms")
+    for label in ('idle', 'training'):
+        timings = results[f'predict_{label}_us']
+        print(f"predict_resolution while {label:8s}: p50 {np.percentile(timings, 50):6.1f} us, "
+              f"p99 {np.percentile(timings, 99):7.1f} us, max {timings.max():8.1f} us")
+    print(f"bundles swapped in during the run: {results['swaps']}")
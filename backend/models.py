@@ -1,24 +1,115 @@
 import os
 import json
+import threading
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 from datetime import datetime
+from backend import tracing
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# Connections kept per process; run_production raises the maximum to the request threads
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+# Seconds a thread waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
 
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pool_max = DB_POOL_MAX
+
+class BlockingConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """Threaded pool whose getconn waits for a free connection
+
+    ThreadedConnectionPool raises PoolError as soon as maxconn connections
+    are out, which the model functions would report as an empty result.
+
+    Args:
+        timeout (float): Seconds to wait before raising PoolError
+    """
+
+    def __init__(self, minconn, maxconn, *args, timeout=DB_POOL_TIMEOUT, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(
+                f"No database connection free within {self.timeout:.0f}s")
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._slots.release()
+
+def configure_db_pool(threads):
+    """Size this process's pool for a number of concurrent request threads
+
+    Takes effect when the pool is next created, so call it before first use
+    (or after reset_db_pool()).
+    """
+    global _pool_max
+    _pool_max = max(DB_POOL_MAX, threads)
+
+def get_db_pool():
+    """Return this process's connection pool, creating it on first use
+
+    The pool is tied to the process that created it: a worker forked from a
+    process that already had one opens its own instead of sharing sockets.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = BlockingConnectionPool(DB_POOL_MIN, _pool_max, DATABASE_URL)
+                _pool_pid = os.getpid()
+    return _pool
+
+def reset_db_pool():
+    """Forget the inherited pool in a freshly forked worker
+
+    The parent's connections are not closed here: closing them would end
+    the parent's sessions too.
+    """
+    global _pool, _pool_pid, _pool_lock
+    _pool = None
+    _pool_pid = None
+    _pool_lock = threading.Lock()
+
+def db_pool_stats():
+    """Connections of this process's pool by state; zeros before first use"""
+    pool = _pool if _pool_pid == os.getpid() else None
+    if pool is None:
+        return {'in_use': 0, 'idle': 0, 'max': _pool_max}
+    return {'in_use': len(pool._used), 'idle': len(pool._pool), 'max': pool.maxconn}
+
+@tracing.traced()
 def get_db_connection():
-    """Create a database connection"""
-    conn = psycopg2.connect(DATABASE_URL)
+    """Take a database connection from the pool"""
+    conn = get_db_pool().getconn()
     conn.autocommit = True
     return conn
 
 def close_db_connection(conn):
-    """Close the database connection"""
+    """Return the database connection to the pool"""
     if conn:
-        conn.close()
+        get_db_pool().putconn(conn, close=bool(conn.closed))
 
-def get_all_voices():
-    """Get all voices from the database"""
+@tracing.traced()
+def get_all_voices(raise_errors=False):
+    """Get all voices from the database
+
+    Args:
+        raise_errors (bool): Re-raise database errors instead of returning an
+            empty list, for callers that must not mistake an outage for an
+            empty catalog
+    """
     conn = None
     try:
         conn = get_db_connection()
@@ -42,10 +133,13 @@ def get_all_voices():
         return result
     except Exception as e:
         print(f"Database error: {e}")
+        if raise_errors:
+            raise
         return []
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
 def get_celebrity_voices():
     """Get only celebrity voices from the database"""
     conn = None
@@ -76,6 +170,7 @@ def get_celebrity_voices():
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
 def get_custom_voices():
     """Get only custom (non-celebrity) voices from the database"""
     conn = None
@@ -106,6 +201,7 @@ def get_custom_voices():
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
 def get_voice_by_id(voice_id):
     """Get a specific voice by ID"""
     conn = None
@@ -133,6 +229,28 @@ def get_voice_by_id(voice_id):
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
+def get_voice_catalog_version():
+    """Get a fingerprint of the voice catalog that changes whenever any voice does"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT count(*), md5(coalesce(string_agg(
+                id::text || ':' || name || ':' || coalesce(parameters::text, ''), ';' ORDER BY id
+            ), ''))
+            FROM voices
+        """)
+        count, digest = cur.fetchone()
+        return f"{count}-{digest}"
+    except Exception as e:
+        print(f"Database error: {e}")
+        return None
+    finally:
+        close_db_connection(conn)
+
+@tracing.traced()
 def add_voice(name, voice_type, accent, is_celebrity=False, parameters=None, file_path=None):
     """Add a new voice to the database"""
     conn = None
@@ -158,6 +276,7 @@ def add_voice(name, voice_type, accent, is_celebrity=False, parameters=None, fil
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
 def update_voice(voice_id, name=None, voice_type=None, accent=None, is_celebrity=None, parameters=None, file_path=None):
     """Update an existing voice in the database"""
     conn = None
@@ -200,6 +319,7 @@ def update_voice(voice_id, name=None, voice_type=None, accent=None, is_celebrity
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
 def delete_voice(voice_id):
     """Delete a voice from the database"""
     conn = None
@@ -224,6 +344,7 @@ def delete_voice(voice_id):
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
 def create_call_session(phone_number, voice_id, session_id, status="initiated", parameters=None):
     """Create a new call session"""
     conn = None
@@ -249,6 +370,7 @@ def create_call_session(phone_number, voice_id, session_id, status="initiated",
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
 def update_call_session_status(session_id, status, ended_at=None):
     """Update the status of a call session"""
     conn = None
@@ -276,6 +398,7 @@ def update_call_session_status(session_id, status, ended_at=None):
     finally:
         close_db_connection(conn)
 
+@tracing.traced()
 def get_call_session(session_id):
     """Get a specific call session by ID"""
     conn = None
@@ -307,6 +430,7 @@ def get_call_session(session_id):
         close_db_connection(conn)
 
 # Add many celebrity voices at once for initial database setup
+@tracing.traced()
 def add_celebrity_voices(celebrity_voices):
     """Add multiple celebrity voices at once"""
     conn = None
@@ -370,4 +494,263 @@ def add_celebrity_voices(celebrity_voices):
         print(f"Database error: {e}")
         return False
     finally:
-        close_db_connection(conn)
\ No newline at end of file
+        close_db_connection(conn)
+
+# Virtual number inventory: numbers are pre-generated or imported in bulk and
+# handed out from a per-country free list
+VIRTUAL_NUMBERS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS virtual_numbers (
+        id BIGSERIAL PRIMARY KEY,
+        number TEXT NOT NULL UNIQUE,
+        country TEXT NOT NULL,
+        platform TEXT NOT NULL DEFAULT 'asterisk',
+        user_id TEXT,
+        assigned_at TIMESTAMP
+    );
+    -- Free list: only unassigned rows, oldest first per country
+    CREATE INDEX IF NOT EXISTS virtual_numbers_free_idx
+        ON virtual_numbers (country, id) WHERE user_id IS NULL;
+    CREATE INDEX IF NOT EXISTS virtual_numbers_user_idx
+        ON virtual_numbers (user_id) WHERE user_id IS NOT NULL;
+"""
+
+@tracing.traced()
+def create_virtual_numbers_table():
+    """Create the virtual number inventory table and its indexes if missing"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        conn.autocommit = False
+        cur = conn.cursor()
+        with conn:
+            # Serialise concurrent workers creating the schema at startup
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('virtual_numbers_schema'))")
+            cur.execute(VIRTUAL_NUMBERS_SCHEMA)
+        return True
+    except Exception as e:
+        print(f"Database error: {e}")
+        return False
+    finally:
+        close_db_connection(conn)
+
+@tracing.traced()
+def add_virtual_numbers(numbers, country, platform='asterisk'):
+    """Add numbers to the inventory in bulk, skipping ones already present
+
+    Returns:
+        int: Numbers actually added, or None on error
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        inserted = psycopg2.extras.execute_values(cur, """
+            INSERT INTO virtual_numbers (number, country, platform)
+            VALUES %s
+            ON CONFLICT (number) DO NOTHING
+            RETURNING id
+        """, [(number, country, platform) for number in numbers], page_size=1000, fetch=True)
+        return len(inserted)
+    except Exception as e:
+        print(f"Database error: {e}")
+        return None
+    finally:
+        close_db_connection(conn)
+
+@tracing.traced()
+def allocate_virtual_number(user_id, country):
+    """Atomically assign the first free number of a country to a user
+
+    A single statement takes the head of the country's free list through the
+    partial index; SKIP LOCKED lets concurrent allocations take the next
+    free row instead of waiting on each other.
+
+    Returns:
+        dict: The assigned number, or None if the country has no free number
+        or on error
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute("""
+            UPDATE virtual_numbers
+            SET user_id = %s, assigned_at = NOW()
+            WHERE id = (
+                SELECT id FROM virtual_numbers
+                WHERE country = %s AND user_id IS NULL
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING number, country, platform, user_id, assigned_at
+        """, (user_id, country))
+        row = cur.fetchone()
+        return dict(row) if row else None
+    except Exception as e:
+        print(f"Database error: {e}")
+        return None
+    finally:
+        close_db_connection(conn)
+
+@tracing.traced()
+def get_user_virtual_numbers(user_id):
+    """Get the numbers assigned to a user, oldest first
+
+    Returns:
+        list: Assigned rows, or None on error
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute("""
+            SELECT number, country, platform, user_id, assigned_at
+            FROM virtual_numbers
+            WHERE user_id = %s
+            ORDER BY assigned_at, id
+        """, (user_id,))
+        return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Database error: {e}")
+        return None
+    finally:
+        close_db_connection(conn)
+
+@tracing.traced()
+def count_free_virtual_numbers(country=None):
+    """Free numbers per country (or for one country)
+
+    Returns:
+        dict: country -> free numbers, or None on error
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        if country is None:
+            cur.execute("""
+                SELECT country, count(*) FROM virtual_numbers
+                WHERE user_id IS NULL GROUP BY country
+            """)
+            return dict(cur.fetchall())
+        cur.execute("""
+            SELECT count(*) FROM virtual_numbers
+            WHERE country = %s AND user_id IS NULL
+        """, (country,))
+        return {country: cur.fetchone()[0]}
+    except Exception as e:
+        print(f"Database error: {e}")
+        return None
+    finally:
+        close_db_connection(conn)
+
+def _allocate_country(cur, country, user_ids, skip_locked):
+    """Pair free numbers of one country with user_ids by position
+
+    With skip_locked, rows other transactions hold are passed over in one
+    statement. Without it the statement waits for them and drops the ones
+    they assigned once they commit, so fewer rows than asked can come back
+    while free numbers remain; it is repeated for the users still waiting
+    until it finds no row and a re-count confirms the country is out.
+
+    Returns:
+        list: Assigned rows
+    """
+    remaining = list(user_ids)
+    assigned = []
+    for _ in range(5):
+        cur.execute(f"""
+            WITH free AS (
+                SELECT id, row_number() OVER (ORDER BY id) AS ord
+                FROM (
+                    SELECT id FROM virtual_numbers
+                    WHERE country = %s AND user_id IS NULL
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE{' SKIP LOCKED' if skip_locked else ''}
+                ) locked
+            ),
+            wanted AS (
+                SELECT user_id, ord FROM unnest(%s::text[]) WITH ORDINALITY AS w(user_id, ord)
+            )
+            UPDATE virtual_numbers v
+            SET user_id = wanted.user_id, assigned_at = NOW()
+            FROM free JOIN wanted USING (ord)
+            WHERE v.id = free.id
+            RETURNING v.number, v.country, v.platform, v.user_id, v.assigned_at
+        """, (country, len(remaining), remaining))
+        rows = cur.fetchall()
+        assigned.extend(rows)
+        # The k rows found always go to the first k users asked for
+        remaining = remaining[len(rows):]
+        if not remaining or skip_locked:
+            # The caller re-counts a short country and retries it waiting
+            break
+        if rows:
+            # Some candidates went to transactions that committed first
+            continue
+        cur.execute("SELECT count(*) FROM virtual_numbers WHERE country = %s AND user_id IS NULL",
+                    (country,))
+        if cur.fetchone()[0] == 0:
+            break
+    return assigned
+
+@tracing.traced()
+def allocate_virtual_numbers_bulk(user_ids_by_country, allow_partial=False):
+    """Assign free numbers to many users in one transaction
+
+    Each country's share is taken from the head of its free list with one
+    statement: the free rows are locked with SKIP LOCKED and paired with the
+    requested user ids by position.
+
+    SKIP LOCKED also passes over rows a concurrent allocation has locked but
+    may yet release, so a short country is re-counted before the shortage
+    is believed. If free rows remain, the batch is rolled back and taken
+    again waiting for those locks, countries in a fixed order so that two
+    waiting batches cannot deadlock on each other.
+
+    Args:
+        user_ids_by_country (dict): country -> list of user ids, one number each
+        allow_partial (bool): Commit what could be assigned when a country
+            runs short; by default a shortage rolls the whole batch back
+
+    Returns:
+        tuple: (assigned rows, shortages) where shortages maps each short
+        country to (requested, available); rows is empty if the batch was
+        rolled back. None on error.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        conn.autocommit = False
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        for skip_locked in (True, False):
+            assigned = []
+            shortages = {}
+            countries = sorted(user_ids_by_country, key=str) if not skip_locked else user_ids_by_country
+            with conn:
+                for country in countries:
+                    user_ids = user_ids_by_country[country]
+                    rows = _allocate_country(cur, country, user_ids, skip_locked)
+                    if len(rows) < len(user_ids):
+                        shortages[country] = (len(user_ids), len(rows))
+                    assigned.extend(dict(row) for row in rows)
+                if shortages and skip_locked:
+                    cur.execute("""
+                        SELECT count(*) FROM virtual_numbers
+                        WHERE country = ANY(%s) AND user_id IS NULL
+                    """, (list(shortages),))
+                    if cur.fetchone()[0]:
+                        # Free rows exist but were locked; retry waiting for them
+                        conn.rollback()
+                        continue
+                if shortages and not allow_partial:
+                    conn.rollback()
+                    return [], shortages
+            return assigned, shortages
+    except Exception as e:
+        print(f"Database error: {e}")
+        return None
+    finally:
+        close_db_connection(conn)
@@ -6,6 +6,10 @@ import random
 import string
 import threading
 from backend import models
+from backend import tracing
+from backend.call_registry import CallRegistry
+from backend.ami_health import ami_health
+from backend.dialplan import DialplanRenderer, render_dialplan
 
 # Asterisk AMI (Asterisk Manager Interface) credentials
 ASTERISK_HOST = os.environ.get('ASTERISK_HOST')
@@ -19,15 +23,36 @@ class PhoneCallManager:
     def __init__(self):
         """Initialize the phone call manager"""
         self.ami_socket = None
-        self.active_calls = {}
+        self.active_calls = CallRegistry()
+        self.dialplan_renderer = DialplanRenderer()
 
+    def reset_after_fork(self):
+        """Drop the AMI session inherited from the parent process
+
+        The keepalive thread does not exist in a forked child, and the socket
+        is the parent's session; the child's next call opens its own.
+        """
+        self._keepalive_running = False
+        self._keepalive_thread = None
+        if self.ami_socket:
+            try:
+                # Only releases this process's descriptor; no logoff is sent
+                self.ami_socket.close()
+            except Exception:
+                pass
+            self.ami_socket = None
+
+    @tracing.traced()
     def _connect_to_ami(self, retry_count=5, retry_delay=3):
-        """Connect to the Asterisk Manager Interface with improved retry mechanism"""
         """Connect to the Asterisk Manager Interface with retry mechanism
 
+        Attempts go through the shared AMI circuit breaker: while Asterisk is
+        known to be unreachable this fails fast instead of blocking the caller.
+
         Args:
             retry_count (int): Number of connection attempts before giving up
-            retry_delay (int): Delay in seconds between retry attempts
+            retry_delay (int): Upper bound in seconds on the jittered delay
+                between retry attempts
 
         Returns:
             bool: True if connection succeeded, False otherwise
@@ -47,6 +72,11 @@ class PhoneCallManager:
 
         # Try to connect with retries
         for attempt in range(retry_count):
+            if not ami_health.allow_request():
+                print(f"Asterisk AMI circuit is {ami_health.state}, not connecting "
+                      f"(next probe in {ami_health.time_until_retry():.1f}s)")
+                return False
+
             try:
                 print(f"Connecting to Asterisk AMI ({attempt + 1}/{retry_count})...")
 
@@ -55,16 +85,10 @@ class PhoneCallManager:
                 self.ami_socket.settimeout(10)  # Set a timeout for connection
                 self.ami_socket.connect((ASTERISK_HOST, ASTERISK_PORT))
 
-                # Read the welcome message
-                welcome = self._read_response()
+                # Read the welcome message (a single banner line)
+                welcome = self._read_banner()
                 if not welcome:
-                    print("Did not receive welcome message from Asterisk AMI")
-                    self.ami_socket.close()
-                    self.ami_socket = None
-                    if attempt < retry_count - 1:
-                        print(f"Retrying in {retry_delay} seconds...")
-                        time.sleep(retry_delay)
-                    continue
+                    raise ConnectionError("Did not receive welcome message from Asterisk AMI")
 
                 # Login to AMI
                 login_cmd = (
@@ -76,46 +100,40 @@ class PhoneCallManager:
                 self.ami_socket.send(login_cmd.encode())
                 login_response = self._read_response()
 
-                if "Success" in login_response:
-                    print("Successfully connected to Asterisk AMI")
+                if "Success" not in login_response:
+                    raise ConnectionError(f"Failed to authenticate with Asterisk AMI: {login_response}")
 
-                    # Set up a keepalive ping
-                    self._start_keepalive()
+                print("Successfully connected to Asterisk AMI")
+                ami_health.record_success()
 
-                    return True
-                else:
-                    print(f"Failed to authenticate with Asterisk AMI: {login_response}")
-                    self.ami_socket.close()
-                    self.ami_socket = None
-                    if attempt < retry_count - 1:
-                        print(f"Retrying in {retry_delay} seconds...")
-                        time.sleep(retry_delay)
+                # Set up a keepalive ping
+                self._start_keepalive()
+
+                return True
             except socket.timeout:
-                print("Connection to Asterisk AMI timed out")
-                if self.ami_socket:
-                    try:
-                        self.ami_socket.close()
-                    except:
-                        pass
-                    self.ami_socket = None
-                if attempt < retry_count - 1:
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
+                self._connection_attempt_failed("Connection to Asterisk AMI timed out")
             except Exception as e:
-                print(f"Error connecting to Asterisk AMI: {e}")
-                if self.ami_socket:
-                    try:
-                        self.ami_socket.close()
-                    except:
-                        pass
-                    self.ami_socket = None
-                if attempt < retry_count - 1:
-                    print(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
+                self._connection_attempt_failed(f"Error connecting to Asterisk AMI: {e}")
+
+            if attempt < retry_count - 1 and ami_health.state == 'closed':
+                delay = min(retry_delay, ami_health.backoff(attempt))
+                print(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
 
         print("All connection attempts to Asterisk AMI failed")
         return False
 
+    def _connection_attempt_failed(self, message):
+        """Close the half-open socket and report the failure to the breaker"""
+        print(message)
+        if self.ami_socket:
+            try:
+                self.ami_socket.close()
+            except:
+                pass
+            self.ami_socket = None
+        ami_health.record_failure(message)
+
     def _start_keepalive(self):
         """Start a background thread to keep the AMI connection alive"""
         if hasattr(self, '_keepalive_thread') and self._keepalive_thread and self._keepalive_thread.is_alive():
@@ -157,14 +175,49 @@ class PhoneCallManager:
 
                 if not response or "Error" in response:
                     print("AMI connection may be dead, attempting to reconnect...")
-                    self._connect_to_ami()
+                    self._reconnect_from_keepalive()
             except Exception as e:
                 print(f"Error in keepalive thread: {e}")
                 try:
-                    self._connect_to_ami()
+                    self._reconnect_from_keepalive()
                 except:
                     pass
 
+    def _reconnect_from_keepalive(self):
+        """Reconnect after a failed ping, backing off while the breaker is open"""
+        ami_health.record_failure("Keepalive ping failed")
+        while self._keepalive_running:
+            wait = ami_health.time_until_retry()
+            if wait > 0:
+                time.sleep(wait)
+            if self._connect_to_ami(retry_count=1):
+                return True
+            if ami_health.state == 'closed':
+                # Below the failure threshold; back off before trying again
+                time.sleep(ami_health.backoff(ami_health.consecutive_failures))
+        return False
+
+    def _read_banner(self, timeout=5):
+        """Read the one-line 'Asterisk Call Manager/x.y' greeting from the AMI socket"""
+        if not self.ami_socket:
+            return ""
+
+        self.ami_socket.settimeout(timeout)
+
+        try:
+            banner = b""
+            while not banner.endswith(b"\r\n"):
+                chunk = self.ami_socket.recv(1)
+                if not chunk:
+                    break
+                banner += chunk
+            return banner.decode()
+        except socket.timeout:
+            return ""
+        except Exception as e:
+            print(f"Error reading from AMI socket: {e}")
+            return ""
+
     def _read_response(self, timeout=5):
         """Read a response from the AMI socket"""
         if not self.ami_socket:
@@ -184,6 +237,8 @@ class PhoneCallManager:
                 # Check if we've reached the end of the response
                 if "\r\n\r\n" in response:
                     break
+            if "Event: " in response:
+                self._handle_ami_events(response)
             return response
         except socket.timeout:
             return ""
@@ -191,12 +246,46 @@ class PhoneCallManager:
             print(f"Error reading from AMI socket: {e}")
             return ""
 
+    def _handle_ami_events(self, text):
+        """Finish tracked calls from AMI events read along with a response
+
+        OriginateResponse ties a call to its channel (or fails it), and a
+        Hangup on that channel finishes it, so calls ended by the remote side
+        leave the registry after its TTL like calls ended through the API.
+        """
+        for block in text.split("\r\n\r\n"):
+            fields = {}
+            for line in block.split("\r\n"):
+                key, sep, value = line.partition(": ")
+                if sep:
+                    fields[key] = value
+            event = fields.get('Event')
+            if event == 'OriginateResponse':
+                call_id = fields.get('ActionID')
+                if fields.get('Response') == 'Success':
+                    self.active_calls.set_channel(call_id, fields.get('Channel'))
+                    self.active_calls.update_status(call_id, 'in-progress')
+                elif self.active_calls.finish(call_id, 'failed'):
+                    models.update_call_session_status(call_id, 'failed')
+            elif event == 'Hangup':
+                record = self.active_calls.find_by_channel(fields.get('Channel'))
+                if record is not None and not record.finished:
+                    self.active_calls.finish(record.call_id, 'completed')
+                    models.update_call_session_status(record.call_id, 'completed')
+
+    def _send_action(self, action, command):
+        """Send an AMI action and read its response, traced as one round trip"""
+        with tracing.span(f'ami.{action}'):
+            self.ami_socket.send(command.encode())
+            return self._read_response()
+
     def is_configured(self):
         """Check if Asterisk is properly configured"""
         return (ASTERISK_HOST is not None and 
                 ASTERISK_USERNAME is not None and 
                 ASTERISK_SECRET is not None)
 
+    @tracing.traced()
     def start_call(self, to_number, voice_id=None, callback_url=None):
         """Start a new phone call with voice transformation"""
         if not self.is_configured():
@@ -243,20 +332,15 @@ class PhoneCallManager:
                 f"\r\n"
             )
 
-            # Send the command
-            self.ami_socket.send(originate_cmd.encode())
-
-            # Read the response
-            response = self._read_response()
+            response = self._send_action('Originate', originate_cmd)
 
             # Store this active call
-            self.active_calls[call_id] = {
-                'status': 'initiated',
-                'to_number': cleaned_number,
-                'voice_id': voice_id,
-                'parameters': voice_params,
-                'start_time': time.time()
-            }
+            self.active_calls.add(
+                call_id,
+                to_number=cleaned_number,
+                voice_id=voice_id,
+                parameters=voice_params
+            )
 
             # Store call session in database
             models.create_call_session(
@@ -277,6 +361,7 @@ class PhoneCallManager:
                 'message': f'Failed to start call: {str(e)}'
             }
 
+    @tracing.traced()
     def end_call(self, call_id):
         """End an active call"""
         if not self.is_configured():
@@ -315,19 +400,13 @@ class PhoneCallManager:
                 f"\r\n"
             )
 
-            # Send the command
-            self.ami_socket.send(hangup_cmd.encode())
-
-            # Read the response
-            response = self._read_response()
+            response = self._send_action('Hangup', hangup_cmd)
 
             # Update the call session in the database
             models.update_call_session_status(call_id, 'completed')
 
-            # Update our local tracking
-            if call_id in self.active_calls:
-                self.active_calls[call_id]['status'] = 'completed'
-                self.active_calls[call_id]['end_time'] = time.time()
+            # Update our local tracking; the record expires after the registry TTL
+            self.active_calls.finish(call_id, 'completed')
 
             return {
                 'success': True,
@@ -339,6 +418,7 @@ class PhoneCallManager:
                 'message': f'Failed to end call: {str(e)}'
             }
 
+    @tracing.traced()
     def get_call_status(self, call_id):
         """Get the status of a call"""
         if not self.is_configured():
@@ -349,22 +429,15 @@ class PhoneCallManager:
 
         try:
             # First, check our local cache of active calls
-            if call_id in self.active_calls:
-                call_info = self.active_calls[call_id]
-                duration = 0
-                if 'start_time' in call_info:
-                    if 'end_time' in call_info:
-                        duration = int(call_info['end_time'] - call_info['start_time'])
-                    else:
-                        duration = int(time.time() - call_info['start_time'])
-
+            call_info = self.active_calls.get(call_id)
+            if call_info:
                 return {
                     'success': True,
-                    'status': call_info['status'],
+                    'status': call_info.status,
                     'direction': 'outbound',
-                    'duration': duration,
+                    'duration': call_info.duration(),
                     'from': ASTERISK_EXTENSION,
-                    'to': call_info['to_number']
+                    'to': call_info.to_number
                 }
 
             # If not in our cache, try to connect to AMI and check
@@ -394,11 +467,7 @@ class PhoneCallManager:
                 f"\r\n"
             )
 
-            # Send the command
-            self.ami_socket.send(status_cmd.encode())
-
-            # Read the response
-            response = self._read_response()
+            response = self._send_action('Status', status_cmd)
 
             # Parse the response to determine the call status
             # This would need to be adapted based on the actual output format
@@ -438,65 +507,17 @@ class PhoneCallManager:
         In Asterisk, we would create a custom dialplan instead of using TwiML.
         This would be included in the extensions.conf file on the Asterisk server.
         """
-        dialplan = []
-
-        # A sample dialplan for voice transformation
-        dialplan.append("[voice-changer]")
-
-        if voice_id:
-            # Get voice details if available
-            voice = models.get_voice_by_id(voice_id)
-            if voice:
-                voice_name = voice.get('name', 'Custom Voice')
-                voice_params = voice.get('parameters', {})
-
-                # Add voice parameters as variables
-                dialplan.append(f"exten => s,1,Set(VOICE_ID={voice_id})")
-                dialplan.append(f"exten => s,n,Set(VOICE_NAME={voice_name})")
-                dialplan.append(f"exten => s,n,Set(VOICE_PITCH={voice_params.get('pitch', 0)})")
-                dialplan.append(f"exten => s,n,Set(VOICE_FORMANT={voice_params.get('formant', 0)})")
-                dialplan.append(f"exten => s,n,Set(VOICE_EFFECT={voice_params.get('effect', 'none')})")
-
-                # Add a greeting with the voice name
-                dialplan.append(f'exten => s,n,Playback(custom/voice-changer-greeting)')
-                dialplan.append(f'exten => s,n,SayAlpha({voice_name})')
-
-                # Apply voice transformation (this would require a custom Asterisk module/app)
-                dialplan.append(f'exten => s,n,VoiceTransform(${VOICE_ID},${VOICE_PITCH},${VOICE_FORMANT},${VOICE_EFFECT})')
-            else:
-                # Default greeting if voice not found
-                dialplan.append('exten => s,1,Playback(custom/voice-changer-greeting)')
-        else:
-            # Default greeting with no voice transformation
-            dialplan.append('exten => s,1,Playback(custom/voice-changer-greeting)')
-
-        # Add options for the caller
-        dialplan.append('exten => s,n,Background(custom/voice-options)')
-        dialplan.append('exten => s,n,WaitExten(10)')
-
-        # Add handlers for different DTMF options
-        dialplan.append('exten => 1,1,Playback(custom/original-voice)')
-        dialplan.append('exten => 1,n,Set(VOICE_TRANSFORM=0)')
-        dialplan.append('exten => 1,n,Goto(voice-changer-call,s,1)')
-
-        dialplan.append('exten => 2,1,Playback(custom/transformed-voice)')
-        dialplan.append('exten => 2,n,Set(VOICE_TRANSFORM=1)')
-        dialplan.append('exten => 2,n,Goto(voice-changer-call,s,1)')
-
-        # Default timeout or invalid option
-        dialplan.append('exten => t,1,Playback(custom/no-selection)')
-        dialplan.append('exten => t,n,Goto(s,1)')
-        dialplan.append('exten => i,1,Playback(custom/invalid-selection)')
-        dialplan.append('exten => i,n,Goto(s,1)')
-
-        # Add the actual call context
-        dialplan.append('')
-        dialplan.append('[voice-changer-call]')
-        dialplan.append('exten => s,1,Dial(${ARG1},30)')
-        dialplan.append('exten => s,n,Hangup()')
-
-        # Join the dialplan lines with newlines
-        return '\n'.join(dialplan)
+        voice = models.get_voice_by_id(voice_id) if voice_id else None
+        return render_dialplan(voice_id, voice)
+
+    def generate_bulk_dialplan(self):
+        """Render the extensions.conf fragment for every voice in the catalog
+
+        Returns:
+            tuple: (catalog version, iterator over dialplan text chunks)
+        """
+        version = self.dialplan_renderer.refresh()
+        return version, self.dialplan_renderer.iter_dialplan()
 
     def handle_asterisk_dtmf(self, digit, call_id):
         """Handle DTMF tones during an Asterisk call."""
@@ -1,8 +1,30 @@
 
 import os
 import json
+import time
 import random
-from datetime import datetime
+from backend import models
+
+# Candidates generated per bulk insert when pre-generating inventory
+PREGENERATE_BATCH = 1000
+# Most numbers one bulk provisioning request may reserve
+NUMBERS_BULK_MAX = int(os.environ.get('NUMBERS_BULK_MAX', '10000'))
+# Allocation attempts while concurrent requests hold every free row locked
+NUMBERS_ALLOCATE_ATTEMPTS = int(os.environ.get('NUMBERS_ALLOCATE_ATTEMPTS', '5'))
+
+
+class NumberPoolExhausted(Exception):
+    """Raised when a country has no free number left in the inventory
+
+    Args:
+        message (str): Error message
+        shortages (dict): country -> (requested, available) for bulk requests
+    """
+
+    def __init__(self, message, shortages=None):
+        super().__init__(message)
+        self.shortages = shortages or {}
+
 
 class PhoneNumberManager:
     def __init__(self):
@@ -16,6 +38,7 @@ class PhoneNumberManager:
         
         # Load platform config
         self.load_platform_config()
+        self._inventory_ready = False
         
     def load_platform_config(self):
         """Load platform configuration from environment or default to Asterisk"""
@@ -82,14 +105,185 @@ class PhoneNumberManager:
         # Implementation for when Vonage is selected
         return self._generate_asterisk_number(country_code)  # Fallback for now
         
-    def assign_number_to_user(self, user_id, country_code='US'):
-        """Assign a virtual number to a user using the configured platform"""
-        number = self.generate_virtual_number(country_code)
-        
+    def _ensure_inventory(self):
+        """Create the inventory table on first use in this process"""
+        if not self._inventory_ready:
+            self._inventory_ready = models.create_virtual_numbers_table()
+
+    def pregenerate_numbers(self, country_code, count):
+        """Add `count` new numbers for a country to the inventory
+
+        Candidates are generated in batches and inserted in bulk; numbers
+        already in the inventory are skipped, so the loop tops up until
+        `count` have been added.
+
+        Returns:
+            int: Numbers added
+        """
+        self._ensure_inventory()
+        added = 0
+        attempts = 0
+        while added < count and attempts < 10 * (count // PREGENERATE_BATCH + 1):
+            attempts += 1
+            wanted = min(PREGENERATE_BATCH, count - added)
+            candidates = {self.generate_virtual_number(country_code) for _ in range(wanted)}
+            inserted = models.add_virtual_numbers(candidates, country_code, self.virtual_number_platform)
+            if inserted is None:
+                break
+            added += inserted
+        return added
+
+    def import_numbers(self, numbers, country_code):
+        """Add numbers bought or provisioned elsewhere to the inventory
+
+        Returns:
+            int: Numbers added (invalid and already known numbers are skipped)
+        """
+        self._ensure_inventory()
+        valid = [n for n in numbers if self._validate_asterisk_number(n)]
+        return models.add_virtual_numbers(valid, country_code, self.virtual_number_platform) or 0
+
+    def _format_assignment(self, row):
         return {
-            'number': number,
-            'country': country_code,
-            'platform': self.virtual_number_platform,
-            'assigned_at': datetime.now().isoformat(),
-            'user_id': user_id
+            'number': row['number'],
+            'country': row['country'],
+            'platform': row['platform'],
+            'assigned_at': row['assigned_at'].isoformat(),
+            'user_id': row['user_id']
         }
+
+    def assign_number_to_user(self, user_id, country_code='US'):
+        """Assign a free number from the country's inventory to a user
+
+        SKIP LOCKED passes over rows other allocations have locked, so an
+        empty result while free numbers remain means they were all in flight;
+        the allocation is retried a few times before giving up.
+
+        Raises:
+            NumberPoolExhausted: If the country has no free number left
+        """
+        self._ensure_inventory()
+        for attempt in range(NUMBERS_ALLOCATE_ATTEMPTS):
+            row = models.allocate_virtual_number(user_id, country_code)
+            if row is not None:
+                return self._format_assignment(row)
+            free = models.count_free_virtual_numbers(country_code)
+            if free is None:
+                break
+            if free[country_code] == 0:
+                raise NumberPoolExhausted(f"No free virtual numbers left for {country_code}")
+            time.sleep(0.005 * (attempt + 1))
+        raise Exception("Could not allocate a virtual number")
+
+    def assign_numbers_bulk(self, assignments, allow_partial=False):
+        """Reserve one number per (user_id, country_code) pair in one transaction
+
+        Args:
+            assignments (list): (user_id, country_code) pairs
+            allow_partial (bool): Keep what could be assigned when a country
+                runs short instead of assigning nothing
+
+        Returns:
+            tuple: (assignments, shortages) where shortages maps each short
+            country to (requested, available)
+
+        Raises:
+            NumberPoolExhausted: If a country runs short and allow_partial is False
+        """
+        self._ensure_inventory()
+        user_ids_by_country = {}
+        for user_id, country_code in assignments:
+            user_ids_by_country.setdefault(country_code, []).append(user_id)
+
+        result = models.allocate_virtual_numbers_bulk(user_ids_by_country, allow_partial)
+        if result is None:
+            raise Exception("Could not allocate virtual numbers")
+        rows, shortages = result
+        if shortages and not allow_partial:
+            short = ', '.join(f"{country} ({available} of {requested})"
+                              for country, (requested, available) in shortages.items())
+            raise NumberPoolExhausted(f"Not enough free virtual numbers for {short}", shortages)
+        return [self._format_assignment(row) for row in rows], shortages
+
+    def get_user_numbers(self, user_id):
+        """Numbers assigned to a user, oldest first"""
+        self._ensure_inventory()
+        rows = models.get_user_virtual_numbers(user_id)
+        if rows is None:
+            raise Exception("Could not read the user's virtual numbers")
+        return [self._format_assignment(row) for row in rows]
+
+
+def _allocate_worker(args):
+    country, user_prefix, allocations = args
+    manager = PhoneNumberManager()
+    numbers = []
+    for i in range(allocations):
+        numbers.append(manager.assign_number_to_user(f'{user_prefix}-{i}', country)['number'])
+    return numbers
+
+
+def _benchmark(allocations=5000, workers=(1, 4, 8), bulk_batch=10000, country='ZZ'):
+    """Allocations per second with concurrent worker processes, and in bulk
+
+    Needs DATABASE_URL. Uses a throwaway country code whose numbers are
+    removed afterwards, and checks that no number is handed out twice.
+    """
+    import multiprocessing
+
+    manager = PhoneNumberManager()
+    manager._ensure_inventory()
+    results = {}
+    try:
+        for processes in workers:
+            per_worker = allocations // processes
+            total = per_worker * processes
+            models.add_virtual_numbers([f'+999{i:09d}' for i in range(total)], country)
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                started = time.perf_counter()
+                batches = pool.map(_allocate_worker,
+                                   [(country, f'bench-{processes}-{w}', per_worker) for w in range(processes)])
+                elapsed = time.perf_counter() - started
+            numbers = [number for batch in batches for number in batch]
+            results[processes] = (total / elapsed, len(numbers) == len(set(numbers)) == total)
+            _delete_country(country)
+
+        # One bulk request reserving bulk_batch numbers in a single transaction
+        models.add_virtual_numbers([f'+999{i:09d}' for i in range(bulk_batch)], country)
+        started = time.perf_counter()
+        assigned, _ = manager.assign_numbers_bulk([(f'bulk-{i}', country) for i in range(bulk_batch)])
+        elapsed = time.perf_counter() - started
+        numbers = [a['number'] for a in assigned]
+        results['bulk'] = (bulk_batch / elapsed, len(numbers) == len(set(numbers)) == bulk_batch)
+    finally:
+        _delete_country(country)
+    return results
+
+
+def _delete_country(country):
+    conn = models.get_db_connection()
+    try:
+        conn.cursor().execute("DELETE FROM virtual_numbers WHERE country = %s", (country,))
+    finally:
+        models.close_db_connection(conn)
+
+
+if __name__ == '__main__':
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'benchmark'
+    if command == 'pregenerate':
+        # python -m backend.phone_numbers pregenerate US 10000
+        added = PhoneNumberManager().pregenerate_numbers(sys.argv[2], int(sys.argv[3]))
+        print(f"Added {added} numbers for {sys.argv[2]}")
+    elif command == 'import':
+        # python -m backend.phone_numbers import US numbers.txt (one number per line)
+        with open(sys.argv[3]) as f:
+            numbers = [line.strip() for line in f if line.strip()]
+        added = PhoneNumberManager().import_numbers(numbers, sys.argv[2])
+        print(f"Imported {added} of {len(numbers)} numbers for {sys.argv[2]}")
+    else:
+        for processes, (rate, unique) in _benchmark().items():
+            label = 'one 10k bulk request' if processes == 'bulk' else f'{processes} worker processes'
+            print(f"{label:>22}: {rate:8.0f} allocations/s, "
+                  f"{'no duplicates' if unique else 'DUPLICATE OR MISSING ALLOCATIONS'}")
@@ -0,0 +1,313 @@
+"""
+Pitch shifting for the voice engine, with two algorithms.
+
+'psola' is time-domain pitch-synchronous overlap-add. Grains two periods
+long are cut around analysis marks spaced one detected period apart and
+laid down at synthesis marks spaced period / ratio apart. Its latency is
+a few pitch periods (about 34 ms at 8 kHz), so it is the default for live
+calls. Unvoiced input falls back to grains laid down unshifted.
+
+'vocoder' is a phase vocoder that moves STFT bins to k * ratio and carries
+each bin's true frequency forward in the synthesis phase. It handles the
+catalog's extremes (-6..+10 semitones) more cleanly, but the long analysis
+frame makes it better suited to offline rendering.
+
+The `pitch` voice parameter is in semitones.
+"""
+import os
+import threading
+
+import numpy as np
+
+from backend.voice_engine import Stage, STFTStage
+from backend.formant import frame_size
+
+PITCH_MODES = ('psola', 'vocoder')
+LIVE_PITCH_MODE = os.environ.get('VOICE_PITCH_MODE_LIVE', 'psola')
+OFFLINE_PITCH_MODE = os.environ.get('VOICE_PITCH_MODE_OFFLINE', 'vocoder')
+
+# Pitch range PSOLA tracks; outside it input is treated as unvoiced
+MIN_PITCH_HZ = 75
+MAX_PITCH_HZ = 400
+# Normalized autocorrelation a period must reach to count as voiced
+VOICING_THRESHOLD = 0.5
+
+# Phase vocoder frame of 64 ms (512 samples at 8 kHz) with 75% overlap
+VOCODER_FRAME_SECONDS = 0.064
+VOCODER_OVERLAP = 4
+
+_bin_maps = {}
+_bin_maps_lock = threading.Lock()
+
+
+def pitch_ratio(semitones):
+    return 2.0 ** (semitones / 12.0)
+
+
+def resolve_pitch_mode(requested=None, params=None, aligned=False):
+    """Pick the pitch algorithm: request, then voice parameters, then default
+
+    An unknown mode stored on a voice falls back to the default rather than
+    breaking calls with that voice.
+
+    Raises:
+        ValueError: If an unknown mode is requested
+    """
+    if requested:
+        if requested not in PITCH_MODES:
+            raise ValueError(f"Unknown pitch mode: {requested}")
+        return requested
+    mode = (params or {}).get('pitch_mode')
+    if mode in PITCH_MODES:
+        return mode
+    return OFFLINE_PITCH_MODE if aligned else LIVE_PITCH_MODE
+
+
+def create_pitch_shifter(semitones, sample_rate, mode, channels=1):
+    if mode == 'vocoder':
+        return VocoderPitchShifter(semitones, sample_rate, channels)
+    return PSOLAPitchShifter(semitones, sample_rate, channels)
+
+
+class PSOLAPitchShifter(Stage):
+    """Streaming time-domain PSOLA
+
+    Pitch marks follow the channel mix, so channels are not independent
+    and the stage cannot carry a batch of calls.
+
+    Args:
+        semitones (float): Pitch shift
+        sample_rate (int): Sample rate of the stream
+        channels (int): Channels per block (marks follow the channel mix)
+    """
+
+    batchable = False
+
+    def __init__(self, semitones, sample_rate, channels=1):
+        self.ratio = pitch_ratio(semitones)
+        self.channels = channels
+        self.min_period = sample_rate // MAX_PITCH_HZ
+        self.max_period = -(-sample_rate // MIN_PITCH_HZ)
+        self.unvoiced_period = sample_rate // 100
+        # A grain for a synthesis mark needs input up to 1.5 periods ahead of
+        # it, and output is final one period behind the next mark
+        self.latency = -(-5 * self.max_period // 2) + 1
+        # Autocorrelation analysis span: lags up to max_period over 2 periods
+        self._span = 3 * self.max_period
+        self._n_corr = 1 << (2 * self._span - 1).bit_length()
+        self._windows = {}
+        self.reset()
+
+    def reset(self):
+        history = 2 * self.max_period
+        # Absolute sample positions; input sample 0 is the first one pushed
+        self._buffer = np.zeros((self.channels, history), dtype=np.float32)
+        self._buffer_start = -history
+        self._available = 0
+        self._output = np.zeros((self.channels, 0), dtype=np.float32)
+        self._output_start = -self.latency  # First output sample not yet emitted
+        self._analysis = 0  # Current analysis mark
+        self._analysis_period = self.unvoiced_period
+        self._voiced = False
+        self._synthesis = 0  # Next synthesis mark
+
+    def _window(self, period):
+        window = self._windows.get(period)
+        if window is None:
+            window = self._windows[period] = np.hanning(2 * period + 1).astype(np.float32)
+        return window
+
+    def _estimate_period(self, mark):
+        """Period at an analysis mark from normalized autocorrelation"""
+        end = mark + self.max_period - self._buffer_start
+        segment = self._buffer[:, max(0, end - self._span):end].mean(axis=0)
+        segment = segment - segment.mean()
+        energy = float(np.dot(segment, segment))
+        if energy < 1e-6:
+            return self.unvoiced_period, False
+        spectrum = np.fft.rfft(segment, n=self._n_corr)
+        corr = np.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, n=self._n_corr)
+        lags = corr[self.min_period:self.max_period + 1]
+        best = int(np.argmax(lags))
+        if lags[best] / energy < VOICING_THRESHOLD:
+            return self.unvoiced_period, False
+        return best + self.min_period, True
+
+    def _add_grain(self, centre, source, period):
+        start = source - period - self._buffer_start
+        grain = self._buffer[:, start:start + 2 * period + 1] * self._window(period)
+        offset = centre - period - self._output_start
+        needed = offset + grain.shape[1]
+        if needed > self._output.shape[1]:
+            self._output = np.concatenate(
+                (self._output, np.zeros((self.channels, needed - self._output.shape[1]),
+                                        dtype=np.float32)), axis=1)
+        self._output[:, offset:needed] += grain
+
+    def process(self, block):
+        self._buffer = np.concatenate((self._buffer, block), axis=1)
+        self._available += block.shape[1]
+
+        while self._synthesis + 3 * self.max_period // 2 <= self._available:
+            # Move the analysis mark to the one nearest the synthesis mark
+            while self._analysis + self._analysis_period // 2 < self._synthesis:
+                self._analysis += self._analysis_period
+                self._analysis_period, self._voiced = self._estimate_period(self._analysis)
+            period = self._analysis_period
+            self._add_grain(self._synthesis, self._analysis, period)
+            step = period / self.ratio if self._voiced else period
+            self._synthesis += max(1, int(round(step)))
+
+        # Emit everything the input has paid for; grains still to come start
+        # at least one period before the next synthesis mark
+        end = self._available - self.latency
+        count = end - self._output_start
+        out = np.zeros((self.channels, count), dtype=np.float32)
+        ready = min(count, self._output.shape[1])
+        out[:, :ready] = self._output[:, :ready]
+        self._output = self._output[:, ready:]
+        self._output_start = end
+
+        # Keep enough history for the earliest grain or analysis span still needed
+        keep_from = min(self._analysis, self._synthesis) - 2 * self.max_period - self._buffer_start
+        if keep_from > 0:
+            self._buffer = self._buffer[:, keep_from:]
+            self._buffer_start += keep_from
+        return out
+
+
+def get_bin_map(bins, ratio):
+    """Source bin feeding every output bin for a pitch ratio, cached
+
+    Mapping output bins back to round(j / ratio) leaves no holes in the
+    spectrum when shifting up.
+
+    Returns:
+        tuple: (source bins, target bins) of equal length
+    """
+    key = (bins, ratio)
+    bin_map = _bin_maps.get(key)
+    if bin_map is None:
+        with _bin_maps_lock:
+            bin_map = _bin_maps.get(key)
+            if bin_map is None:
+                source = np.round(np.arange(bins) / ratio).astype(np.intp)
+                target = np.nonzero(source < bins)[0]
+                bin_map = _bin_maps[key] = (source[target], target)
+    return bin_map
+
+
+class VocoderPitchShifter(STFTStage):
+    """Phase-vocoder pitch shifter working by bin shifting
+
+    Args:
+        semitones (float): Pitch shift
+        sample_rate (int): Sample rate of the stream
+        channels (int): Channels per block
+    """
+
+    def __init__(self, semitones, sample_rate, channels=1):
+        super().__init__(frame_size(sample_rate, VOCODER_FRAME_SECONDS), VOCODER_OVERLAP, channels)
+        self.ratio = pitch_ratio(semitones)
+        bins = self.n_fft // 2 + 1
+        self.source_bins, self.target_bins = get_bin_map(bins, self.ratio)
+        # Where a spectral peak at each bin moves to, clamped at Nyquist
+        self.bin_target_of = np.minimum(np.round(np.arange(bins) * self.ratio), bins - 1).astype(np.intp)
+        # Expected phase advance of each bin over one hop
+        self._bin_advance = ((2 * np.pi * self.hop / self.n_fft) * np.arange(bins)).astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        bins = self.n_fft // 2 + 1
+        # float32 throughout: synthesis phase is wrapped after every block
+        self._last_phase = np.zeros((self.channels, bins), dtype=np.float32)
+        self._synthesis_phase = np.zeros((self.channels, bins), dtype=np.float32)
+
+    def reset_channel(self, index):
+        super().reset_channel(index)
+        self._last_phase[index] = 0.0
+        self._synthesis_phase[index] = 0.0
+
+    def process_spectra(self, spectra):
+        magnitude = np.abs(spectra)
+        phase = np.angle(spectra)
+
+        # True frequency of each bin, as phase advance per hop
+        previous = np.concatenate((self._last_phase[:, None], phase[:, :-1]), axis=1)
+        deviation = phase - previous - self._bin_advance
+        deviation -= 2 * np.pi * np.round(deviation / (2 * np.pi))
+        advance = self._bin_advance + deviation
+        self._last_phase = phase[:, -1]
+
+        shifted_advance = np.zeros_like(advance)
+        shifted_advance[..., self.target_bins] = advance[..., self.source_bins] * self.ratio
+
+        # Accumulate synthesis phase frame by frame across the whole batch
+        synthesis_phase = self._synthesis_phase[:, None] + np.cumsum(shifted_advance, axis=1)
+        self._synthesis_phase = np.mod(synthesis_phase[:, -1], 2 * np.pi)
+
+        # Move each peak's region by a whole number of bins so its main lobe
+        # keeps its shape, with phases locked to the peak's synthesis phase
+        peak = _nearest_peak(magnitude)
+        peak_target = self.bin_target_of[peak]
+        target = np.arange(magnitude.shape[-1]) + (peak_target - peak)
+        phase_out = (np.take_along_axis(synthesis_phase, peak_target, axis=-1)
+                     + phase - np.take_along_axis(phase, peak, axis=-1))
+
+        # Scatter-add, since neighbouring regions can land on the same bins.
+        # Real and imaginary parts go separately: cheaper than a complex exp
+        bins = magnitude.shape[-1]
+        valid = (target >= 0) & (target < bins)
+        rows = np.arange(magnitude.shape[0] * magnitude.shape[1]).reshape(magnitude.shape[:2])
+        flat = (rows[..., None] * bins + target)[valid]
+        size = rows.size * bins
+        magnitude, phase_out = magnitude[valid], phase_out[valid]
+        shifted = np.empty(size, dtype=np.complex64)
+        shifted.real = np.bincount(flat, magnitude * np.cos(phase_out), minlength=size)
+        shifted.imag = np.bincount(flat, magnitude * np.sin(phase_out), minlength=size)
+        return shifted.reshape(spectra.shape)
+
+
+def _nearest_peak(magnitude):
+    """Index of the nearest local magnitude maximum for every bin"""
+    bins = magnitude.shape[-1]
+    index = np.arange(bins)
+    is_peak = np.zeros(magnitude.shape, dtype=bool)
+    is_peak[..., 1:-1] = ((magnitude[..., 1:-1] > magnitude[..., :-2])
+                          & (magnitude[..., 1:-1] >= magnitude[..., 2:]))
+    is_peak[..., 0] = True
+    left = np.maximum.accumulate(np.where(is_peak, index, 0), axis=-1)
+    right = np.minimum.accumulate(np.where(is_peak, index, bins)[..., ::-1], axis=-1)[..., ::-1]
+    use_right = (right < bins) & (right - index < index - left)
+    return np.where(use_right, right, left)
+
+
+def _benchmark(seconds=10.0, sample_rate=8000, frame_ms=20):
+    """Latency and CPU per channel for each mode across the catalog's pitch range"""
+    import time
+
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    # Voiced test signal: 120 Hz glottal-like pulse train with harmonics
+    audio = sum(np.sin(2 * np.pi * 120 * h * t) / h for h in range(1, 20))
+    audio = (0.2 * audio / np.max(np.abs(audio))).astype(np.float32)[None]
+    frame = sample_rate * frame_ms // 1000
+
+    results = []
+    for mode in PITCH_MODES:
+        for semitones in (-6, -3, 4, 10):
+            shifter = create_pitch_shifter(semitones, sample_rate, mode)
+            started = time.process_time()
+            for i in range(0, audio.shape[1], frame):
+                shifter.process(audio[:, i:i + frame])
+            cpu = time.process_time() - started
+            frames = -(-audio.shape[1] // frame)
+            results.append((mode, semitones, shifter.latency * 1000 / sample_rate,
+                            cpu / frames * 1e6, seconds / cpu if cpu else float('inf')))
+    return results
+
+
+if __name__ == '__main__':
+    for mode, semitones, latency_ms, per_frame_us, realtime in _benchmark():
+        print(f"{mode:8s} {semitones:+3d} st: latency {latency_ms:5.1f} ms, "
+              f"{per_frame_us:7.1f} us CPU per 20 ms frame, {realtime:6.0f}x realtime per channel")
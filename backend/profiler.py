@@ -0,0 +1,122 @@
+"""
+On-demand stack-sampling profiler for live worker processes.
+
+A profile samples the stacks of every thread in the process at a fixed
+interval for a bounded time, using sys._current_frames(). It then returns
+them in collapsed-stack format ("thread;module:function;... count"), ready
+for flamegraph.pl or speedscope. Nothing runs between profiles, so the
+profiler costs nothing when idle. Only one profile runs per process at a
+time.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger('Profiler')
+
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '60'))
+PROFILE_DEFAULT_INTERVAL = 0.005  # seconds between samples
+# Sampling interval bounds; shorter starves the worker, longer yields no profile
+PROFILE_MIN_INTERVAL = 0.001
+PROFILE_MAX_INTERVAL = 1.0
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp')
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is already running in this process"""
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', os.path.basename(code.co_filename))
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+def sample(seconds=10.0, interval=PROFILE_DEFAULT_INTERVAL):
+    """Sample every thread's stack for `seconds`
+
+    Args:
+        seconds (float): Profile length, capped at PROFILE_MAX_SECONDS
+        interval (float): Seconds between samples, clamped to
+            [PROFILE_MIN_INTERVAL, PROFILE_MAX_INTERVAL]
+
+    Returns:
+        dict: 'stacks' (Counter of collapsed stack -> samples), 'samples',
+        'seconds' (actual duration) and 'interval'
+
+    Raises:
+        ProfilerBusy: If another profile is running
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running in this process")
+    try:
+        interval = min(max(interval, PROFILE_MIN_INTERVAL), PROFILE_MAX_INTERVAL)
+        seconds = min(max(seconds, interval), PROFILE_MAX_SECONDS)
+        own = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f'thread-{ident}'))
+                stacks[';'.join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+        return {'stacks': stacks, 'samples': samples,
+                'seconds': round(time.monotonic() - started, 3), 'interval': interval}
+    finally:
+        _running.release()
+
+
+def collapsed(profile):
+    """Collapsed-stack text, one "stack count" line per distinct stack"""
+    return ''.join(f'{stack} {count}\n' for stack, count in profile['stacks'].most_common())
+
+
+def profile_to_file(seconds=10.0, interval=PROFILE_DEFAULT_INTERVAL, prefix='worker'):
+    """Profile this process and write the collapsed stacks under PROFILE_DIR
+
+    Returns:
+        str: Path of the written file, or None if a profile was already running
+    """
+    try:
+        profile = sample(seconds, interval)
+    except ProfilerBusy:
+        logger.warning("Profile requested while one is running, ignored")
+        return None
+    path = os.path.join(PROFILE_DIR, f"{prefix}-{os.getpid()}-{int(time.time())}.collapsed")
+    with open(path, 'w') as f:
+        f.write(collapsed(profile))
+    logger.info(f"Wrote {profile['samples']} samples over {profile['seconds']}s to {path}")
+    return path
+
+
+def install_signal_handler(signum, seconds=10.0, prefix='worker'):
+    """Profile to a file in the background whenever the process receives signum
+
+    Only possible from the main thread; returns False elsewhere.
+    """
+    import signal
+
+    if threading.current_thread() is not threading.main_thread():
+        return False
+
+    def handler(received, frame):
+        threading.Thread(target=profile_to_file, args=(seconds,), kwargs={'prefix': prefix},
+                         name='profiler', daemon=True).start()
+
+    signal.signal(signum, handler)
+    return True
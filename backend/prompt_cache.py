@@ -0,0 +1,282 @@
+"""
+On-disk cache of voice prompts pre-rendered in a caller's selected voice.
+
+Prompts such as custom/voice-changer-greeting are transformed once per
+(prompt file, voice parameters, codec) combination and stored under a
+content-addressed key, so STREAM FILE never runs the voice engine on the
+playback path. The cache is bounded by PROMPT_CACHE_MAX_BYTES with
+least-recently-used eviction, and cached renders are read through mmap.
+"""
+import os
+import io
+import json
+import mmap
+import wave
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from backend.resampler import resample_pcm
+
+logger = logging.getLogger('PromptCache')
+
+PROMPT_SOURCE_DIR = os.environ.get('PROMPT_SOURCE_DIR', '/var/lib/asterisk/sounds')
+PROMPT_CACHE_DIR = os.environ.get('PROMPT_CACHE_DIR',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'prompts'))
+PROMPT_CACHE_MAX_BYTES = int(os.environ.get('PROMPT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+PROMPT_CACHE_CODEC = os.environ.get('PROMPT_CACHE_CODEC', 'sln')
+
+# Source prompt formats, in lookup order, with their fixed sample rates
+SOURCE_FORMATS = [('.wav', None), ('.sln16', 16000), ('.sln', 8000)]
+
+# Output codecs Asterisk can play directly: file extension and sample rate
+# (None means the source rate is kept)
+CODECS = {
+    'sln': ('.sln', 8000),
+    'sln16': ('.sln16', 16000),
+    'wav': ('.wav', None),
+}
+
+
+class PromptNotFound(Exception):
+    """Raised when no source audio exists for a prompt"""
+
+
+def voice_parameters_hash(params):
+    """Stable hash of a voice parameter dict"""
+    payload = json.dumps(params or {}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def read_pcm(path, default_rate=None):
+    """Read 16-bit mono PCM from a WAV or raw slin file
+
+    Returns:
+        tuple: (pcm bytes, sample rate)
+    """
+    if path.endswith('.wav'):
+        with wave.open(path, 'rb') as wav:
+            if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+                raise ValueError(f"{path}: only 16-bit mono WAV prompts are supported")
+            return wav.readframes(wav.getnframes()), wav.getframerate()
+    with open(path, 'rb') as f:
+        return f.read(), default_rate
+
+
+def encode_pcm(pcm, sample_rate, codec):
+    """Encode 16-bit mono PCM into the on-disk format for codec"""
+    if codec == 'wav':
+        buf = io.BytesIO()
+        with wave.open(buf, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(pcm)
+        return buf.getvalue()
+    return pcm
+
+
+class PromptCache:
+    """Content-addressed, size-bounded cache of transformed prompts
+
+    Args:
+        cache_dir (str): Directory holding rendered prompts
+        source_dir (str): Asterisk sounds directory with the original prompts
+        max_bytes (int): Total size above which least recently used renders are evicted
+    """
+
+    def __init__(self, cache_dir=PROMPT_CACHE_DIR, source_dir=PROMPT_SOURCE_DIR,
+                 max_bytes=PROMPT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.source_dir = source_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._render_locks = {}
+        self._entries = OrderedDict()  # path -> size, least recently used first
+        self._total_bytes = 0
+        self._source_digests = {}  # source path -> (mtime, size, digest)
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the LRU order from what is already on disk"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_atime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._total_bytes += size
+
+    def find_source(self, prompt):
+        """Locate the source file for a prompt name like 'custom/voice-options'"""
+        base = os.path.normpath(os.path.join(self.source_dir, prompt))
+        if not base.startswith(os.path.normpath(self.source_dir) + os.sep):
+            raise PromptNotFound(f"Prompt outside the sounds directory: {prompt}")
+        for ext, rate in SOURCE_FORMATS:
+            if os.path.exists(base + ext):
+                return base + ext, rate
+        raise PromptNotFound(f"No source audio for prompt {prompt}")
+
+    def _source_digest(self, path):
+        """Content hash of a source prompt, memoized on (mtime, size)"""
+        st = os.stat(path)
+        cached = self._source_digests.get(path)
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest = digest.hexdigest()
+        self._source_digests[path] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+    def cache_key(self, prompt, params, codec):
+        """Content-addressed key for (prompt file, voice parameters, codec)"""
+        source_path, _ = self.find_source(prompt)
+        material = f"{self._source_digest(source_path)}:{voice_parameters_hash(params)}:{codec}"
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def _path_for(self, key, codec):
+        return os.path.join(self.cache_dir, key[:2], key + CODECS[codec][0])
+
+    def get(self, prompt, params, render, codec=PROMPT_CACHE_CODEC):
+        """Return the path of the prompt rendered with params, rendering it if needed
+
+        Args:
+            prompt (str): Prompt name relative to the sounds directory, without extension
+            params (dict): Voice parameters the render depends on
+            render (callable): render(pcm_bytes, sample_rate) -> transformed pcm bytes
+            codec (str): Output codec, one of CODECS
+
+        Returns:
+            str: Path to the cached render
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported prompt codec: {codec}")
+        key = self.cache_key(prompt, params, codec)
+        path = self._path_for(key, codec)
+
+        if self._touch(path, count_hit=True):
+            return path
+
+        # Render each key once even when many calls ask for it at the same time
+        with self._lock:
+            render_lock = self._render_locks.setdefault(key, threading.Lock())
+        try:
+            with render_lock:
+                if self._touch(path, count_hit=True):
+                    return path
+                with self._lock:
+                    self.misses += 1
+                self._render(prompt, render, codec, path)
+        finally:
+            with self._lock:
+                # A later waiter may already have installed a fresh lock
+                if self._render_locks.get(key) is render_lock:
+                    del self._render_locks[key]
+        return path
+
+    def _render(self, prompt, render, codec, path):
+        source_path, default_rate = self.find_source(prompt)
+        pcm, sample_rate = read_pcm(source_path, default_rate)
+        target_rate = CODECS[codec][1]
+        if target_rate is not None and target_rate != sample_rate:
+            # Resample before rendering so the engine runs at the playback rate
+            pcm = resample_pcm(pcm, sample_rate, target_rate)
+            sample_rate = target_rate
+
+        data = encode_pcm(render(pcm, sample_rate), sample_rate, codec)
+
+        # Write atomically so concurrent readers never see a partial render
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        logger.info(f"Rendered prompt {prompt} ({codec}) to {path}")
+
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(path, 0)
+            self._entries[path] = len(data)
+            self._evict()
+
+    def _touch(self, path, count_hit=False):
+        """Mark a cached render as recently used; False if it is not cached
+
+        The file is checked every time: another process sharing the cache
+        directory may have evicted it.
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            self.discard(path)
+            return False
+        with self._lock:
+            if path not in self._entries:
+                # Rendered by another process sharing the cache directory
+                self._entries[path] = size
+                self._total_bytes += size
+            self._entries.move_to_end(path)
+            if count_hit:
+                self.hits += 1
+        return True
+
+    def discard(self, path):
+        """Forget a render that is gone or unreadable, so the next get re-renders it"""
+        with self._lock:
+            size = self._entries.pop(path, None)
+            if size is not None:
+                self._total_bytes -= size
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def open(self, path):
+        """Map a cached render read-only; the caller closes the returned mmap"""
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_samples(self, path):
+        """Map a cached render and return (mmap, memoryview of its PCM payload)
+
+        The view stays valid until the mmap is closed; no audio is copied.
+        An empty render (an empty source prompt) cannot be mapped: it comes
+        back as (None, an empty view).
+        """
+        if os.path.getsize(path) == 0:
+            return None, memoryview(b'')
+        mapped = self.open(path)
+        offset = 0
+        if path.endswith('.wav'):
+            offset = mapped.find(b'data', 12) + 8
+            if offset < 8:
+                mapped.close()
+                raise ValueError(f"{path}: no data chunk")
+        return mapped, memoryview(mapped)[offset:]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,210 @@
+"""
+Streaming polyphase resampler for moving audio between browser rates
+(44.1/48 kHz) and Asterisk legs (8/16 kHz).
+
+The rate ratio is reduced to up/down and a Kaiser-windowed sinc low-pass is
+split into `up` polyphase branches. Filter banks are designed once per rate
+pair and shared by every stream. A Resampler carries the input history and
+the filter phase between blocks, so a stream resampled frame by frame is
+sample-identical to the same audio resampled in one go. Each block is
+computed with a single vectorized gather and multiply-accumulate.
+"""
+import threading
+from math import gcd, ceil
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from backend.voice_engine import pcm_to_float, float_to_pcm
+
+# Zero crossings of the sinc on each side of the centre, at the lower of the two rates
+HALF_ZERO_CROSSINGS = 8
+KAISER_BETA = 8.6
+# Fraction of the lower Nyquist frequency kept in the passband
+ROLLOFF = 0.92
+
+_banks = {}
+_banks_lock = threading.Lock()
+
+
+def _design_bank(up, down):
+    """Design the polyphase filter bank for an up/down ratio
+
+    Returns:
+        tuple: (bank shaped (up, taps) with taps time-reversed for direct
+        dot products against input windows, taps per phase, filter centre
+        in upsampled samples)
+    """
+    ratio = max(up, down)
+    taps = 2 * HALF_ZERO_CROSSINGS * ceil(ratio / up)
+    length = up * taps
+    centre = length // 2
+    cutoff = ROLLOFF * 0.5 / ratio  # Cycles per upsampled sample
+
+    m = np.arange(length) - centre
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * m) * np.kaiser(length, KAISER_BETA)
+    prototype *= up / prototype.sum()  # Unity DC gain in every phase
+
+    # bank[p, j] = prototype[p + j * up], reversed along j
+    bank = prototype.reshape(taps, up).T[:, ::-1]
+    return np.ascontiguousarray(bank, dtype=np.float32), taps, centre
+
+
+def get_filter_bank(in_rate, out_rate):
+    """Filter bank for a rate pair, designed on first use and cached
+
+    Returns:
+        tuple: (up, down, bank, taps, centre)
+    """
+    key = (in_rate, out_rate)
+    bank = _banks.get(key)
+    if bank is None:
+        divisor = gcd(in_rate, out_rate)
+        up, down = out_rate // divisor, in_rate // divisor
+        with _banks_lock:
+            bank = _banks.get(key)
+            if bank is None:
+                bank = _banks[key] = (up, down) + _design_bank(up, down)
+    return bank
+
+
+class Resampler:
+    """Stateful resampling of one stream of float32 blocks
+
+    Args:
+        in_rate (int): Input sample rate
+        out_rate (int): Output sample rate
+        channels (int): Channels per block
+        aligned (bool): Drop the filter delay so output sample n lines up
+            with input time n / out_rate; call flush() at the end for the tail
+    """
+
+    def __init__(self, in_rate, out_rate, channels=1, aligned=False):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.aligned = aligned
+        self.up, self.down, self._bank, self._taps, centre = get_filter_bank(in_rate, out_rate)
+        # Start on the phase that puts the filter centre on an output sample,
+        # which makes the delay a whole number of output samples
+        self._start_phase = centre % self.down
+        self.latency = centre // self.down
+        self.reset()
+
+    @property
+    def passthrough(self):
+        return self.in_rate == self.out_rate
+
+    def reset(self):
+        self._history = np.zeros((self.channels, self._taps - 1), dtype=np.float32)
+        self._t = self._start_phase  # Next output position in upsampled samples
+        self._to_trim = self.latency if self.aligned else 0
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def process(self, block):
+        """Resample a float32 block shaped (channels, samples)"""
+        block = np.asarray(block, dtype=np.float32)
+        self.samples_in += block.shape[-1]
+        if self.passthrough:
+            self.samples_out += block.shape[-1]
+            return block
+
+        n_in = block.shape[-1]
+        x = np.concatenate((self._history, block), axis=1)
+        self._history = x[:, x.shape[1] - (self._taps - 1):]
+
+        # Output k sits at upsampled position t_k; it needs inputs up to t_k // up
+        count = max(0, -(-(n_in * self.up - self._t) // self.down))
+        t = self._t + np.arange(count) * self.down
+        self._t += count * self.down - n_in * self.up
+
+        windows = sliding_window_view(x, self._taps, axis=1)
+        out = np.einsum('ckj,kj->ck', windows[:, t // self.up], self._bank[t % self.up])
+
+        if self._to_trim:
+            trim = min(self._to_trim, out.shape[1])
+            out = out[:, trim:]
+            self._to_trim -= trim
+        self.samples_out += out.shape[1]
+        return out
+
+    def flush(self):
+        """Drain the filter tail (aligned mode)"""
+        expected = -(-self.samples_in * self.out_rate // self.in_rate)
+        missing = expected - self.samples_out
+        if not self.aligned or self.passthrough or missing <= 0:
+            return np.zeros((self.channels, 0), dtype=np.float32)
+        # Enough silence to push the remaining outputs and any untrimmed delay through
+        pad = -(-(missing + self._to_trim + 1) * self.in_rate // self.out_rate)
+        samples_in = self.samples_in
+        out = self.process(np.zeros((self.channels, pad), dtype=np.float32))[:, :missing]
+        self.samples_in = samples_in
+        self.samples_out = expected
+        return out
+
+
+class PCMResampler:
+    """Resampler over 16-bit mono PCM bytes, for telephony and upload paths"""
+
+    def __init__(self, in_rate, out_rate, aligned=False):
+        self.resampler = Resampler(in_rate, out_rate, aligned=aligned)
+        self._pending = b''
+
+    def process(self, pcm):
+        if self._pending:
+            pcm = self._pending + pcm
+            self._pending = b''
+        if len(pcm) % 2:
+            self._pending = bytes(pcm[-1:])
+            pcm = pcm[:-1]
+        if not pcm:
+            return b''
+        if self.resampler.passthrough:
+            return bytes(pcm)
+        return float_to_pcm(self.resampler.process(pcm_to_float(pcm)))
+
+    def flush(self):
+        return float_to_pcm(self.resampler.flush())
+
+
+def resample_pcm(pcm, in_rate, out_rate):
+    """Resample a complete 16-bit mono PCM buffer, delay compensated"""
+    if in_rate == out_rate:
+        return bytes(pcm)
+    stream = PCMResampler(in_rate, out_rate, aligned=True)
+    return stream.process(pcm) + stream.flush()
+
+
+def _benchmark(seconds=10.0, block_ms=20):
+    """Throughput of frame-by-frame streaming for the common rate pairs"""
+    import time
+
+    rng = np.random.default_rng(0)
+    results = []
+    for in_rate, out_rate in ((48000, 8000), (8000, 48000), (44100, 16000),
+                              (16000, 44100), (16000, 8000), (8000, 16000)):
+        audio = rng.standard_normal((1, int(seconds * in_rate))).astype(np.float32) * 0.1
+        block = in_rate * block_ms // 1000
+
+        # Streaming in frames must match one-shot resampling exactly
+        whole = Resampler(in_rate, out_rate).process(audio)
+        stream = Resampler(in_rate, out_rate)
+        framed = np.concatenate([stream.process(audio[:, i:i + block])
+                                 for i in range(0, audio.shape[1], block)], axis=1)
+        max_error = float(np.max(np.abs(whole - framed)))
+
+        stream.reset()
+        started = time.process_time()
+        for i in range(0, audio.shape[1], block):
+            stream.process(audio[:, i:i + block])
+        cpu = time.process_time() - started
+        results.append((in_rate, out_rate, stream._taps, seconds / cpu if cpu else float('inf'),
+                        max_error))
+    return results
+
+
+if __name__ == '__main__':
+    for in_rate, out_rate, taps, realtime, error in _benchmark():
+        print(f"{in_rate:5d} -> {out_rate:5d} Hz  {taps:3d} taps/phase  "
+              f"{realtime:8.0f}x realtime per core  frame/one-shot max diff {error:.2e}")
@@ -0,0 +1,334 @@
+"""
+Lightweight span tracing across API requests, AMI actions and database calls.
+
+A request starts a trace (sampled at TRACE_SAMPLE_RATE, or forced with an
+`X-Trace-Sample: 1` header, or continued from a W3C `traceparent` header).
+The current span lives in a context variable, so code further down opens
+child spans with `with tracing.span('ami.originate'):` or the @traced()
+decorator without passing anything around. Outside a sampled trace both
+cost a context-variable lookup.
+
+A finished trace is queued to a background exporter. The exporter appends
+one JSON line per span to TRACE_FILE, or posts OTLP/JSON to
+TRACE_OTLP_ENDPOINT (any OTLP-compatible collector). Run
+`python -m backend.tracing` to break the slowest trace in the file down per
+step.
+"""
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import functools
+import contextvars
+
+logger = logging.getLogger('Tracing')
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+# e.g. http://localhost:4318; spans are posted to <endpoint>/v1/traces instead of the file
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT')
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'rvc-api')
+# Finished traces waiting for export; more are dropped rather than slow requests
+TRACE_QUEUE_SIZE = 1000
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class Span:
+    """One timed step of a trace"""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Trace:
+    __slots__ = ('trace_id', 'spans', '_lock')
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or f'{random.getrandbits(128):032x}'
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+
+class _NoopSpan:
+    """Stand-in when the current work is not sampled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _SpanContext:
+    __slots__ = ('trace', 'name', 'parent_id', 'attributes', 'root', 'span', '_token')
+
+    def __init__(self, trace, name, parent_id, attributes, root=False):
+        self.trace = trace
+        self.name = name
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.root = root
+
+    def __enter__(self):
+        self.span = Span(self.trace, self.name, self.parent_id, self.attributes)
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.end_ns = time.time_ns()
+        if exc is not None:
+            span.error = f'{exc_type.__name__}: {exc}'
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Ended from another context (e.g. after a streamed response)
+            pass
+        self.trace.add(span)
+        if self.root:
+            exporter.submit(self.trace)
+        return False
+
+
+def parse_traceparent(header):
+    """(trace_id, parent span id, sampled) from a W3C traceparent header, or None"""
+    parts = (header or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def start_trace(name, sampled=None, traceparent=None, **attributes):
+    """Context manager for the root span of a request or job
+
+    Args:
+        name (str): Root span name
+        sampled (bool): Force the sampling decision; by default an incoming
+            traceparent decides, else TRACE_SAMPLE_RATE
+        traceparent (str): W3C traceparent header to continue
+
+    Returns:
+        Context manager yielding the root Span, or a no-op when not sampled
+    """
+    trace_id = parent_id = None
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_id, parent_sampled = parent
+        if sampled is None:
+            sampled = parent_sampled
+    if sampled is None:
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    if not sampled:
+        return _NOOP
+    return _SpanContext(Trace(trace_id), name, parent_id, attributes, root=True)
+
+
+def span(name, **attributes):
+    """Context manager for a child of the current span; no-op outside a trace"""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return _SpanContext(parent.trace, name, parent.span_id, attributes)
+
+
+def traced(name=None):
+    """Decorator running the function in a span named module.function"""
+    def decorator(func):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parent = _current.get()
+            if parent is None:
+                return func(*args, **kwargs)
+            with _SpanContext(parent.trace, span_name, parent.span_id, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_trace_id():
+    current = _current.get()
+    return current.trace.trace_id if current is not None else None
+
+
+def _otlp_payload(trace):
+    def attribute(key, value):
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    spans = []
+    for s in trace.spans:
+        record = {
+            'traceId': trace.trace_id,
+            'spanId': s.span_id,
+            'name': s.name,
+            'kind': 1,
+            'startTimeUnixNano': str(s.start_ns),
+            'endTimeUnixNano': str(s.end_ns),
+            'attributes': [attribute(k, v) for k, v in s.attributes.items()],
+            'status': {'code': 2, 'message': s.error} if s.error else {'code': 1},
+        }
+        if s.parent_id:
+            record['parentSpanId'] = s.parent_id
+        spans.append(record)
+    return {'resourceSpans': [{
+        'resource': {'attributes': [attribute('service.name', TRACE_SERVICE_NAME)]},
+        'scopeSpans': [{'scope': {'name': 'backend.tracing'}, 'spans': spans}],
+    }]}
+
+
+class Exporter:
+    """Writes finished traces from a background thread
+
+    Args:
+        path (str): JSON-lines file, one span per line
+        otlp_endpoint (str): OTLP/HTTP collector base URL; replaces the file
+    """
+
+    def __init__(self, path=TRACE_FILE, otlp_endpoint=TRACE_OTLP_ENDPOINT):
+        self.path = path
+        self.otlp_endpoint = otlp_endpoint
+        self.dropped = 0
+        self.exported = 0
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        # Threads do not survive fork: each worker process starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+                    self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            trace = self._queue.get()
+            try:
+                self.export(trace)
+                self.exported += 1
+            except Exception as e:
+                logger.warning(f"Trace export failed: {e}")
+
+    def export(self, trace):
+        if self.otlp_endpoint:
+            import urllib.request
+            request = urllib.request.Request(
+                self.otlp_endpoint.rstrip('/') + '/v1/traces',
+                data=json.dumps(_otlp_payload(trace)).encode(),
+                headers={'Content-Type': 'application/json'})
+            urllib.request.urlopen(request, timeout=5).close()
+        else:
+            lines = ''.join(json.dumps(s.to_dict(), default=str) + '\n' for s in trace.spans)
+            with open(self.path, 'a') as f:
+                f.write(lines)
+
+    def flush(self, timeout=5.0):
+        """Wait until queued traces are written (tests, shutdown)"""
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+exporter = Exporter()
+
+
+def load_traces(path=TRACE_FILE):
+    """Spans in a JSON-lines trace file, grouped by trace id"""
+    traces = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                traces.setdefault(record['trace_id'], []).append(record)
+    return traces
+
+
+def format_trace(spans):
+    """Indented per-step breakdown of one trace"""
+    children = {}
+    for s in spans:
+        children.setdefault(s['parent_id'], []).append(s)
+    ids = {s['span_id'] for s in spans}
+    lines = []
+
+    def visit(s, depth):
+        error = f"  !! {s['error']}" if s['error'] else ''
+        lines.append(f"{s['duration_ms']:10.2f} ms  {'  ' * depth}{s['name']}{error}")
+        for child in sorted(children.get(s['span_id'], []), key=lambda c: c['start_ns']):
+            visit(child, depth + 1)
+
+    for root in sorted((s for s in spans if s['parent_id'] not in ids), key=lambda s: s['start_ns']):
+        visit(root, 0)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE
+    traces = load_traces(path)
+    if len(sys.argv) > 2:
+        trace_id = sys.argv[2]
+    else:
+        # Slowest trace: the one with the longest root span
+        trace_id = max(traces, key=lambda t: max(s['duration_ms'] for s in traces[t]))
+    print(f"trace {trace_id}")
+    print(format_trace(traces[trace_id]))
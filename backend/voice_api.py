@@ -1,14 +1,59 @@
 
 import os
 import json
+import time
+import threading
 import traceback
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, stream_with_context, g
 from functools import lru_cache
 from datetime import datetime, timedelta
-from backend.debug_bot import DebugBot
+
+from backend import metrics
+from backend import tracing
 
 app = Flask(__name__, template_folder='..', static_folder='..', static_url_path='/')
 
+REQUEST_LATENCY = metrics.histogram('http_request_duration_seconds', 'API request latency',
+                                    ('method', 'route', 'status'))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    trace = tracing.start_trace(
+        f'{request.method} {route}',
+        sampled=True if request.headers.get('X-Trace-Sample') == '1' else None,
+        traceparent=request.headers.get('traceparent'),
+        path=request.path)
+    g.trace_span = trace.__enter__()
+    g.trace = trace
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Label by route pattern, not path, to keep the series count bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_LATENCY.labels(request.method, route, str(response.status_code)).observe(
+            time.perf_counter() - started)
+    span = g.get('trace_span')
+    if isinstance(span, tracing.Span):
+        span.set_attribute('status', response.status_code)
+        response.headers['X-Trace-Id'] = span.trace.trace_id
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        g.pop('trace_span', None)
+        trace.__exit__(type(error) if error else None, error, None)
+
+@app.route('/metrics')
+def get_metrics():
+    """Process metrics in the Prometheus text exposition format"""
+    return Response(metrics.registry.expose(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -22,13 +67,32 @@ def handle_error(error):
         'error': str(error)
     }), 500
 
+_debug_bot = None
+_debug_bot_lock = threading.Lock()
+
+def get_debug_bot():
+    """Return the API's DebugBot, importing the debug/ML stack on first use
+
+    MLDebugger pulls in scikit-learn, which would otherwise cost
+    every worker seconds of startup for a rarely called endpoint.
+    """
+    global _debug_bot
+    if _debug_bot is None:
+        # Concurrent first requests would each build a DebugBot and trainer
+        with _debug_bot_lock:
+            if _debug_bot is None:
+                from backend.debug_bot import DebugBot
+                _debug_bot = DebugBot()
+    return _debug_bot
+
 @app.route('/api/debug/run', methods=['POST'])
 def run_debug():
     """Run automated debugging"""
     try:
+        debug_bot = get_debug_bot()
         results = debug_bot.run_diagnostics()
         if results['status'] == 'error':
-            fixes = debug_bot.auto_fix()
+            fixes = debug_bot.auto_fix(results)
             results['fixes'] = fixes
         return jsonify(results)
     except Exception as e:
@@ -36,9 +100,57 @@ def run_debug():
             'error': str(e),
             'trace': traceback.format_exc()
         }), 500
+
+@app.route('/api/debug/profile', methods=['POST'])
+def profile_worker():
+    """Sample the stacks of every thread in this worker for a few seconds
+
+    Requires the X-Admin-Token header to match ADMIN_TOKEN; disabled when
+    ADMIN_TOKEN is unset. Query parameters: seconds (default 10, at most
+    PROFILE_MAX_SECONDS), interval (default 0.005, clamped to [0.001, 1]) and
+    format ('collapsed', the default, or 'json').
+    """
+    import hmac
+    import math
+    from backend import profiler
+
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token:
+        return jsonify({'error': 'Profiling is disabled: ADMIN_TOKEN is not set'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+        return jsonify({'error': 'Invalid admin token'}), 401
+
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', profiler.PROFILE_DEFAULT_INTERVAL))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+    if not (math.isfinite(seconds) and math.isfinite(interval)):
+        return jsonify({'error': 'seconds and interval must be finite'}), 400
+    if seconds <= 0 or interval <= 0:
+        return jsonify({'error': 'seconds and interval must be positive'}), 400
+
+    try:
+        profile = profiler.sample(seconds, interval)
+    except profiler.ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'pid': os.getpid(),
+            'samples': profile['samples'],
+            'seconds': profile['seconds'],
+            'interval': profile['interval'],
+            'stacks': dict(profile['stacks'].most_common()),
+        })
+    return Response(profiler.collapsed(profile), mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename=profile-{os.getpid()}.collapsed',
+        'X-Profile-Samples': str(profile['samples']),
+    })
+
 from backend import models
 from backend.phone import PhoneCallManager
-from backend.phone_numbers import PhoneNumberManager
+from backend.phone_numbers import PhoneNumberManager, NumberPoolExhausted, NUMBERS_BULK_MAX
 
 phone_number_manager = PhoneNumberManager()
 
@@ -56,22 +168,105 @@ def generate_number():
     try:
         number_data = phone_number_manager.assign_number_to_user(user_id, country_code)
         return jsonify(number_data)
+    except NumberPoolExhausted as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/numbers/bulk', methods=['POST'])
+def provision_numbers_bulk():
+    """Reserve numbers for many users in one transaction
+
+    Body: {"country": "US", "user_ids": [...]} or
+    {"assignments": [{"user_id": ..., "country": ...}, ...]}, plus
+    "allow_partial": true to keep what could be assigned when a country runs
+    short. The response streams one JSON line per assigned number, then one
+    per exhausted country, then a summary line.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    default_country = data.get('country', 'US')
+    entries = data.get('assignments')
+    if entries is None:
+        user_ids = data.get('user_ids', [])
+        if not isinstance(user_ids, list):
+            return jsonify({'error': 'user_ids must be a list'}), 400
+        entries = [{'user_id': user_id} for user_id in user_ids]
+    elif not isinstance(entries, list):
+        return jsonify({'error': 'assignments must be a list'}), 400
+    assignments = [(entry.get('user_id'), entry.get('country', default_country))
+                   for entry in entries if isinstance(entry, dict)]
+
+    if (not assignments or len(assignments) != len(entries)
+            or not all(isinstance(user_id, str) and user_id for user_id, _ in assignments)):
+        return jsonify({'error': 'A non-empty string user_id is required for every assignment'}), 400
+    if not all(isinstance(country, str) and country for _, country in assignments):
+        return jsonify({'error': 'country must be a non-empty string'}), 400
+    if len(assignments) > NUMBERS_BULK_MAX:
+        return jsonify({'error': f'At most {NUMBERS_BULK_MAX} numbers per request'}), 413
+
+    try:
+        assigned, shortages = phone_number_manager.assign_numbers_bulk(
+            assignments, allow_partial=bool(data.get('allow_partial')))
+    except NumberPoolExhausted as e:
+        return jsonify({
+            'error': str(e),
+            'exhausted': {country: {'requested': requested, 'available': available}
+                          for country, (requested, available) in e.shortages.items()}
+        }), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    # The batch is committed; stream it instead of building one large body
+    def lines():
+        for number_data in assigned:
+            yield json.dumps(number_data) + '\n'
+        for country, (requested, available) in shortages.items():
+            yield json.dumps({'country': country, 'error': 'pool_exhausted',
+                              'requested': requested, 'assigned': available}) + '\n'
+        yield json.dumps({'summary': {'requested': len(assignments), 'assigned': len(assigned)}}) + '\n'
+
+    return Response(lines(), mimetype='application/x-ndjson')
+
 @app.route('/api/numbers/user/<user_id>', methods=['GET'])
 def get_user_numbers(user_id):
     """Get virtual numbers assigned to a user"""
-    # In production, this would fetch from a database
-    return jsonify({
-        'numbers': [
-            phone_number_manager.assign_number_to_user(user_id)
-        ]
-    })
+    try:
+        numbers = phone_number_manager.get_user_numbers(user_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'numbers': numbers})
 
 # Initialize the phone call manager
 phone_manager = PhoneCallManager()
 
+def _register_gauges():
+    """Gauges read from the objects that own the state, at scrape time"""
+    from backend.ami_health import ami_health
+
+    pool = metrics.gauge('db_pool_connections', 'Database pool connections by state', ('state',))
+    pool.labels('in_use').set_function(lambda: models.db_pool_stats()['in_use'])
+    pool.labels('idle').set_function(lambda: models.db_pool_stats()['idle'])
+    metrics.gauge('db_pool_max_connections', 'Database pool size limit').set_function(
+        lambda: models.db_pool_stats()['max'])
+
+    breaker = metrics.gauge('ami_circuit_state', 'AMI circuit breaker state (1 for the current one)',
+                            ('state',))
+    for state in ('closed', 'half-open', 'open'):
+        breaker.labels(state).set_function(lambda state=state: int(ami_health.state == state))
+    metrics.gauge('ami_consecutive_failures', 'AMI connection failures since the last success').set_function(
+        lambda: ami_health.consecutive_failures)
+    metrics.gauge('ami_connected', 'Whether this process holds an AMI session').set_function(
+        lambda: int(phone_manager.ami_socket is not None))
+
+    metrics.gauge('call_registry_active', 'Tracked calls that have not finished').set_function(
+        lambda: len(phone_manager.active_calls.active()))
+    metrics.gauge('call_registry_tracked', 'Calls held by the call registry').set_function(
+        lambda: len(phone_manager.active_calls))
+
+_register_gauges()
+
 # Celebrity voices data - made available as a global variable for direct initialization
 celebrity_voices = [
     {"name": "Morgan Freeman", "type": "celebrity", "accent": "american", 
@@ -344,6 +539,22 @@ def generate_dialplan():
     
     return dialplan, 200, {'Content-Type': 'text/plain'}
 
+@app.route('/api/asterisk/dialplan/all', methods=['GET'])
+def generate_bulk_dialplan():
+    """Generate the dialplan contexts for every voice in one extensions.conf fragment"""
+    from backend.dialplan import DialplanUnavailable
+
+    try:
+        version, chunks = phone_manager.generate_bulk_dialplan()
+    except DialplanUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    
+    # Let deploy scripts skip the download when the catalog has not changed
+    if version and request.if_none_match.contains(version):
+        return '', 304, {'ETag': f'"{version}"'}
+    
+    return Response(chunks, mimetype='text/plain', headers={'ETag': f'"{version}"'})
+
 @app.route('/api/asterisk/dtmf', methods=['POST'])
 def handle_dtmf():
     """Process DTMF input during an Asterisk call"""
@@ -375,6 +586,7 @@ def voice_hangup():
     # Update the call session in the database
     if call_sid:
         models.update_call_session_status(call_sid, 'completed')
+        phone_manager.active_calls.finish(call_sid, 'completed')
     
     # Generate a simple response for Asterisk
     response = {
@@ -393,9 +605,124 @@ def voice_status():
     # Update the call session in the database
     if call_sid and call_status:
         models.update_call_session_status(call_sid, call_status)
+        phone_manager.active_calls.update_status(call_sid, call_status)
     
     return '', 204
 
+@app.route('/api/call/registry', methods=['GET'])
+def get_call_registry_stats():
+    """Size and eviction counters of this process's call registry"""
+    return jsonify(phone_manager.active_calls.stats())
+
+# Offline voice transformation
+TRANSFORM_BLOCK_SAMPLES = int(os.environ.get('TRANSFORM_BLOCK_SAMPLES', '8192'))
+
+_voice_processor = None
+
+def get_voice_processor():
+    """Return the API's VoiceProcessor, loading the voice engine on first use"""
+    global _voice_processor
+    if _voice_processor is None:
+        from backend.agi_server import VoiceProcessor
+        _voice_processor = VoiceProcessor()
+    return _voice_processor
+
+@app.route('/api/transform', methods=['POST'])
+def transform_audio():
+    """Transform an uploaded WAV or raw 16-bit PCM file with a catalog voice
+    
+    The audio is the request body (raw PCM takes ?sample_rate=). It is read and
+    transformed in fixed-size blocks and the result is streamed back chunked,
+    so the file is never held in memory as a whole. ?output_rate= resamples
+    the result (e.g. 48000 browser audio down to an 8000 Hz phone leg), and
+    ?pitch_mode=psola|vocoder overrides the voice's pitch algorithm.
+    Pass ?report=1 to discard the audio and get throughput figures instead.
+    """
+    from backend.audio_io import AudioFormatError, read_wav_header, wav_header, iter_blocks
+    from backend.resampler import PCMResampler
+    
+    voice_id = request.args.get('voice_id')
+    if not voice_id:
+        return jsonify({'error': 'voice_id is required'}), 400
+    
+    voice = models.get_voice_by_id(voice_id)
+    if not voice:
+        return jsonify({'error': 'Voice not found'}), 404
+    
+    # The audio is the raw request body; it is consumed as it is transformed
+    stream = request.stream
+    
+    prefix = stream.read(4)
+    is_wav = prefix == b'RIFF'
+    data_size = None
+    try:
+        if is_wav:
+            fmt = read_wav_header(stream, prefix)
+            if fmt['channels'] != 1:
+                return jsonify({'error': 'Only mono audio is supported'}), 400
+            sample_rate = fmt['sample_rate']
+            data_size = fmt['data_size']
+        else:
+            sample_rate = int(request.args.get('sample_rate', 8000))
+        output_rate = int(request.args.get('output_rate', sample_rate))
+        if sample_rate <= 0 or output_rate <= 0:
+            raise ValueError('Sample rates must be positive')
+        voice_stream = get_voice_processor().open_stream(
+            voice_id, sample_rate, aligned=True, pitch_mode=request.args.get('pitch_mode'))
+    except (AudioFormatError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    resampler = PCMResampler(sample_rate, output_rate, aligned=True)
+    block_bytes = TRANSFORM_BLOCK_SAMPLES * 2
+    
+    def blocks():
+        if not is_wav and prefix:
+            yield prefix
+        yield from iter_blocks(stream, block_bytes, limit=data_size)
+    
+    def transformed():
+        cpu_started = time.thread_time()
+        if is_wav:
+            yield wav_header(output_rate)
+        for block in blocks():
+            out = resampler.process(voice_stream.process(block))
+            if out:
+                yield out
+        tail = resampler.process(voice_stream.flush()) + resampler.flush()
+        if tail:
+            yield tail
+        cpu_seconds = time.thread_time() - cpu_started
+        audio_seconds = voice_stream.samples_in / sample_rate
+        transformed.stats = {
+            'voice_id': voice_id,
+            'sample_rate': sample_rate,
+            'output_rate': output_rate,
+            'pitch_mode': voice_stream.pitch_mode,
+            'audio_seconds': round(audio_seconds, 3),
+            'cpu_seconds': round(cpu_seconds, 3),
+            'audio_seconds_per_cpu_second': round(audio_seconds / cpu_seconds, 1) if cpu_seconds > 0 else None
+        }
+        app.logger.info(f"Transformed {audio_seconds:.1f}s of audio with voice {voice_id} "
+                        f"in {cpu_seconds:.3f} CPU s")
+    
+    if request.args.get('report'):
+        for _ in transformed():
+            pass
+        return jsonify(transformed.stats)
+    
+    mimetype = 'audio/wav' if is_wav else 'application/octet-stream'
+    return Response(stream_with_context(transformed()), mimetype=mimetype,
+                    headers={'X-Sample-Rate': str(output_rate)})
+
+@app.route('/api/media/stats', methods=['GET'])
+def get_media_stats():
+    """Per-voice and per-worker media latency and jitter percentiles
+
+    Pass ?sessions=1 to include each live session's own figures.
+    """
+    from backend.media_stats import media_stats
+    return jsonify(media_stats.snapshot(include_sessions=bool(request.args.get('sessions'))))
+
 # Helper route to initialize celebrity voices
 @app.route('/api/init/celebrity-voices', methods=['POST'])
 def init_celebrity_voices():
@@ -444,6 +771,7 @@ def set_asterisk_config():
 def get_asterisk_status():
     """Get Asterisk connection status"""
     from backend.phone import PhoneCallManager, ASTERISK_HOST, ASTERISK_USERNAME, ASTERISK_SECRET
+    from backend.ami_health import ami_health
     
     try:
         # Check if Asterisk credentials are configured
@@ -453,18 +781,28 @@ def get_asterisk_status():
         if not is_configured:
             return jsonify({
                 'configured': False,
-                'connected': False
+                'connected': False,
+                'breaker': ami_health.snapshot()
             })
         
-        # Try to connect to Asterisk
+        # Try to connect to Asterisk (fails fast while the breaker is open)
         manager = PhoneCallManager()
         connected = manager._connect_to_ami()
+        breaker = ami_health.snapshot()
+        
+        if connected:
+            message = 'Connected successfully'
+        elif breaker['state'] != 'closed':
+            message = f"Asterisk unreachable, circuit {breaker['state']} (retry in {breaker['retry_in']}s)"
+        else:
+            message = 'Failed to connect to Asterisk'
         
         return jsonify({
             'configured': True,
             'connected': connected,
             'host': ASTERISK_HOST,
-            'message': 'Connected successfully' if connected else 'Failed to connect to Asterisk'
+            'breaker': breaker,
+            'message': message
         })
     except Exception as e:
         # Handle the case when is_configured might not be defined due to exception
@@ -472,6 +810,7 @@ def get_asterisk_status():
         return jsonify({
             'configured': configured_status,
             'connected': False,
+            'breaker': ami_health.snapshot(),
             'message': f'Error checking Asterisk status: {str(e)}'
         })
 
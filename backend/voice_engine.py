@@ -0,0 +1,252 @@
+"""
+Server-side voice transformation engine.
+
+A VoiceStream carries the per-stream state of the transformation chain built
+from a voice's parameters, so audio can be pushed through it in blocks of
+any size: a 20 ms telephony frame or a large block of an uploaded file.
+Stages work on float32 arrays shaped (channels, samples) and report their
+algorithmic latency, which the stream compensates when `aligned` output is
+requested (offline rendering).
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# int16 full scale, used to convert between PCM and float samples
+PCM_SCALE = 32768.0
+
+# Smallest block of silence pushed through the chain when draining it
+FLUSH_BLOCK_SAMPLES = 256
+
+
+class Stage:
+    """Base class for a streaming engine stage
+
+    Subclasses implement process(); `latency` is the delay in samples the
+    stage adds between its input and its output. A `batchable` stage keeps
+    every channel independent, so one instance can carry many calls (one
+    per channel) and reset_channel() recycles a single channel.
+    """
+
+    latency = 0
+    batchable = True
+
+    def process(self, block):
+        """Transform a float32 block shaped (channels, samples)"""
+        raise NotImplementedError
+
+    def reset(self):
+        """Drop any state carried between blocks"""
+
+    def reset_channel(self, index):
+        """Drop the state carried for one channel"""
+
+
+class STFTStage(Stage):
+    """Base for stages that rewrite short-time spectra
+
+    Frames of n_fft samples are taken every n_fft / overlap samples with a
+    Hann window. Every frame completed by a block is transformed in one
+    batch by process_spectra() and overlap-added back. The output is the
+    input delayed by n_fft - hop samples.
+
+    Args:
+        n_fft (int): Frame size
+        overlap (int): Frames overlapping each sample (hop = n_fft / overlap)
+        channels (int): Channels per block
+    """
+
+    def __init__(self, n_fft, overlap=4, channels=1):
+        self.n_fft = n_fft
+        self.overlap = overlap
+        self.hop = n_fft // overlap
+        self.channels = channels
+        self.latency = n_fft - self.hop
+        # Periodic Hann for analysis and synthesis, scaled so the squared
+        # windows overlap-add to one
+        window = np.hanning(n_fft + 1)[:n_fft]
+        self.window = (window / np.sqrt(np.sum(window ** 2) / self.hop)).astype(np.float32)
+        STFTStage.reset(self)
+
+    def process_spectra(self, spectra):
+        """Transform rfft spectra shaped (channels, frames, bins)"""
+        raise NotImplementedError
+
+    def reset(self):
+        # Pre-roll of latency zeros so the first frame ends on the first hop
+        self._input = np.zeros((self.channels, self.latency), dtype=np.float32)
+        # Overlap-add tail still waiting for later frames
+        self._tail = np.zeros((self.channels, self.latency), dtype=np.float32)
+
+    def reset_channel(self, index):
+        self._input[index] = 0.0
+        self._tail[index] = 0.0
+
+    def process(self, block):
+        data = np.concatenate((self._input, block), axis=1)
+        n_frames = (data.shape[1] - self.n_fft) // self.hop + 1
+        if n_frames <= 0:
+            self._input = data
+            return np.zeros((self.channels, 0), dtype=np.float32)
+
+        frames = sliding_window_view(data, self.n_fft, axis=1)[:, ::self.hop][:, :n_frames]
+        spectra = self.process_spectra(np.fft.rfft(frames * self.window, axis=-1))
+        shifted = np.fft.irfft(spectra, n=self.n_fft, axis=-1) * self.window
+
+        # Overlap-add: frame f contributes its s-th hop to output hop f + s
+        out = np.zeros((self.channels, (n_frames + self.overlap - 1) * self.hop), dtype=np.float32)
+        out[:, :self.latency] += self._tail
+        hops = shifted.reshape(self.channels, n_frames, self.overlap, self.hop)
+        for s in range(self.overlap):
+            out[:, s * self.hop:(s + n_frames) * self.hop] += hops[:, :, s].reshape(self.channels, -1)
+
+        emitted = n_frames * self.hop
+        self._tail = out[:, emitted:]
+        self._input = data[:, emitted:]
+        return out[:, :emitted]
+
+
+def build_stages(params, sample_rate, pitch_mode='psola', channels=1):
+    """Build the engine stages for a voice's parameters
+
+    Args:
+        params (dict): Voice parameters (pitch, formant, effect, ...)
+        sample_rate (int): Sample rate the stages will run at
+        pitch_mode (str): Pitch algorithm, one of backend.pitch.PITCH_MODES
+        channels (int): Channels in each block (one per call when batching)
+
+    Returns:
+        list: Stage instances, applied in order
+    """
+    from backend.convolution import ConvolutionEffect, has_impulse_response
+    from backend.formant import FormantShifter
+    from backend.pitch import create_pitch_shifter
+
+    stages = []
+    pitch = float(params.get('pitch') or 0)
+    if pitch:
+        stages.append(create_pitch_shifter(pitch, sample_rate, pitch_mode, channels))
+    formant = float(params.get('formant') or 0)
+    if formant:
+        stages.append(FormantShifter(formant, sample_rate, channels))
+    effect = params.get('effect') or 'none'
+    if effect != 'none' and has_impulse_response(effect):
+        stages.append(ConvolutionEffect(effect, sample_rate, channels))
+    return stages
+
+
+def pcm_to_float(pcm):
+    """View 16-bit PCM bytes as a float32 (1, samples) block"""
+    samples = np.frombuffer(pcm, dtype='<i2')
+    return (samples.astype(np.float32) / PCM_SCALE).reshape(1, -1)
+
+
+def float_to_pcm(block):
+    """Convert a float32 block back to 16-bit little-endian PCM bytes"""
+    scaled = np.clip(block.reshape(-1) * PCM_SCALE, -PCM_SCALE, PCM_SCALE - 1)
+    return scaled.astype('<i2').tobytes()
+
+
+class VoiceStream:
+    """Stateful transformation of one audio stream with one voice
+
+    Args:
+        params (dict): Voice parameters
+        sample_rate (int): Sample rate of the PCM pushed into the stream
+        aligned (bool): Drop the chain's leading latency so output sample n
+            corresponds to input sample n; call flush() at the end to get
+            the remaining tail. Use for offline rendering only.
+        pitch_mode (str): Pitch algorithm overriding the voice's own
+            'pitch_mode'; by default live streams use the low-latency one
+    """
+
+    def __init__(self, params, sample_rate=8000, aligned=False, pitch_mode=None):
+        from backend.pitch import resolve_pitch_mode
+
+        self.params = params or {}
+        self.sample_rate = sample_rate
+        self.aligned = aligned
+        self.pitch_mode = resolve_pitch_mode(pitch_mode, self.params, aligned)
+        self.stages = build_stages(self.params, sample_rate, self.pitch_mode)
+        self.latency = sum(stage.latency for stage in self.stages)
+        self._to_trim = self.latency if aligned else 0
+        self._pending = b''  # Odd trailing byte of a split sample
+        self.samples_in = 0
+        self.samples_out = 0
+
+    @property
+    def passthrough(self):
+        return not self.stages
+
+    def process(self, pcm):
+        """Push 16-bit mono PCM through the chain and return transformed PCM
+
+        The output may be shorter than the input while the chain's latency
+        is being trimmed in aligned mode.
+        """
+        if self._pending:
+            pcm = self._pending + pcm
+            self._pending = b''
+        if len(pcm) % 2:
+            self._pending = bytes(pcm[-1:])
+            pcm = pcm[:-1]
+        if not pcm:
+            return b''
+
+        self.samples_in += len(pcm) // 2
+        if self.passthrough:
+            self.samples_out += len(pcm) // 2
+            return bytes(pcm)
+
+        return float_to_pcm(self._run(pcm_to_float(pcm)))
+
+    def process_block(self, block):
+        """Push a float32 block shaped (channels, samples) through the chain
+
+        Used by media paths that decode frames straight into float buffers
+        (see backend.audio_buffer); the returned block may be the input
+        array itself when the chain is a passthrough.
+        """
+        self.samples_in += block.shape[-1]
+        if self.passthrough:
+            self.samples_out += block.shape[-1]
+            return block
+        return self._run(block)
+
+    def _run(self, block):
+        for stage in self.stages:
+            block = stage.process(block)
+
+        if self._to_trim:
+            trim = min(self._to_trim, block.shape[-1])
+            block = block[:, trim:]
+            self._to_trim -= trim
+
+        self.samples_out += block.shape[-1]
+        return block
+
+    def flush(self):
+        """Emit the tail still held inside the chain (aligned mode)"""
+        if not self.aligned or self.passthrough:
+            return b''
+        missing = self.samples_in - self.samples_out
+        if missing <= 0:
+            return b''
+        # Push silence through to drain the chain, including any latency not
+        # yet trimmed; stages that emit whole hops may need more than one push
+        tail = []
+        produced = 0
+        while produced < missing:
+            pad = max(missing - produced + self._to_trim, FLUSH_BLOCK_SAMPLES)
+            block = self._run(np.zeros((1, pad), dtype=np.float32))
+            tail.append(block)
+            produced += block.shape[-1]
+        self.samples_out = self.samples_in
+        return float_to_pcm(np.concatenate(tail, axis=1)[:, :missing])
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+        self._to_trim = self.latency if self.aligned else 0
+        self._pending = b''
+        self.samples_in = 0
+        self.samples_out = 0
@@ -0,0 +1,65 @@
+
+import os
+import sys
+import argparse
+import subprocess
+
+# Cumulative import time allowed for each entry module, in milliseconds
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', '600'))
+
+# Modules that must stay out of API startup; they load on first use
+FORBIDDEN_AT_STARTUP = ('sklearn', 'pandas', 'scipy', 'joblib', 'backend.ml_debugger')
+
+ENTRY_MODULES = ('backend.voice_api',)
+
+
+def measure(module):
+    """Import a module in a fresh interpreter under -X importtime
+
+    Returns:
+        tuple: (cumulative milliseconds, {imported module: cumulative ms})
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported[name.strip()] = int(cumulative) / 1000.0
+    return imported.get(module, 0.0), imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fail if API startup imports regress')
+    parser.add_argument('modules', nargs='*', default=ENTRY_MODULES, help='Entry modules to check')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help='Cumulative import time allowed per module')
+    parser.add_argument('--runs', type=int, default=3, help='Imports per module; the fastest counts')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.runs)]
+        total, imported = min(runs, key=lambda run: run[0])
+        forbidden = [name for name in FORBIDDEN_AT_STARTUP if name in imported]
+        ok = total <= args.budget_ms and not forbidden
+        failed |= not ok
+
+        print(f"{'ok  ' if ok else 'FAIL'} {module}: {total:.0f} ms (budget {args.budget_ms:.0f} ms)")
+        if forbidden:
+            print(f"     imports at startup: {', '.join(forbidden)}")
+        # Top-level packages only, so nested imports are not counted twice
+        heaviest = sorted(((ms, name) for name, ms in imported.items() if '.' not in name), reverse=True)
+        for ms, name in heaviest[:args.top]:
+            print(f"     {ms:8.1f} ms  {name}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import subprocess
+import http.client
+from multiprocessing import Pool
+
+
+def _client(args):
+    """Issue GET requests for `seconds`; returns (completed, errors)"""
+    host, port, path, seconds = args
+    completed = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status < 500:
+                completed += 1
+            else:
+                errors += 1
+        except OSError:
+            errors += 1
+    return completed, errors
+
+
+def _wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def run(workers, threads, clients, seconds, path, port, host='127.0.0.1'):
+    """Start run_production.py with `workers` workers and measure requests/sec"""
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_production.py'),
+         '--host', host, '--port', str(port), '--workers', str(workers),
+         '--threads', str(threads), '--log-level', 'WARNING'])
+    try:
+        if not _wait_for_port(host, port):
+            raise RuntimeError('Server did not start')
+        # Warm every worker up before measuring
+        _client((host, port, path, 0.5))
+        with Pool(clients) as pool:
+            started = time.monotonic()
+            results = pool.map(_client, [(host, port, path, seconds)] * clients)
+            elapsed = time.monotonic() - started
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+    completed = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    return completed / elapsed, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Requests/sec of the production API against worker count')
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts')
+    parser.add_argument('--threads', type=int, default=8, help='Request threads per worker')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent client processes')
+    parser.add_argument('--seconds', type=float, default=5.0, help='Measurement time per run')
+    parser.add_argument('--path', default='/api/media/stats', help='Endpoint to request')
+    parser.add_argument('--port', type=int, default=5051)
+    args = parser.parse_args(argv)
+
+    print(f"GET {args.path}, {args.clients} clients, {args.threads} threads per worker, "
+          f"{os.cpu_count()} CPUs")
+    baseline = None
+    for workers in (int(w) for w in args.workers.split(',')):
+        rate, errors = run(workers, args.threads, args.clients, args.seconds, args.path, args.port)
+        baseline = baseline or rate
+        print(f"{workers:3d} workers: {rate:8.0f} req/s ({rate / baseline:4.2f}x), {errors} errors")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+
+import sys
+import json
+import logging
+import argparse
+from backend.batch_render import run_batch
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-voice a folder or manifest of WAV files')
+    parser.add_argument('source', help='Directory of WAV files or a manifest file')
+    parser.add_argument('output_dir', help='Directory for the rendered files')
+    voice = parser.add_mutually_exclusive_group(required=True)
+    voice.add_argument('--voice-id', help='Catalog voice to render with')
+    voice.add_argument('--params', help='Voice parameters as JSON, e.g. \'{"pitch": -3}\'')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    args = parser.parse_args(argv)
+
+    if args.voice_id:
+        from backend import models
+        voice_row = models.get_voice_by_id(args.voice_id)
+        if not voice_row:
+            logging.error(f"Voice {args.voice_id} not found")
+            return 1
+        params = voice_row.get('parameters') or {}
+    else:
+        params = json.loads(args.params)
+
+    try:
+        result = run_batch(args.source, args.output_dir, params, workers=args.workers)
+    except ValueError as e:
+        logging.error(str(e))
+        return 1
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import select
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+API_HOST = os.environ.get('API_HOST', '0.0.0.0')
+API_PORT = int(os.environ.get('API_PORT', '5001'))
+API_WORKERS = int(os.environ.get('API_WORKERS', str(os.cpu_count() or 1)))
+API_THREADS = int(os.environ.get('API_THREADS', '8'))
+# Seconds workers get to finish in-flight requests after SIGTERM
+API_DRAIN_TIMEOUT = float(os.environ.get('API_DRAIN_TIMEOUT', '30'))
+API_LISTEN_BACKLOG = int(os.environ.get('API_LISTEN_BACKLOG', '1024'))
+# Seconds a saturated worker waits for a free thread before re-polling the socket
+API_ACCEPT_WAIT = float(os.environ.get('API_ACCEPT_WAIT', '0.5'))
+
+logger = logging.getLogger('APIServer')
+
+
+class _RequestHandler(WSGIRequestHandler):
+    # One request per connection, so a pool thread never idles on keep-alive
+    protocol_version = 'HTTP/1.0'
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug WSGI server on an inherited socket, handling requests on a fixed thread pool
+
+    A connection is only accepted once a pool thread is free for it, so a
+    saturated worker leaves new connections in the shared backlog for an
+    idle one instead of queueing them behind its own requests.
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, app, listener, threads):
+        host, port = listener.getsockname()[:2]
+        super().__init__(host, port, app, handler=_RequestHandler, fd=listener.fileno())
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='api')
+        self.slots = threading.BoundedSemaphore(threads)
+
+    def get_request(self):
+        if not self.slots.acquire(timeout=API_ACCEPT_WAIT):
+            # Back to the poll loop; socketserver ignores OSError from here
+            raise OSError("All request threads busy")
+        try:
+            # Another worker may have taken the connection while this one waited
+            if not select.select([self.socket], [], [], 0)[0]:
+                raise OSError("Connection taken by another worker")
+            return super().get_request()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self.executor.submit(self._handle, request, client_address)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+
+def init_worker(threads):
+    """Set up per-process resources in a worker forked from the preloaded app"""
+    from backend import models
+    from backend.ami_health import ami_health
+    from backend import voice_api
+
+    models.reset_db_pool()
+    # One connection per request thread, so requests never hit an exhausted pool
+    models.configure_db_pool(threads)
+    ami_health.after_fork()
+    voice_api.phone_manager.reset_after_fork()
+
+
+def run_worker(listener, threads):
+    """Serve on the shared listening socket until SIGTERM, then drain"""
+    from backend.voice_api import app
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The master handles Ctrl-C
+    init_worker(threads)
+    server = PooledWSGIServer(app, listener, threads)
+
+    def drain(signum, frame):
+        # shutdown() waits for serve_forever(), so it cannot run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain)
+    logger.info(f"Worker {os.getpid()} serving with {threads} threads")
+    server.serve_forever()
+
+    # Stop accepting, then let requests already accepted finish
+    server.socket.close()
+    server.executor.shutdown(wait=True)
+    logger.info(f"Worker {os.getpid()} drained")
+
+
+class Master:
+    """Preforks workers on one listening socket and keeps them running
+
+    Args:
+        listener (socket.socket): Bound, listening socket shared by the workers
+        workers (int): Number of worker processes
+        threads (int): Request threads per worker
+        drain_timeout (float): Seconds to wait for workers on shutdown
+    """
+
+    def __init__(self, listener, workers, threads, drain_timeout=API_DRAIN_TIMEOUT):
+        self.listener = listener
+        self.workers = workers
+        self.threads = threads
+        self.drain_timeout = drain_timeout
+        self.children = set()
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.listener, self.threads)
+            except Exception as e:
+                logger.error(f"Worker {os.getpid()} failed: {e}")
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self.children.add(pid)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def reap(self):
+        """Collect exited workers; returns their pids"""
+        exited = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            self.children.discard(pid)
+            exited.append(pid)
+            if not self.stopping:
+                logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+        return exited
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        logger.info(f"Serving on {self.listener.getsockname()} with {self.workers} workers "
+                    f"x {self.threads} threads")
+
+        while not self.stopping:
+            for _ in self.reap():
+                if not self.stopping:
+                    self.spawn()
+            time.sleep(0.2)
+
+        logger.info(f"Draining {len(self.children)} workers")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.children.discard(pid)
+        deadline = time.monotonic() + self.drain_timeout
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in self.children:
+            logger.warning(f"Worker {pid} did not drain in {self.drain_timeout:.0f}s, killing it")
+            os.kill(pid, signal.SIGKILL)
+        while self.children:
+            self.reap()
+            time.sleep(0.05)
+        self.listener.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the voice API with preforked workers')
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--workers', type=int, default=API_WORKERS, help='Worker processes')
+    parser.add_argument('--threads', type=int, default=API_THREADS, help='Request threads per worker')
+    parser.add_argument('--drain-timeout', type=float, default=API_DRAIN_TIMEOUT)
+    parser.add_argument('--log-level', default='INFO', help='Set to WARNING to silence access logs')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format='%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s'
+    )
+    # Werkzeug raises its own logger to INFO unless it has a level already
+    logging.getLogger('werkzeug').setLevel(args.log_level.upper())
+
+    # Import the app once in the master so workers share it copy-on-write
+    import backend.voice_api  # noqa: F401
+
+    listener = socket.create_server((args.host, args.port), backlog=API_LISTEN_BACKLOG)
+    Master(listener, max(1, args.workers), max(1, args.threads), args.drain_timeout).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
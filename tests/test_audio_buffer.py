@@ -0,0 +1,62 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from backend.audio_buffer import CODECS
+
+PCM = np.arange(-32768, 32768, dtype=np.int32)
+
+# (16-bit sample, u-law byte) pairs from the G.711 reference encoder, around
+# the segment boundaries and rounding edges where a naive encoder drifts
+ULAW_REFERENCE = [
+    (-32768, 0x00), (-31611, 0x00), (-30587, 0x01), (-8031, 0x20),
+    (-133, 0x6F), (-132, 0x6F), (-104, 0x72), (-97, 0x72), (-34, 0x7A),
+    (-33, 0x7A), (-6, 0x7E), (-1, 0x7E), (0, 0xFF), (3, 0xFF), (4, 0xFE),
+    (132, 0xEF), (133, 0xEF), (8031, 0xA0), (8033, 0xA0), (32767, 0x80),
+]
+
+
+def reference_lin2ulaw(sample):
+    """Scalar port of the 14-bit reference encoder (st_14linear2ulaw)"""
+    pcm = sample >> 2
+    mask = 0xFF
+    if pcm < 0:
+        pcm, mask = -pcm, 0x7F
+    pcm = min(pcm, 8159) + (0x84 >> 2)
+    for segment, end in enumerate((0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)):
+        if pcm <= end:
+            return ((segment << 4) | ((pcm >> (segment + 1)) & 0x0F)) ^ mask
+    return 0x7F ^ mask
+
+
+def encode_int16(codec, samples):
+    return np.frombuffer(codec.encode(np.asarray(samples, dtype=np.float32) / 32768.0), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('sample, expected', ULAW_REFERENCE)
+def test_ulaw_reference_table(sample, expected):
+    assert reference_lin2ulaw(sample) == expected
+    assert encode_int16(CODECS['ulaw'], [sample])[0] == expected
+
+
+def test_ulaw_encoder_matches_reference_for_every_sample():
+    expected = np.array([reference_lin2ulaw(int(s)) for s in PCM], dtype=np.uint8)
+    assert np.array_equal(CODECS['ulaw'].encode_table, expected)
+    assert np.array_equal(encode_int16(CODECS['ulaw'], PCM), expected)
+
+
+@pytest.mark.parametrize('codec', ['ulaw', 'alaw'])
+def test_g711_matches_audioop(codec):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        audioop = pytest.importorskip('audioop')
+    lin2x = audioop.lin2ulaw if codec == 'ulaw' else audioop.lin2alaw
+    x2lin = audioop.ulaw2lin if codec == 'ulaw' else audioop.alaw2lin
+
+    encoded = np.frombuffer(lin2x(PCM.astype('<i2').tobytes(), 2), dtype=np.uint8)
+    assert np.array_equal(CODECS[codec].encode_table, encoded)
+
+    every_byte = np.arange(256, dtype=np.uint8)
+    decoded = np.frombuffer(x2lin(every_byte.tobytes(), 2), dtype='<i2')
+    assert np.array_equal(np.round(CODECS[codec].decode(every_byte) * 32768).astype(np.int16), decoded)
@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from backend import models
+from backend.call_registry import CallRegistry
+from backend.phone import PhoneCallManager
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls time.monotonic() as seen by the registry"""
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_calls_are_indexed_by_number_voice_and_channel():
+    registry = CallRegistry()
+    registry.add('c1', '5550001', voice_id='7')
+    registry.add('c2', '5550001', voice_id='8')
+    registry.set_channel('c1', 'SIP/trunk-0001')
+
+    assert {r.call_id for r in registry.find_by_number('5550001')} == {'c1', 'c2'}
+    assert [r.call_id for r in registry.find_by_voice('8')] == ['c2']
+    assert registry.find_by_channel('SIP/trunk-0001').call_id == 'c1'
+    assert len(registry.active()) == 2
+
+
+def test_finished_calls_are_evicted_after_the_ttl(clock):
+    registry = CallRegistry(ttl=60)
+    registry.add('c1', '5550001', voice_id='7')
+    registry.set_channel('c1', 'SIP/trunk-0001')
+    registry.update_status('c1', 'completed')
+    assert registry.get('c1').finished
+
+    clock[0] += 61
+    assert registry.get('c1') is None
+    assert registry.find_by_number('5550001') == []
+    assert registry.find_by_voice('7') == []
+    assert registry.find_by_channel('SIP/trunk-0001') is None
+    assert registry.stats()['evicted'] == 1
+
+
+def test_finished_calls_are_capped():
+    registry = CallRegistry(ttl=3600, max_finished=2)
+    for i in range(3):
+        registry.add(f'c{i}', '5550001')
+        registry.finish(f'c{i}')
+    assert 'c0' not in registry
+    assert len(registry) == 2
+
+
+def test_calls_never_finished_expire(clock):
+    registry = CallRegistry(ttl=60, max_active_age=600)
+    registry.add('c1', '5550001')
+    clock[0] += 300
+    registry.add('c2', '5550002')
+
+    clock[0] += 301
+    assert registry.get('c1').status == 'expired'
+    assert registry.get('c2').status == 'initiated'
+    assert registry.stats()['expired_active'] == 1
+
+
+def test_reused_call_id_replaces_the_old_record(clock):
+    registry = CallRegistry(ttl=60)
+    registry.add('c1', '5550001')
+    registry.finish('c1')
+    registry.add('c1', '5550002')
+
+    clock[0] += 61
+    # The finished first record is evicted without touching its replacement
+    assert registry.get('c1').to_number == '5550002'
+    assert registry.find_by_number('5550001') == []
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    statuses = []
+    monkeypatch.setattr(models, 'update_call_session_status',
+                        lambda call_id, status: statuses.append((call_id, status)))
+    manager = PhoneCallManager()
+    manager.statuses = statuses
+    return manager
+
+
+def ami(*events):
+    return ''.join(''.join(f'{key}: {value}\r\n' for key, value in event.items()) + '\r\n'
+                   for event in events)
+
+
+def test_originate_and_hangup_events_finish_the_call(manager):
+    manager.active_calls.add('c1', '5550001')
+    manager._handle_ami_events(ami(
+        {'Response': 'Success', 'ActionID': 'ping'},
+        {'Event': 'OriginateResponse', 'ActionID': 'c1', 'Response': 'Success',
+         'Channel': 'SIP/trunk-0001'}))
+    assert manager.active_calls.get('c1').status == 'in-progress'
+    assert manager.statuses == []
+
+    manager._handle_ami_events(ami({'Event': 'Hangup', 'Channel': 'SIP/trunk-0002'}))
+    assert not manager.active_calls.get('c1').finished
+
+    manager._handle_ami_events(ami({'Event': 'Hangup', 'Channel': 'SIP/trunk-0001'}))
+    assert manager.active_calls.get('c1').status == 'completed'
+    assert manager.statuses == [('c1', 'completed')]
+
+    # A repeated Hangup does not update the session again
+    manager._handle_ami_events(ami({'Event': 'Hangup', 'Channel': 'SIP/trunk-0001'}))
+    assert manager.statuses == [('c1', 'completed')]
+
+
+def test_failed_originate_fails_the_call(manager):
+    manager.active_calls.add('c1', '5550001')
+    manager._handle_ami_events(ami({'Event': 'OriginateResponse', 'ActionID': 'c1',
+                                    'Response': 'Failure', 'Reason': '0'}))
+    assert manager.active_calls.get('c1').status == 'failed'
+    assert manager.statuses == [('c1', 'failed')]
+
+    # Events for calls this process did not place are ignored
+    manager._handle_ami_events(ami({'Event': 'OriginateResponse', 'ActionID': 'other',
+                                    'Response': 'Failure'}))
+    assert manager.statuses == [('c1', 'failed')]
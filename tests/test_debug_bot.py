@@ -0,0 +1,110 @@
+import time
+import threading
+
+import pytest
+
+from backend import debug_bot
+
+
+class FakeMLDebugger:
+    def __init__(self, resolution='auto_fix'):
+        self.resolution = resolution
+        self.records = []
+
+    def predict_resolution(self, diagnostic_data):
+        return self.resolution
+
+    def save_diagnostic_record(self, diagnostic_data, resolution, success):
+        self.records.append((diagnostic_data, resolution, success))
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    monkeypatch.setattr(debug_bot, 'MLDebugger', FakeMLDebugger)
+    monkeypatch.setattr(debug_bot, 'DEBUG_CHECK_TIMEOUT', 0.1)
+    bot = debug_bot.DebugBot()
+    bot.runs = 0
+
+    def port_conflicts(timeout):
+        bot.runs += 1
+        return [{'type': 'port_conflict', 'port': 5001, 'message': 'Port 5001 is already in use'}]
+
+    bot.checks = {
+        'port_conflicts': port_conflicts,
+        'asterisk_config': lambda timeout: [],
+        'syntax_errors': lambda timeout: [],
+    }
+    bot.fix_syntax_errors = lambda: False
+    return bot
+
+
+def test_auto_fix_applies_port_fixes(bot):
+    fixes = bot.auto_fix()
+    assert fixes['fixes_applied'] == ['port_5001']
+    assert len(bot.ml_debugger.records) == 1
+
+
+def test_timed_out_check_is_filed_outside_the_issue_lists(bot):
+    release = threading.Event()
+    bot.checks['port_conflicts'] = lambda timeout: release.wait() and []
+    try:
+        results = bot.run_diagnostics(use_cache=False)
+        assert results['port_conflicts'] == []
+        assert results['status'] == 'error'
+        assert [f['check'] for f in results['check_failures']] == ['port_conflicts']
+
+        # Still running: reported again without starting a second copy
+        again = bot.run_diagnostics(use_cache=False)
+        assert again['check_failures'][0]['type'] == 'check_timeout'
+
+        fixes = bot.auto_fix(results)
+        assert fixes['fixes_applied'] == []
+    finally:
+        release.set()
+
+
+def test_auto_fix_uses_the_callers_results(bot):
+    results = bot.run_diagnostics()
+    bot.auto_fix(results)
+    assert bot.runs == 1
+
+
+def test_cached_results_are_not_recorded_again(bot):
+    bot.auto_fix(bot.run_diagnostics())
+    cached = bot.run_diagnostics()
+    assert cached['cached']
+    bot.auto_fix(cached)
+    assert bot.runs == 1
+    assert len(bot.ml_debugger.records) == 1
+
+
+def test_debug_route_runs_diagnostics_once(bot, monkeypatch):
+    from backend import voice_api
+
+    monkeypatch.setattr(voice_api, '_debug_bot', bot)
+    response = voice_api.app.test_client().post('/api/debug/run')
+    assert response.status_code == 200
+    assert response.get_json()['fixes']['fixes_applied'] == ['port_5001']
+    assert bot.runs == 1
+
+
+def test_concurrent_first_requests_share_one_bot(monkeypatch):
+    from backend import voice_api
+
+    created = []
+
+    class SlowBot:
+        def __init__(self):
+            created.append(self)
+            time.sleep(0.05)
+
+    monkeypatch.setattr(debug_bot, 'DebugBot', SlowBot)
+    monkeypatch.setattr(voice_api, '_debug_bot', None)
+    bots = []
+    threads = [threading.Thread(target=lambda: bots.append(voice_api.get_debug_bot())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1
+    assert all(bot is created[0] for bot in bots)
@@ -0,0 +1,52 @@
+import csv
+import threading
+
+from backend.debug_history import DiagnosticHistory, COLUMNS
+
+
+def record(resolution='port_fix'):
+    return {'timestamp': '2026-01-01T00:00:00', 'port_conflicts': 1, 'asterisk_issues': 0,
+            'syntax_errors': 0, 'had_error': 1, 'resolution_type': resolution, 'success': 1}
+
+
+def test_batch_is_written_when_full(tmp_path):
+    writes = []
+    history = DiagnosticHistory(str(tmp_path / 'h.sqlite3'), batch_size=3, flush_seconds=60,
+                                on_write=lambda: writes.append(1))
+    assert [history.append(record()) for _ in range(3)] == [False, False, True]
+    assert history.count() == 3
+    assert writes == [1]
+
+
+def test_timer_writes_a_partial_batch_and_reports_it(tmp_path):
+    written = threading.Event()
+    history = DiagnosticHistory(str(tmp_path / 'h.sqlite3'), batch_size=100, flush_seconds=0.05,
+                                on_write=written.set)
+    assert history.append(record()) is False
+    assert written.wait(2)
+    assert history.count() == 1
+
+
+def test_read_since_returns_only_new_rows(tmp_path):
+    history = DiagnosticHistory(str(tmp_path / 'h.sqlite3'), batch_size=1)
+    for resolution in ('port_fix', 'syntax_fix', 'config_fix'):
+        history.append(record(resolution))
+    ids, features, resolutions = history.read_since(1)
+    assert list(ids) == [2, 3]
+    assert features.shape == (2, 4)
+    assert resolutions == ['syntax_fix', 'config_fix']
+
+
+def test_legacy_csv_is_imported_once(tmp_path):
+    with open(tmp_path / 'debug_history.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+        writer.writerows(record() for _ in range(5))
+
+    first = DiagnosticHistory(str(tmp_path / 'h.sqlite3'))
+    assert first.count() == 5
+    assert (tmp_path / 'debug_history.csv.imported').exists()
+
+    # A file put back later is not imported a second time
+    (tmp_path / 'debug_history.csv.imported').rename(tmp_path / 'debug_history.csv')
+    assert DiagnosticHistory(str(tmp_path / 'h.sqlite3')).count() == 5
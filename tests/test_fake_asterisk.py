@@ -0,0 +1,34 @@
+import pytest
+
+from backend.fake_asterisk import FakeAMIServer, FAILURE_STAGES
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+
+    def make(**kwargs):
+        server = FakeAMIServer(port=0, seed=1, **kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.server_close()
+
+
+def test_failures_apply_to_every_stage_by_default(make_server):
+    server = make_server(failure_rate=1.0)
+    assert all(server.should_fail(stage) for stage in FAILURE_STAGES)
+
+
+def test_failures_are_limited_to_the_chosen_stages(make_server):
+    server = make_server(failure_rate=1.0, fail_stages=['answer'])
+    assert server.should_fail('answer')
+    assert not server.should_fail('login')
+    assert not server.should_fail('originate')
+
+
+def test_unknown_stage_is_rejected(make_server):
+    with pytest.raises(ValueError):
+        make_server(failure_rate=0.5, fail_stages=['dial'])
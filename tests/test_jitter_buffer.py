@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from backend.jitter_buffer import (JitterBuffer, _simulate, CONCEAL_DECAY, MAX_CONCEALED_FRAMES,
+                                   JITTER_BUFFER_MIN_FRAMES, JITTER_BUFFER_MAX_FRAMES)
+from backend.media_stats import MediaStats
+
+SEEDS = range(5)
+FRAME_MS = 20
+# Network delay before the buffer; playout delay includes it
+NETWORK_MS = 30
+
+
+def phase_delays(result):
+    """Mean playout delay (ms) for the 2 ms, 25 ms and 5 ms jitter phases"""
+    return [delay for _, _, delay in result['phases']]
+
+
+def phase_targets(result):
+    return [target for _, target, _ in result['phases']]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_adaptive_buffer_has_few_late_frames(seed):
+    result = _simulate(seed=seed, min_frames=JITTER_BUFFER_MIN_FRAMES,
+                       max_frames=JITTER_BUFFER_MAX_FRAMES)
+    assert result['late'] <= 0.005 * result['sent']
+    assert result['played'] + result['concealed'] >= result['sent']
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_adaptive_buffer_tracks_jitter(seed):
+    result = _simulate(seed=seed, min_frames=JITTER_BUFFER_MIN_FRAMES,
+                       max_frames=JITTER_BUFFER_MAX_FRAMES)
+    calm, jittery, settled = phase_delays(result)
+    calm_target, jittery_target, settled_target = phase_targets(result)
+
+    # Low delay while the network is calm: about one frame past the network delay
+    assert calm <= NETWORK_MS + 3 * FRAME_MS
+    # Deeper while jitter is high, then shrinking again once it settles
+    assert jittery_target > calm_target + 2
+    assert calm < settled < jittery
+    assert settled_target < jittery_target
+    # Never beyond the configured ceiling
+    assert jittery <= NETWORK_MS + (JITTER_BUFFER_MAX_FRAMES + 1) * FRAME_MS
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_fixed_shallow_buffer_is_fast_but_late(seed):
+    result = _simulate(seed=seed, min_frames=1, max_frames=1)
+    assert all(delay <= NETWORK_MS + 3 * FRAME_MS for delay in phase_delays(result))
+    assert phase_targets(result) == [1.0, 1.0, 1.0]
+    assert result['late'] >= 0.02 * result['sent']
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_fixed_deep_buffer_is_on_time_but_slow(seed):
+    result = _simulate(seed=seed, min_frames=6, max_frames=6)
+    assert result['late'] <= 0.005 * result['sent']
+    for delay in phase_delays(result):
+        assert 6 * FRAME_MS <= delay <= NETWORK_MS + 8 * FRAME_MS
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_adaptive_beats_both_fixed_depths(seed):
+    adaptive = _simulate(seed=seed, min_frames=JITTER_BUFFER_MIN_FRAMES,
+                         max_frames=JITTER_BUFFER_MAX_FRAMES)
+    shallow = _simulate(seed=seed, min_frames=1, max_frames=1)
+    deep = _simulate(seed=seed, min_frames=6, max_frames=6)
+
+    assert adaptive['late'] * 5 < shallow['late']
+    # Cheaper than a fixed deep buffer whenever the network allows it
+    assert phase_delays(adaptive)[0] < phase_delays(deep)[0] - 50
+    assert phase_delays(adaptive)[2] < phase_delays(deep)[2]
+
+
+def frame(value, samples=160):
+    return np.full(samples, value, dtype=np.float32)
+
+
+def arrival(timestamp, delay=0.03):
+    # Constant network delay: no measured jitter, so the target stays at one frame
+    return timestamp / 8000.0 + delay
+
+
+def test_out_of_order_frames_are_played_in_timestamp_order():
+    buffer = JitterBuffer(160, 8000, min_frames=1, max_frames=4)
+    assert buffer.put(160, frame(0.2), now=arrival(0))
+    assert buffer.put(0, frame(0.1), now=arrival(0) + 0.001)
+
+    played = [buffer.get(1.0)[0][0] for _ in range(2)]
+    assert played == pytest.approx([0.1, 0.2])
+    assert buffer.summary()['reordered'] == 1
+
+
+def test_duplicate_frame_is_dropped():
+    stats = MediaStats().open_session('call')
+    buffer = JitterBuffer(160, 8000, stats=stats)
+    assert buffer.put(0, frame(0.1), now=arrival(0))
+    assert not buffer.put(0, frame(0.9), now=arrival(0))
+
+    samples, when = buffer.get(1.0)
+    assert samples[0] == pytest.approx(0.1)
+    assert when == arrival(0)
+    assert stats.counters['duplicate_frames'] == 1
+
+
+def test_frame_after_its_playout_time_is_dropped_and_grows_the_buffer():
+    stats = MediaStats().open_session('call')
+    buffer = JitterBuffer(160, 8000, stats=stats, min_frames=1, max_frames=4)
+    buffer.put(0, frame(0.4), now=arrival(0))
+    buffer.put(320, frame(0.3), now=arrival(320))
+    assert buffer.get(1.0)[0][0] == pytest.approx(0.4)
+
+    # 160 is missing when due: concealed from the last frame, playout moves on
+    samples, when = buffer.get(1.0)
+    assert when is None
+    assert samples[0] == pytest.approx(0.4 * CONCEAL_DECAY)
+
+    target = buffer.target
+    assert not buffer.put(160, frame(0.2), now=arrival(320))
+    assert buffer.late == 1
+    assert buffer.target > target
+    assert stats.counters['discarded_late_frames'] == 1
+    assert buffer.get(1.0)[0][0] == pytest.approx(0.3)
+
+
+def test_concealment_fades_to_silence():
+    stats = MediaStats().open_session('call')
+    buffer = JitterBuffer(160, 8000, stats=stats)
+    buffer.put(0, frame(0.8), now=arrival(0))
+    buffer.get(1.0)
+
+    levels = [buffer.get(1.0)[0][0] for _ in range(MAX_CONCEALED_FRAMES + 1)]
+    expected = [0.8 * CONCEAL_DECAY ** n for n in range(1, MAX_CONCEALED_FRAMES + 1)] + [0.0]
+    assert levels == pytest.approx(expected)
+    assert buffer.summary()['concealed'] == MAX_CONCEALED_FRAMES + 1
+    assert stats.counters['concealed_frames'] == MAX_CONCEALED_FRAMES + 1
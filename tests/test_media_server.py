@@ -0,0 +1,149 @@
+import time
+import uuid
+import socket
+import struct
+import threading
+
+import numpy as np
+import pytest
+
+from backend.batch_dsp import BatchScheduler
+from backend.media_server import MediaServer
+from backend.media_stats import MediaStats
+
+FRAME_BYTES = 320
+VOICE_PARAMS = {'pitch': -3}
+
+
+@pytest.fixture
+def server():
+    stats = MediaStats()
+    resolved = []
+
+    def resolve_voice(voice_id):
+        resolved.append(voice_id)
+        return VOICE_PARAMS
+
+    server = MediaServer(resolve_voice, host='127.0.0.1', port=0,
+                         scheduler=BatchScheduler(stats=stats))
+    server.media_stats = stats
+    server.resolved = resolved
+    threading.Thread(target=server.start, daemon=True).start()
+    assert server.ready.wait(2) and server.running
+    yield server
+    server.stop()
+
+
+def message(kind, payload=b''):
+    return struct.pack('>BH', kind, len(payload)) + payload
+
+
+def recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        assert chunk, 'connection closed'
+        data += chunk
+    return data
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def tone(frames):
+    t = np.arange(frames * FRAME_BYTES // 2) / 8000.0
+    return (np.sin(2 * np.pi * 220 * t) * 8000).astype('<i2').tobytes()
+
+
+def test_call_is_transformed_in_its_bound_voice(server):
+    call = uuid.uuid4()
+    server.bind(str(call), 'voice-7')
+    audio = tone(50)
+
+    with socket.create_connection(('127.0.0.1', server.port)) as sock:
+        sock.sendall(message(0x01, call.bytes))
+        replies = []
+        for i in range(50):
+            sock.sendall(message(0x10, audio[i * FRAME_BYTES:(i + 1) * FRAME_BYTES]))
+            kind, length = struct.unpack('>BH', recv_exact(sock, 3))
+            assert (kind, length) == (0x10, FRAME_BYTES)
+            replies.append(recv_exact(sock, length))
+            time.sleep(0.02)
+        assert server.scheduler.stats()['sessions'] == 1
+        sock.sendall(message(0x00))
+
+    wait_for(lambda: server.scheduler.stats()['sessions'] == 0)
+    assert server.resolved == ['voice-7']
+    assert any(np.frombuffer(reply, '<i2').any() for reply in replies)
+    summary = server.media_stats.snapshot()['by_voice']['voice-7']
+    assert summary['sessions'] == 1
+    assert summary['frames'] > 0
+
+
+def test_odd_sized_audio_is_split_into_frames(server):
+    call = uuid.uuid4()
+    server.bind(str(call), 'voice-7')
+
+    with socket.create_connection(('127.0.0.1', server.port)) as sock:
+        sock.sendall(message(0x01, call.bytes))
+        # Three frames' worth in two messages that split a frame
+        audio = tone(3)
+        sock.sendall(message(0x10, audio[:400]) + message(0x10, audio[400:]))
+        for _ in range(3):
+            assert struct.unpack('>BH', recv_exact(sock, 3)) == (0x10, FRAME_BYTES)
+            recv_exact(sock, FRAME_BYTES)
+
+
+def test_burst_is_buffered_rather_than_dropped(server):
+    call = uuid.uuid4()
+    server.bind(str(call), 'voice-7')
+
+    with socket.create_connection(('127.0.0.1', server.port)) as sock:
+        sock.sendall(message(0x01, call.bytes))
+        audio = tone(5)
+        sock.sendall(b''.join(message(0x10, audio[i * FRAME_BYTES:(i + 1) * FRAME_BYTES])
+                              for i in range(5)))
+        for _ in range(5):
+            recv_exact(sock, 3 + FRAME_BYTES)
+        sock.sendall(message(0x00))
+
+    wait_for(lambda: server.scheduler.stats()['sessions'] == 0)
+    summary = server.media_stats.snapshot()['by_voice']['voice-7']
+    assert summary['frames'] == 5
+    assert summary['duplicate_frames'] == 0
+
+
+def test_unbound_call_and_invalid_uuid(server):
+    with pytest.raises(ValueError):
+        server.bind('not-a-uuid', 'voice-7')
+
+    with socket.create_connection(('127.0.0.1', server.port)) as sock:
+        sock.sendall(message(0x01, uuid.uuid4().bytes))
+        sock.sendall(message(0x10, tone(1)))
+        assert struct.unpack('>BH', recv_exact(sock, 3)) == (0x10, FRAME_BYTES)
+    assert server.resolved == []
+
+
+def test_agi_session_binds_the_voice(server):
+    from backend.agi_server import AGIServer
+
+    agi = AGIServer(media_server=server)
+    call = str(uuid.uuid4())
+    ours, theirs = socket.socketpair()
+    handler = threading.Thread(target=agi.handle_client, args=(theirs, 'test'))
+    handler.start()
+    ours.sendall(f'agi_arg_1: voice-3\nagi_arg_2: {call}\n\n'.encode())
+    reader = ours.makefile('r')
+    assert reader.readline().strip() == '200 status=ready'
+    ours.sendall(b'EXEC VoiceTransform "voice-4" "bogus"\n')
+    assert reader.readline().strip() == '200 result=-1'
+    ours.sendall(b'HANGUP\n')
+    assert reader.readline().strip() == '200 result=1'
+    handler.join(2)
+    ours.close()
+
+    assert server._take_binding(call) == 'voice-3'
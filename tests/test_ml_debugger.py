@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from backend import ml_debugger
+from backend.debug_history import DiagnosticHistory
+from backend.ml_debugger import MLDebugger, RESOLUTION_TYPES, DEBUG_MODEL_KEEP_VERSIONS
+
+PORT_ISSUE = {'status': 'error', 'port_conflicts': [{}, {}]}
+SYNTAX_ISSUE = {'status': 'error', 'syntax_errors': [{}, {}]}
+
+
+def debugger(tmp_path):
+    history = DiagnosticHistory(str(tmp_path / 'history.sqlite3'), batch_size=1000, flush_seconds=60)
+    debugger = MLDebugger(str(tmp_path / 'models'), history)
+    history.on_write = None  # Trained explicitly below
+    debugger.reload_model()
+    return debugger
+
+
+def record(debugger, rounds=50):
+    for _ in range(rounds):
+        debugger.save_diagnostic_record(PORT_ISSUE, 'port_fix', True)
+        debugger.save_diagnostic_record(SYNTAX_ISSUE, 'syntax_fix', True)
+        debugger.save_diagnostic_record({'status': 'ok'}, 'auto_fix', False)
+
+
+def bundle_files(debugger):
+    return sorted(name for name in os.listdir(debugger.model_dir) if name.startswith('debug_model-'))
+
+
+def test_model_survives_a_restart(tmp_path):
+    first = debugger(tmp_path)
+    record(first)
+    assert first.train_model() == 150
+    assert first.predict_resolution(PORT_ISSUE) == 'port_fix'
+
+    restarted = debugger(tmp_path)
+    assert restarted.bundle['version'] == 1
+    assert list(restarted.bundle['label_encoder'].classes_) == list(RESOLUTION_TYPES)
+    assert restarted.predict_resolution(PORT_ISSUE) == 'port_fix'
+    assert restarted.predict_resolution(SYNTAX_ISSUE) == 'syntax_fix'
+    # Nothing new to learn from after the restart
+    assert restarted.train_model() == 0
+
+
+def test_failed_publish_leaves_the_current_bundle(tmp_path, monkeypatch):
+    trainer = debugger(tmp_path)
+    record(trainer)
+    trainer.train_model()
+
+    def partial_dump(bundle, path):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('disk full')
+
+    record(trainer, rounds=1)
+    monkeypatch.setattr(ml_debugger.joblib, 'dump', partial_dump)
+    with pytest.raises(OSError):
+        trainer.train_model()
+
+    assert bundle_files(trainer) == ['debug_model-v1.joblib']
+    assert debugger(tmp_path).bundle['version'] == 1
+
+
+def test_old_versions_are_pruned(tmp_path):
+    trainer = debugger(tmp_path)
+    for _ in range(DEBUG_MODEL_KEEP_VERSIONS + 2):
+        record(trainer, rounds=1)
+        trainer.train_model()
+
+    latest = DEBUG_MODEL_KEEP_VERSIONS + 2
+    assert bundle_files(trainer) == [f'debug_model-v{version}.joblib'
+                                     for version in range(latest - DEBUG_MODEL_KEEP_VERSIONS + 1, latest + 1)]
+    with open(trainer.pointer_path) as f:
+        assert f.read() == f'debug_model-v{latest}.joblib'
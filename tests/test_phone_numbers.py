@@ -0,0 +1,152 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from backend import models
+from backend import phone_numbers
+from backend.phone_numbers import PhoneNumberManager, NumberPoolExhausted
+
+
+def row(user_id, country='US', number='+12025550100'):
+    return {'number': number, 'country': country, 'platform': 'asterisk',
+            'assigned_at': datetime(2026, 1, 1), 'user_id': user_id}
+
+
+@pytest.fixture
+def inventory(monkeypatch):
+    """Stubs the models layer: `results` feeds allocate_virtual_number, `free` the free counts"""
+    state = {'results': [], 'free': 0, 'allocations': 0}
+
+    def allocate_virtual_number(user_id, country_code):
+        state['allocations'] += 1
+        return state['results'].pop(0) if state['results'] else None
+
+    monkeypatch.setattr(models, 'create_virtual_numbers_table', lambda: True)
+    monkeypatch.setattr(models, 'allocate_virtual_number', allocate_virtual_number)
+    monkeypatch.setattr(models, 'count_free_virtual_numbers',
+                        lambda country_code: {country_code: state['free']})
+    monkeypatch.setattr(phone_numbers.time, 'sleep', lambda seconds: None)
+    return state
+
+
+def test_exhausted_pool_raises(inventory):
+    with pytest.raises(NumberPoolExhausted):
+        PhoneNumberManager().assign_number_to_user('u1', 'US')
+    assert inventory['allocations'] == 1
+
+
+def test_empty_skip_locked_result_is_retried(inventory):
+    # Every free row was locked by another allocation on the first attempt
+    inventory['results'] = [None, row('u1')]
+    inventory['free'] = 3
+    assigned = PhoneNumberManager().assign_number_to_user('u1', 'US')
+    assert assigned['number'] == '+12025550100'
+    assert assigned['assigned_at'] == '2026-01-01T00:00:00'
+    assert inventory['allocations'] == 2
+
+
+def test_allocation_gives_up_after_the_attempt_limit(inventory):
+    inventory['free'] = 3
+    with pytest.raises(Exception, match='Could not allocate'):
+        PhoneNumberManager().assign_number_to_user('u1', 'US')
+    assert inventory['allocations'] == phone_numbers.NUMBERS_ALLOCATE_ATTEMPTS
+
+
+def test_generate_route_answers_409_when_exhausted(inventory):
+    from backend import voice_api
+
+    response = voice_api.app.test_client().post('/api/numbers/generate',
+                                                json={'user_id': 'u1', 'country': 'US'})
+    assert response.status_code == 409
+
+
+def test_user_numbers_route_answers_503_on_read_error(inventory, monkeypatch):
+    from backend import voice_api
+
+    monkeypatch.setattr(models, 'get_user_virtual_numbers', lambda user_id: None)
+    response = voice_api.app.test_client().get('/api/numbers/user/u1')
+    assert response.status_code == 503
+
+    monkeypatch.setattr(models, 'get_user_virtual_numbers', lambda user_id: [row(user_id)])
+    response = voice_api.app.test_client().get('/api/numbers/user/u1')
+    assert response.status_code == 200
+    assert response.get_json()['numbers'][0]['user_id'] == 'u1'
+
+
+@pytest.fixture
+def bulk(monkeypatch):
+    """Bulk route with assign_numbers_bulk stubbed; `calls` records its arguments"""
+    from backend import voice_api
+
+    calls = []
+    state = {'shortages': {}}
+
+    def assign_numbers_bulk(assignments, allow_partial=False):
+        calls.append((assignments, allow_partial))
+        shortages = state['shortages']
+        if shortages and not allow_partial:
+            raise NumberPoolExhausted('Not enough free virtual numbers', shortages)
+        # Short countries hand out only what they have, in request order
+        left = {country: available for country, (_, available) in shortages.items()}
+        assigned = []
+        for user_id, country in assignments:
+            if country in left:
+                if not left[country]:
+                    continue
+                left[country] -= 1
+            assigned.append(PhoneNumberManager._format_assignment(None, row(user_id, country)))
+        return assigned, shortages
+
+    monkeypatch.setattr(voice_api.phone_number_manager, 'assign_numbers_bulk', assign_numbers_bulk)
+    client = voice_api.app.test_client()
+    client.calls = calls
+    client.state = state
+    return client
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    {'user_ids': 'u1'},
+    {'assignments': {'user_id': 'u1'}},
+    {'user_ids': []},
+    {'user_ids': ['u1', 7]},
+    {'assignments': [{'user_id': 'u1'}, 'u2']},
+    {'assignments': [{'user_id': 'u1', 'country': 44}]},
+])
+def test_bulk_rejects_malformed_bodies(bulk, body):
+    assert bulk.post('/api/numbers/bulk', json=body).status_code == 400
+    assert bulk.calls == []
+
+
+def test_bulk_rejects_oversized_requests(bulk, monkeypatch):
+    from backend import voice_api
+
+    monkeypatch.setattr(voice_api, 'NUMBERS_BULK_MAX', 2)
+    response = bulk.post('/api/numbers/bulk', json={'user_ids': ['u1', 'u2', 'u3']})
+    assert response.status_code == 413
+    assert bulk.calls == []
+
+
+def test_bulk_shortage_answers_409(bulk):
+    bulk.state['shortages'] = {'UK': (2, 1)}
+    response = bulk.post('/api/numbers/bulk', json={
+        'assignments': [{'user_id': 'u1', 'country': 'UK'}, {'user_id': 'u2', 'country': 'UK'}]})
+    assert response.status_code == 409
+    assert response.get_json()['exhausted'] == {'UK': {'requested': 2, 'available': 1}}
+
+
+def test_bulk_streams_assignments_shortages_and_summary(bulk):
+    bulk.state['shortages'] = {'UK': (2, 1)}
+    response = bulk.post('/api/numbers/bulk', json={
+        'country': 'US', 'allow_partial': True,
+        'assignments': [{'user_id': 'u1'}, {'user_id': 'u2', 'country': 'UK'},
+                        {'user_id': 'u3', 'country': 'UK'}]})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert [(line['user_id'], line['country']) for line in lines[:2]] == [('u1', 'US'), ('u2', 'UK')]
+    assert lines[2] == {'country': 'UK', 'error': 'pool_exhausted', 'requested': 2, 'assigned': 1}
+    assert lines[3] == {'summary': {'requested': 3, 'assigned': 2}}
+    assert bulk.calls == [([('u1', 'US'), ('u2', 'UK'), ('u3', 'UK')], True)]
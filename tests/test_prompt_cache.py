@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from backend import prompt_cache
+from backend.prompt_cache import PromptCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    sounds = tmp_path / 'sounds' / 'custom'
+    sounds.mkdir(parents=True)
+    (sounds / 'greeting.sln').write_bytes(b'\x01\x00' * 800)
+    (sounds / 'empty.sln').write_bytes(b'')
+    return PromptCache(cache_dir=str(tmp_path / 'cache'), source_dir=str(tmp_path / 'sounds'))
+
+
+def identity(pcm, sample_rate):
+    return pcm
+
+
+def test_cache_dir_does_not_depend_on_the_working_directory():
+    assert os.path.isabs(prompt_cache.PROMPT_CACHE_DIR) or 'PROMPT_CACHE_DIR' in os.environ
+
+
+def test_render_is_cached_and_mapped(cache):
+    path = cache.get('custom/greeting', {'pitch': -3}, identity)
+    assert cache.get('custom/greeting', {'pitch': -3}, identity) == path
+    assert cache.stats()['hits'] == 1
+
+    mapped, samples = cache.read_samples(path)
+    try:
+        assert len(samples) == 1600
+    finally:
+        samples.release()
+        mapped.close()
+
+
+def test_empty_render_reads_as_no_samples(cache):
+    path = cache.get('custom/empty', {}, identity)
+    mapped, samples = cache.read_samples(path)
+    assert mapped is None
+    assert len(samples) == 0
+
+
+def test_agi_serves_an_empty_prompt(cache):
+    from backend.agi_server import AGIServer
+
+    agi = AGIServer()
+    agi.prompt_cache = cache
+    agi.voice_processor.get_voice_parameters = lambda voice_id: {}
+    agi.voice_processor.transform_voice = lambda voice_id, pcm, sample_rate: pcm
+    response = agi._stream_file('STREAM FILE custom/empty ""', 'voice-1')
+    assert response.startswith('200 result=0 endpos=0 (')